@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Offline benchmark of the update pipeline. Synthetic feeds are served from a local HTTP server, fetched and expanded
+by CalHelper, rendered by the configured engine and packed and sent through display.epdsim, which stands in for
+epdconfig and counts the SPI bytes and GPIO toggles. Power management is never imported, so it runs on any Linux
+box. From the repository root:
+
+    python -m bench.bench --events 2000 --recurring 0.3 --runs 5
+
+Every run is recorded with the metrics layer of the device and the stage timings are summarised at the end.
+"""
+
+import argparse
+import datetime as dt
+import functools
+import http.server
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+
+from pytz import timezone
+
+from display import epdsim
+epdsim.install()  # before anything imports the real epdconfig
+
+import display.display as display
+import metrics.metrics as metrics
+from bench.synthetic import make_feed
+from cal.cal import CalHelper
+from render.native import NativeRenderHelper
+from render.render import RenderHelper
+
+STAGES = ('fetch', 'download', 'parse', 'expand', 'render', 'wkhtmltoimage', 'pack', 'upload', 'refresh')
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+WEATHER_IDS = [800, 801, 500, 211, 601, 741, 310]
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory):
+    # Serves the feed directory on a free port, Last-Modified/If-Modified-Since work as with a real feed
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_forecast(day):
+    return {day + dt.timedelta(days=i): {'high': 20 + i, 'low': 10 + i, 'pop': 10 * i, 'id': WEATHER_IDS[i]}
+            for i in range(len(WEATHER_IDS))}
+
+
+def run_once(args, feeds, workDir, tz):
+    cacheDir = os.path.join(workDir, 'cache')
+    if not args.warm:
+        shutil.rmtree(cacheDir, ignore_errors=True)
+        if os.path.exists(display.FRAME_FILE):
+            os.remove(display.FRAME_FILE)  # every stripe is uploaded and refreshed again
+
+    epdsim.reset()  # the panel is only initialised when a stripe changed, which is what resets the counts otherwise
+    metrics.begin(events=args.events, recurring=args.recurring, feeds=len(feeds), engine=args.engine,
+                  streaming=args.streaming, warm=args.warm)
+    currDatetime = dt.datetime.now(tz)
+    currDate = currDatetime.date()
+    calStartDate = currDate - dt.timedelta(days=((currDate.weekday() + (7 - args.weekStartDay)) % 7))
+    calEndDate = calStartDate + dt.timedelta(days=(5 * 7 - 1))
+    calStartDatetime = tz.localize(dt.datetime.combine(calStartDate, dt.datetime.min.time()))
+    calEndDatetime = tz.localize(dt.datetime.combine(calEndDate, dt.datetime.max.time()))
+
+    calService = CalHelper(streaming=args.streaming)
+    calService.cacheDir = cacheDir
+    with metrics.span('fetch'):
+        eventList = calService.retrieve_events(feeds, calStartDatetime, calEndDatetime, tz, 12)
+    metrics.count('events', len(eventList))
+
+    forecast = get_forecast(currDate)
+    calDict = {'events': eventList, 'calStartDate': calStartDate, 'today': currDate, 'lastRefresh': currDatetime,
+               'batteryLevel': 80, 'batteryDisplayMode': 1, 'dayOfWeekText': DAY_NAMES,
+               'weekStartDay': args.weekStartDay, 'maxEventsPerDay': args.maxEventsPerDay, 'forecast': forecast}
+    if args.engine == 'pillow':
+        renderService = NativeRenderHelper(args.imageWidth, args.imageHeight, args.rotateAngle)
+    else:
+        renderService = RenderHelper(args.imageWidth, args.imageHeight, args.rotateAngle)
+    with metrics.span('render'):
+        calBlackImage, calRedImage = renderService.render(calDict, forecast[currDate])
+
+    displayService = display.DisplayHelper(args.screenWidth, args.screenHeight)
+    displayService.update(calBlackImage, calRedImage)
+    displayService.sleep()
+    metrics.record('epd', dict(epdsim.stats))
+    return metrics.finish()
+
+
+def summarise(runs):
+    # Median, min and max per stage over all runs, then throughput figures of the median run. The feeds are
+    # fetched concurrently, so download, parse and expand add up the time of all feeds and can exceed fetch
+    print('{:<14}{:>10}{:>10}{:>10}{:>10}'.format('stage', 'median s', 'min s', 'max s', 'cpu s'))
+    for name in STAGES:
+        stages = [run['stages'][name] for run in runs if name in run['stages']]
+        if not stages:
+            continue
+        seconds = [stage['seconds'] for stage in stages]
+        print('{:<14}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}'.format(
+            name, statistics.median(seconds), min(seconds), max(seconds),
+            statistics.median(stage['cpuSeconds'] for stage in stages)))
+    totals = [run['seconds'] for run in runs]
+    print('{:<14}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}'.format(
+        'total', statistics.median(totals), min(totals), max(totals),
+        statistics.median(run['cpuSeconds'] + run['childCpuSeconds'] for run in runs)))
+
+    run = sorted(runs, key=lambda run: run['seconds'])[len(runs) // 2]
+    counters, stages = run['counters'], run['stages']
+    print()
+    print('events shown      {}'.format(counters.get('events', 0)))
+    if 'expand' in stages and stages['expand']['seconds']:
+        print('expanded          {} events, {:.0f} events/s'.format(
+            counters.get('eventsExpanded', 0), counters.get('eventsExpanded', 0) / stages['expand']['seconds']))
+    if 'download' in stages and counters.get('downloadBytes'):
+        print('downloaded        {:.2f} MB, {:.1f} MB/s'.format(
+            counters['downloadBytes'] / 1e6, counters['downloadBytes'] / 1e6 / stages['download']['seconds']))
+    if 'upload' in stages:
+        print('sent over SPI     {:.1f} kB in {} calls, {:.1f} MB/s'.format(
+            run['epd']['spi_bytes'] / 1e3, run['epd']['spi_calls'],
+            counters.get('spiBytes', 0) / 1e6 / max(stages['upload']['seconds'], 1e-9)))
+    print('GPIO              {} writes, {} toggles'.format(run['epd']['gpio_writes'], run['epd']['gpio_toggles']))
+    print('peak RSS          {:.1f} MB, children {:.1f} MB'.format(run['peakRssKb'] / 1024,
+                                                                  run['childPeakRssKb'] / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the calendar update without the Pi, PiSugar or panel')
+    parser.add_argument('--events', type=int, default=500, help='events per feed')
+    parser.add_argument('--recurring', type=float, default=0.2, help='share of the events that recur')
+    parser.add_argument('--feeds', type=int, default=2, help='number of feeds, every second one is shown in red')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--engine', choices=('html', 'pillow'), default='html')
+    parser.add_argument('--streaming', action='store_true', help='pre-filter the feeds like calendarStreaming')
+    parser.add_argument('--warm', action='store_true',
+                        help='keep the feed cache, event index and last frame between runs, as on the device')
+    parser.add_argument('--tz', default='Europe/London')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='append the runs as JSON lines to this file')
+    parser.add_argument('--verbose', action='store_true', help='show the einkcal log')
+    parser.add_argument('--weekStartDay', type=int, default=6)
+    parser.add_argument('--maxEventsPerDay', type=int, default=4)
+    parser.add_argument('--imageWidth', type=int, default=984)
+    parser.add_argument('--imageHeight', type=int, default=1304)
+    parser.add_argument('--rotateAngle', type=int, default=90)
+    parser.add_argument('--screenWidth', type=int, default=1304)
+    parser.add_argument('--screenHeight', type=int, default=984)
+    args = parser.parse_args()
+
+    logger = logging.getLogger('einkcal')
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO if args.verbose else logging.WARNING)
+    if args.engine == 'html' and shutil.which('wkhtmltoimage') is None:
+        parser.error('wkhtmltoimage is not installed, use --engine pillow')
+
+    tz = timezone(args.tz)
+    workDir = tempfile.mkdtemp(prefix='einkcal-bench-')
+    # The frame file and metrics of the device are left alone
+    display.FRAME_FILE = os.path.join(workDir, 'framebuffer.bin')
+    metrics.set_metrics_file(os.path.abspath(args.output) if args.output else os.path.join(workDir, 'runs.jsonl'))
+    feedDir = os.path.join(workDir, 'feeds')
+    os.makedirs(feedDir)
+    server = serve(feedDir)
+    try:
+        feeds = []
+        size = 0
+        for i in range(args.feeds):
+            data = make_feed(args.events, args.recurring, dt.date.today(), args.tz, seed=args.seed + i)
+            with open(os.path.join(feedDir, 'feed{}.ics'.format(i)), 'wb') as file:
+                file.write(data)
+            size += len(data)
+            feeds.append({'url': 'http://127.0.0.1:{}/feed{}.ics'.format(server.server_address[1], i),
+                          'color': 'red' if i % 2 else 'black', 'label': 'bench{}'.format(i)})
+        print('{} feeds of {} events, {:.0%} recurring, {:.2f} MB in total, {} engine{}{}'.format(
+            args.feeds, args.events, args.recurring, size / 1e6, args.engine,
+            ', streaming' if args.streaming else '', ', warm' if args.warm else ''))
+
+        runs = []
+        for i in range(args.runs):
+            run = run_once(args, feeds, workDir, tz)
+            print('run {}: {:.3f}s'.format(i + 1, run['seconds']))
+            runs.append(run)
+        print()
+        summarise(runs)
+    finally:
+        server.shutdown()
+        shutil.rmtree(workDir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Generates reproducible iCalendar feeds for the benchmark. Events are spread over a year around a given day so the
+streaming filter and the expansion window have something to skip, and a share of them recur with daily, weekly
+or monthly rules, some of those with exceptions and moved occurrences.
+"""
+
+import datetime as dt
+import random
+
+SPREAD_DAYS = 180  # events start up to this many days before or after the reference day
+SUMMARIES = ['Standup', 'Dentist', 'Team lunch', 'Gym', 'Piano lesson', 'Flight to Lisbon', 'Quarterly review',
+             'Book club', 'School run', 'Yoga', 'Project sync', 'Birthday dinner', 'Car service', 'Football']
+RULES = ['FREQ=DAILY', 'FREQ=DAILY;INTERVAL=2', 'FREQ=WEEKLY', 'FREQ=WEEKLY;BYDAY=MO,WE,FR', 'FREQ=WEEKLY;INTERVAL=2',
+         'FREQ=MONTHLY', 'FREQ=MONTHLY;BYDAY=1TU', 'FREQ=YEARLY']
+
+
+def fold(line):
+    # Content lines are folded at 75 octets as RFC 5545 asks, continuation lines start with a space
+    data = line.encode('utf-8')
+    parts = []
+    while len(data) > 75:
+        cut = 75 if not parts else 74
+        while data[cut] & 0xc0 == 0x80:  # never split a multi-byte character
+            cut -= 1
+        parts.append(data[:cut])
+        data = data[cut:]
+    parts.append(data)
+    return b'\r\n '.join(parts) + b'\r\n'
+
+
+def local(value):
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def make_feed(events, recurringShare, day, tzName, seed=0, allDayShare=0.15, multiDayShare=0.05):
+    # Returns the feed as bytes. recurringShare is the fraction of the events that carry an RRULE
+    rng = random.Random(seed)
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//einkcal//bench//EN', 'CALSCALE:GREGORIAN']
+    stamp = 'DTSTAMP:' + local(dt.datetime(day.year, day.month, day.day)) + 'Z'
+    for i in range(events):
+        uid = 'bench-{}-{}@einkcal'.format(seed, i)
+        date = day + dt.timedelta(days=rng.randint(-SPREAD_DAYS, SPREAD_DAYS))
+        summary = '{} {}'.format(rng.choice(SUMMARIES), i)
+        lines += ['BEGIN:VEVENT', 'UID:' + uid, stamp, 'SUMMARY:' + summary]
+        kind = rng.random()
+        if kind < allDayShare:
+            length = rng.randint(2, 6) if rng.random() < multiDayShare / allDayShare else 1
+            lines.append('DTSTART;VALUE=DATE:' + date.strftime('%Y%m%d'))
+            lines.append('DTEND;VALUE=DATE:' + (date + dt.timedelta(days=length)).strftime('%Y%m%d'))
+        else:
+            start = dt.datetime.combine(date, dt.time(rng.randint(6, 20), rng.choice((0, 15, 30, 45))))
+            end = start + dt.timedelta(minutes=rng.choice((15, 30, 45, 60, 90, 120)))
+            lines.append('DTSTART;TZID={}:{}'.format(tzName, local(start)))
+            lines.append('DTEND;TZID={}:{}'.format(tzName, local(end)))
+        recurring = rng.random() < recurringShare
+        if recurring:
+            rule = rng.choice(RULES)
+            if rng.random() < 0.5:
+                rule += ';COUNT={}'.format(rng.randint(5, 120))
+            lines.append('RRULE:' + rule)
+        if rng.random() < 0.3:
+            lines.append('DESCRIPTION:' + ' '.join(rng.choice(SUMMARIES) for _ in range(rng.randint(5, 30))))
+        lines.append('END:VEVENT')
+        if recurring and kind >= allDayShare and rng.random() < 0.2:
+            # a moved occurrence of the first repeat, matched by RECURRENCE-ID
+            moved = start + dt.timedelta(hours=1)
+            lines += ['BEGIN:VEVENT', 'UID:' + uid, stamp, 'SUMMARY:' + summary + ' (moved)',
+                      'RECURRENCE-ID;TZID={}:{}'.format(tzName, local(start)),
+                      'DTSTART;TZID={}:{}'.format(tzName, local(moved)),
+                      'DTEND;TZID={}:{}'.format(tzName, local(moved + (end - start))), 'END:VEVENT']
+    lines.append('END:VCALENDAR')
+    return b''.join(fold(line) for line in lines)
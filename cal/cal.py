@@ -2,15 +2,35 @@
 # -*- coding: utf-8 -*-
 
 import requests
-from icalendar import Calendar
 from pytz import timezone
-import recurring_ical_events
 import datetime
+import hashlib
+import heapq
+import json
 import logging
+import os
+import pathlib
+import pickle
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cal.clock import LocalClock
+from cal.event import Event, RED, pack_events, unpack_events
+import metrics.metrics as metrics
+# icalendar and recurring_ical_events are imported by the stages that parse and expand a feed, so runs served
+# from the event index never load them
+
+INDEX_VERSION = 2  # bump when the layout of the expanded event records changes
+LOOKAHEAD_DAYS = 14  # days expanded past the display window, covers the weekly shift of the window
 
 class CalHelper:
-    def __init__(self):
+    def __init__(self, streaming=False):
         self.logger = logging.getLogger('einkcal')
+        self.streaming = streaming  # pre-filter the feed line by line and only parse events near the window
+        self.cacheDir = str(pathlib.Path(__file__).parent.absolute()) + '/cache'
+        self.stale = False  # set when the events come from a cached feed because the download failed
+        self.session = None  # pooled connections, kept for the next refresh when the helper stays alive
+        self.indexes = {}  # index file -> (feed file signature, feed hash, index) of the events expanded so far
 
     def retry_strategy(self):
         return requests.adapters.Retry(
@@ -20,21 +40,10 @@ class CalHelper:
             allowed_methods=None,
         )
 
-    def get_datetime(self, date, localTZ, offset=0):
-        allDayEvent = False
-        if isinstance(date, datetime.date) and not isinstance(date, datetime.datetime):
-            allDayEvent = True
-            dt_obj = datetime.datetime(date.year, date.month, date.day) + datetime.timedelta(days=offset)
-            dt_obj = localTZ.localize(dt_obj)
-        else:
-            if date.tzinfo is None:
-                dt_obj = localTZ.localize(date)
-            else:
-                dt_obj = date.astimezone(localTZ)
-        return dt_obj, allDayEvent
-
-    def is_multiday(self, start, end):
-        return start.date() != end.date()
+    def get_datetime(self, date, clock, offset=0):
+        # (epoch seconds, local day ordinal, local start minute, all day) of a DTSTART/DTEND value, converted by
+        # the clock of the expansion window instead of a pytz localize or astimezone per occurrence
+        return clock.convert(date, offset)
 
     def _has_mixed_naive_aware(self, event):
         dtstart_prop = event.get("DTSTART")
@@ -52,7 +61,8 @@ class CalHelper:
         end_naive = (end.tzinfo is None)
         return start_naive != end_naive  # one naive, one aware
 
-    def strip_bad_series(self, cal: Calendar):
+    def strip_bad_series(self, cal: 'Calendar'):
+        from icalendar import Calendar
         bad_uids = set()
         bad_events = []
         for event in cal.walk("VEVENT"):
@@ -81,30 +91,176 @@ class CalHelper:
             new_cal.add_component(component)
         return new_cal, bad_events
 
-    def retrieve_events(self, calendar, startDate, endDate, localTZ, thresholdHours):
-        session = requests.Session()
-        adapter = requests.adapters.HTTPAdapter(max_retries=self.retry_strategy())
-        session.mount("https://", adapter)
-        session.mount("http://", adapter)
+    def cache_paths(self, calendar):
+        key = hashlib.sha1(calendar.encode('utf-8')).hexdigest()
+        return self.cacheDir + '/' + key + '.ics', self.cacheDir + '/' + key + '.json'
+
+    def fetch_feed(self, session, calendar):
+        # Downloads the feed into the on-disk cache and returns the cached file, or None when nothing is available.
+        # The request is conditional on the cached ETag/Last-Modified, a 304 or a network failure reuses the cache
+        bodyFile, metaFile = self.cache_paths(calendar)
+        meta = {}
+        if os.path.exists(bodyFile) and os.path.exists(metaFile):
+            try:
+                with open(metaFile, 'r') as file:
+                    meta = json.load(file)
+            except ValueError:
+                meta = {}
+        headers = {'Accept-Encoding': 'gzip'}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('lastModified'):
+            headers['If-Modified-Since'] = meta['lastModified']
         try:
-            r = session.get(calendar, timeout=10)
-            r.raise_for_status()
+            # the response is closed on every path, so its connection goes back to the pool of a long-lived session
+            with session.get(calendar, headers=headers, timeout=10, stream=True) as r:
+                if r.status_code == 304 and meta:
+                    self.logger.info("Calendar not modified since {}, using cached copy".format(meta.get('fetched')))
+                    return bodyFile
+                r.raise_for_status()
+                # streamed to disk so a large feed is never held in memory as a whole
+                os.makedirs(self.cacheDir, exist_ok=True)
+                with open(bodyFile + '.tmp', 'wb') as file:
+                    for chunk in r.iter_content(chunk_size=1 << 16):
+                        file.write(chunk)
         except requests.RequestException as e:
+            if meta:
+                self.logger.error(f"Error fetching calendar, using cached copy from {meta.get('fetched')}: {e}")
+                self.stale = True
+                return bodyFile
             self.logger.error(f"Error fetching calendar: {e}")
-            return []
+            return None
+        os.replace(bodyFile + '.tmp', bodyFile)
+        metrics.count('downloadBytes', os.path.getsize(bodyFile))
+        with open(metaFile, 'w') as file:
+            json.dump({'url': calendar, 'etag': r.headers.get('ETag'), 'lastModified': r.headers.get('Last-Modified'),
+                       'fetched': datetime.datetime.now().isoformat()}, file)
+        return bodyFile
+
+    def split_property(self, line):
+        # Splits an unfolded content line into its name and value, colons inside quoted parameters are skipped
+        quoted = False
+        for i, char in enumerate(line):
+            if char == 0x22:
+                quoted = not quoted
+            elif char == 0x3a and not quoted:
+                return re.split(rb'[;:]', line[:i + 1], maxsplit=1)[0].upper(), line[i + 1:]
+        return line.upper(), b''
+
+    def properties(self, lines):
+        # (name, value) of every content line, folded continuation lines joined first
+        logical = b''
+        for raw in lines:
+            if raw[:1] in (b' ', b'\t'):
+                logical += raw.rstrip(b'\r\n')[1:]
+                continue
+            if logical:
+                yield self.split_property(logical)
+            logical = raw.rstrip(b'\r\n')
+        if logical:
+            yield self.split_property(logical)
+
+    def value_date(self, value):
         try:
-            cal = Calendar.from_ical(r.content)
+            return datetime.date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+        except ValueError:
+            return None
+
+    def in_window(self, props, startDate, endDate):
+        # Cheap overlap test on the raw DTSTART/DTEND/DURATION/RRULE/RECURRENCE-ID values of one VEVENT.
+        # Anything that cannot be decided from them is kept, one day of slack covers timezone offsets
+        first = startDate.date() - datetime.timedelta(days=1)
+        last = endDate.date() + datetime.timedelta(days=1)
+        start = self.value_date(props.get(b'DTSTART', b''))
+        if start is None or b'RDATE' in props:
+            return True
+        if b'RRULE' in props:
+            until = re.search(rb'UNTIL=(\d{8})', props[b'RRULE'])
+            return until is None or self.value_date(until.group(1)) is None or self.value_date(until.group(1)) >= first
+        if b'DTEND' in props:
+            end = self.value_date(props[b'DTEND'])
+        elif b'DURATION' in props:
+            duration = re.match(rb'[+-]?P(?:(\d+)W)?(?:(\d+)D)?', props[b'DURATION'])
+            days = int(duration.group(1) or 0) * 7 + int(duration.group(2) or 0) + 1 if duration else None
+            end = start + datetime.timedelta(days=days) if days is not None else None
+        else:
+            end = start
+        if end is None:
+            return True
+        inWindow = start <= last and end >= first
+        if not inWindow and b'RECURRENCE-ID' in props:
+            # an override moved out of the window still has to cancel the occurrence it replaces
+            recurrence = self.value_date(props[b'RECURRENCE-ID'])
+            inWindow = recurrence is None or first <= recurrence <= last
+        return inWindow
+
+    def filter_feed(self, file, startDate, endDate):
+        # Streams the feed line by line and keeps everything except VEVENTs that cannot overlap the window,
+        # so only the relevant part of a large feed is ever parsed into an icalendar tree
+        kept = []
+        component = None
+        skipped = 0
+        for line in file:
+            stripped = line.rstrip(b'\r\n')
+            if component is None:
+                if stripped.upper() == b'BEGIN:VEVENT':
+                    component = [line]
+                else:
+                    kept.append(line)
+                continue
+            component.append(line)
+            if stripped.upper() != b'END:VEVENT':
+                continue
+            props = {}
+            nested = 0  # inside a VALARM, whose DURATION or TRIGGER must not be taken for the event's
+            for name, value in self.properties(component[1:-1]):
+                if name == b'BEGIN':
+                    nested += 1
+                elif name == b'END':
+                    nested -= 1
+                elif not nested:
+                    props.setdefault(name, value)
+            if self.in_window(props, startDate, endDate):
+                kept.extend(component)
+            else:
+                skipped += 1
+            component = None
+        self.logger.info("Streaming parse skipped {} events outside the window".format(skipped))
+        return b''.join(kept)
+
+    def parse_feed(self, bodyFile, startDate, endDate):
+        with metrics.importing('icalendar'):
+            from icalendar import Calendar
+        try:
+            with open(bodyFile, 'rb') as file:
+                if self.streaming:
+                    cal = Calendar.from_ical(self.filter_feed(file, startDate, endDate))
+                else:
+                    cal = Calendar.from_ical(file.read())
         except Exception as e:
             self.logger.error(f"Error parsing iCal data: {e}")
-            return []
+            return None
+        return self.strip_bad_series(cal)
+
+    def expand_events(self, cal, bad_events, startDate, endDate, localTZ):
+        # Expands recurrences and normalises every occurrence overlapping [startDate, endDate] into an event dict
+        with metrics.span('expand'):
+            events = self.expand_occurrences(cal, bad_events, startDate, endDate, localTZ)
+        metrics.count('eventsExpanded', len(events))
+        return events
+
+    def expand_occurrences(self, cal, bad_events, startDate, endDate, localTZ):
+        with metrics.importing('recurring_ical_events'):
+            import recurring_ical_events
         events = []
-        cal, bad_events = self.strip_bad_series(cal)
         try:
             occurrences = list(recurring_ical_events.of(cal).between(startDate, endDate))
         except Exception as e:
             self.logger.error(f"Error expanding recurring events: {e}")
             occurrences = list(cal.walk("VEVENT"))
         occurrences.extend(bad_events)
+        clock = LocalClock(localTZ, startDate, endDate)
+        windowStart, windowEnd = startDate.timestamp(), endDate.timestamp()
         for event in occurrences:
             status = str(event.get("STATUS", "CONFIRMED")).upper()
             if status == "CANCELLED":
@@ -132,11 +288,11 @@ class CalHelper:
             if dtend is None:
                 dtend = dtstart
             try:
-                start, allDayEventS = self.get_datetime(dtstart, localTZ)
-                end, allDayEventE = self.get_datetime(dtend, localTZ, offset=-1)
+                start, startDay, startMinute, allDayEventS = self.get_datetime(dtstart, clock)
+                end, endDay, _, allDayEventE = self.get_datetime(dtend, clock, offset=-1)
             except Exception:
                 continue
-            if end < startDate or start > endDate:
+            if end < windowStart or start > windowEnd:
                 continue
             summary_prop = event.get("SUMMARY")
             if summary_prop is not None:
@@ -146,13 +302,132 @@ class CalHelper:
                     summary = str(summary_prop)
             else:
                 summary = ""
-            events.append(
-                {
-                    "allday": allDayEventS or allDayEventE,
-                    "startDatetime": start,
-                    "endDatetime": end,
-                    "isMultiday": self.is_multiday(start, end),
-                    "summary": summary,
-                }
-            )
-        return sorted(events, key=lambda x: x["startDatetime"])
+            events.append(Event.from_local(str(event.get("UID", "")), summary, start, end, startDay, endDay,
+                                           startMinute, allDayEventS or allDayEventE))
+        return events
+
+    def file_hash(self, path):
+        digest = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 16), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def load_index(self, indexFile, feedHash, localTZ):
+        # The index holds the events already expanded for [start, end] from the feed with the given hash
+        try:
+            with open(indexFile, 'rb') as file:
+                index = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+        if index.get('version') != INDEX_VERSION or index.get('feedHash') != feedHash or index.get('tz') != str(localTZ):
+            return None
+        index['events'] = unpack_events(index['events'])
+        return index
+
+    def save_index(self, indexFile, index):
+        os.makedirs(self.cacheDir, exist_ok=True)
+        with open(indexFile + '.tmp', 'wb') as file:
+            pickle.dump(dict(index, events=pack_events(index['events'])), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(indexFile + '.tmp', indexFile)
+
+    def get_feeds(self, calendar):
+        # The calendar setting is one url or a list of urls / {"url", "color": "black"|"red", "label"} entries
+        # The default label is a position, private feed urls carry access tokens and should not reach the log
+        feeds = []
+        for i, entry in enumerate(calendar if isinstance(calendar, list) else [calendar]):
+            if isinstance(entry, str):
+                entry = {'url': entry}
+            feeds.append({'url': entry['url'], 'color': entry.get('color', 'black'),
+                          'label': entry.get('label') or '#{}'.format(i + 1)})
+        return feeds
+
+    def get_session(self, poolSize):
+        if self.session is None:
+            self.session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(max_retries=self.retry_strategy(), pool_maxsize=max(poolSize, 10))
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+        return self.session
+
+    def retrieve_events(self, calendar, startDate, endDate, localTZ, thresholdHours):
+        # Fetches and expands every feed concurrently over one pooled session, then merges the sorted lists
+        self.stale = False
+        feeds = self.get_feeds(calendar)
+        session = self.get_session(len(feeds))
+        with ThreadPoolExecutor(max_workers=len(feeds)) as executor:
+            futures = [executor.submit(self.retrieve_feed_events, session, feed, startDate, endDate, localTZ)
+                       for feed in feeds]
+            eventLists = [future.result() for future in futures]
+
+        events = []
+        seen = set()
+        for event in heapq.merge(*eventLists, key=lambda x: x.start):
+            key = (event.uid, event.start)
+            if event.uid and key in seen:
+                continue
+            seen.add(key)
+            events.append(event)
+        return events
+
+    def retrieve_feed_events(self, session, feed, startDate, endDate, localTZ):
+        start = time.perf_counter()
+        try:
+            events = self.retrieve_calendar_events(session, feed['url'], startDate, endDate, localTZ)
+        except Exception as e:
+            self.logger.error("Error retrieving calendar {}: {}".format(feed['label'], e))
+            events = []
+        # the events can be the same objects as in the last refresh, so the flag is cleared as well as set
+        for event in events:
+            event.flags = event.flags | RED if feed['color'] == 'red' else event.flags & ~RED
+        self.logger.info("Calendar {} retrieved in {:.2f}s ({} events)".format(feed['label'], time.perf_counter() - start,
+                                                                          len(events)))
+        return events
+
+    def retrieve_calendar_events(self, session, calendar, startDate, endDate, localTZ):
+        with metrics.span('download'):
+            bodyFile = self.fetch_feed(session, calendar)
+        if bodyFile is None:
+            return []
+
+        # Reuse the expanded events of an unchanged feed, only the days that entered the window are expanded.
+        # Expansion runs LOOKAHEAD_DAYS past the window so most runs do not need to parse the feed at all
+        indexFile = bodyFile[:-len('.ics')] + '.idx'
+        windowStart, windowEnd = int(startDate.timestamp()), int(endDate.timestamp())
+        # An unchanged feed file is neither hashed nor its index unpickled again while the helper stays alive
+        stat = os.stat(bodyFile)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self.indexes.get(indexFile)
+        if cached is not None and cached[0] == signature and cached[2]['tz'] == str(localTZ):
+            _, feedHash, index = cached
+        else:
+            feedHash = self.file_hash(bodyFile)
+            index = self.load_index(indexFile, feedHash, localTZ)
+        if index is not None and (index['start'] > startDate or index['end'] < startDate):
+            index = None
+        if index is None or index['end'] < endDate:
+            expandEnd = endDate + datetime.timedelta(days=LOOKAHEAD_DAYS)
+            with metrics.span('parse'):
+                parsed = self.parse_feed(bodyFile, startDate if index is None else index['end'], expandEnd)
+            if parsed is None:
+                return []
+            cal, bad_events = parsed
+            if index is None:
+                index = {'version': INDEX_VERSION, 'feedHash': feedHash, 'tz': str(localTZ),
+                         'start': startDate, 'end': expandEnd,
+                         'events': self.expand_events(cal, bad_events, startDate, expandEnd, localTZ)}
+            else:
+                known = set((event.uid, event.start) for event in index['events'])
+                added = self.expand_events(cal, bad_events, index['end'], expandEnd, localTZ)
+                index['events'].extend(event for event in added if (event.uid, event.start) not in known)
+                index['end'] = expandEnd
+            index['events'] = [event for event in index['events'] if event.end >= windowStart]
+            index['start'] = startDate
+            self.save_index(indexFile, index)
+        else:
+            metrics.count('indexHits')
+            self.logger.info("Calendar feed unchanged, using expanded events from index")
+        self.indexes[indexFile] = (signature, feedHash, index)
+
+        events = [event for event in index['events'] if not (event.end < windowStart or event.start > windowEnd)]
+        return sorted(events, key=lambda x: x.start)
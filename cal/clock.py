@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Converts event times to the display timezone without a timezone library call per occurrence. The UTC offset
+transitions around the expansion window are looked up once, after that an instant maps to local day and minute
+with a bisect and integer arithmetic, and all-day dates never become datetime objects. Results are the same as
+pytz's astimezone() and localize() (is_dst=False: ambiguous wall times take standard time, non-existent ones the
+offset from before the gap).
+"""
+
+import bisect
+import datetime
+
+DAY = 86400
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+SAMPLE_SECONDS = 6 * 3600  # offsets are sampled this far apart, transitions closer together than this are not expected
+MARGIN_DAYS = 3  # precomputed range around the window, covers the day of slack the localize rules probe
+GAP_SHIFT = 6 * 3600  # a wall time in a gap is resolved like the one this much earlier, as pytz does
+
+
+class LocalClock:
+
+    def __init__(self, localTZ, start, end):
+        # start and end are aware datetimes or epoch seconds of the range most conversions fall in, anything
+        # outside it is still converted correctly, only slower
+        self.localTZ = localTZ
+        start = start.timestamp() if isinstance(start, datetime.datetime) else start
+        end = end.timestamp() if isinstance(end, datetime.datetime) else end
+        self.first = int(start) - MARGIN_DAYS * DAY
+        self.last = int(end) + MARGIN_DAYS * DAY
+        # periods start at self.transitions[i] and have the offset and dst flag in self.periods[i]
+        self.transitions = [self.first]
+        self.periods = [self.lookup(self.first)]
+        previous = self.first
+        for sample in range(self.first + SAMPLE_SECONDS, self.last + SAMPLE_SECONDS, SAMPLE_SECONDS):
+            period = self.lookup(sample)
+            if period != self.periods[-1]:
+                self.transitions.append(self.find_transition(previous, sample))
+                self.periods.append(period)
+            previous = sample
+        self.offsets = [offset for offset, _ in self.periods]
+
+        # Wall time edges of the same periods. Around a transition the wall times between the old and the new
+        # offset are skipped or repeated, those get None and go through the localize rules in from_wall
+        self.wallEdges = [self.first + self.offsets[0]]
+        self.wallOffsets = [self.offsets[0]]
+        for transition, before, after in zip(self.transitions[1:], self.offsets, self.offsets[1:]):
+            self.wallEdges += [transition + min(before, after), transition + max(before, after)]
+            self.wallOffsets += [None, after]
+        self.wallFirst = self.first + 2 * DAY
+        self.wallLast = self.last - 2 * DAY
+
+    def lookup(self, instant):
+        # (utc offset in seconds, is dst) straight from the timezone
+        local = datetime.datetime.fromtimestamp(instant, self.localTZ)
+        return int(local.utcoffset().total_seconds()), bool(local.dst())
+
+    def find_transition(self, before, after):
+        # First whole second in (before, after] with the period in effect at after
+        period = self.lookup(after)
+        while after - before > 1:
+            middle = (before + after) // 2
+            if self.lookup(middle) == period:
+                after = middle
+            else:
+                before = middle
+        return after
+
+    def period_at(self, instant):
+        if self.first <= instant < self.last:
+            return self.periods[bisect.bisect_right(self.transitions, instant) - 1]
+        return self.lookup(instant)
+
+    def from_wall(self, wall):
+        # Epoch seconds of a local wall time given as seconds since the local epoch. Away from the transitions
+        # the wall time has exactly one offset
+        if self.wallFirst <= wall < self.wallLast:
+            offset = self.wallOffsets[bisect.bisect_right(self.wallEdges, wall) - 1]
+            if offset is not None:
+                return wall - offset
+        return self.localize(wall)
+
+    def localize(self, wall):
+        # The rules of pytz localize(is_dst=False): the offsets in effect a day before and after are tried and
+        # the ones that map back to the same wall time kept
+        candidates = {}
+        for probe in (wall - DAY, wall + DAY):
+            offset, _ = self.period_at(probe)
+            instant = wall - offset
+            period = self.period_at(instant)
+            if period[0] == offset:
+                candidates[instant] = period[1]
+        if len(candidates) == 1:
+            return next(iter(candidates))
+        if not candidates:
+            # in a gap the wall time keeps the offset from before it
+            return self.localize(wall - GAP_SHIFT) + GAP_SHIFT
+        standard = [instant for instant, dst in candidates.items() if not dst]
+        return standard[0] if len(standard) == 1 else max(standard or candidates)
+
+    def convert(self, date, offset=0):
+        # Returns (epoch seconds, local date ordinal, local minutes since midnight, all day) for a date, naive or
+        # aware datetime. offset moves all-day dates by whole days, -1 turns an exclusive DTEND into the last day
+        if not isinstance(date, datetime.datetime):
+            day = date.toordinal() + offset
+            return self.from_wall((day - EPOCH_ORDINAL) * DAY), day, 0, True
+        if date.tzinfo is None:
+            wall = (date.toordinal() - EPOCH_ORDINAL) * DAY + date.hour * 3600 + date.minute * 60 + date.second + \
+                date.microsecond / 1e6
+            # localize keeps the wall time as given, also inside a gap
+            return self.from_wall(wall), date.toordinal(), date.hour * 60 + date.minute, False
+        instant = date.timestamp()
+        if self.first <= instant < self.last:
+            utcOffset = self.offsets[bisect.bisect_right(self.transitions, instant) - 1]
+        else:
+            utcOffset = self.lookup(instant)[0]
+        local = int(instant // 1) + utcOffset
+        return instant, local // DAY + EPOCH_ORDINAL, local % DAY // 60, False
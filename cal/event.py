@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compact record for one calendar event occurrence. Times are kept as epoch seconds and the local calendar days as
+date ordinals, so sorting, window checks and day bucketing are plain integer operations. Lists of events pack
+into a flat binary form for the on-disk index.
+"""
+
+import datetime
+import struct
+
+ALLDAY = 1
+MULTIDAY = 2
+RED = 4  # event of a calendar shown in red
+
+# start, end, startDay, endDay, startMinute, flags, uid length, summary length
+RECORD = struct.Struct('<qqiiHBII')
+COUNT = struct.Struct('<I')
+
+
+class Event:
+    __slots__ = ('uid', 'summary', 'start', 'end', 'startDay', 'endDay', 'startMinute', 'flags')
+
+    def __init__(self, uid, summary, start, end, startDay, endDay, startMinute, flags):
+        self.uid = uid
+        self.summary = summary
+        self.start = start  # epoch seconds
+        self.end = end
+        self.startDay = startDay  # local date ordinals, endDay is the last day the event covers
+        self.endDay = endDay
+        self.startMinute = startMinute  # local minutes since midnight of the start
+        self.flags = flags
+
+    @classmethod
+    def from_datetimes(cls, uid, summary, start, end, allday):
+        # start and end are aware datetimes already converted to the display timezone
+        return cls.from_local(uid, summary, start.timestamp(), end.timestamp(), start.toordinal(), end.toordinal(),
+                              start.hour * 60 + start.minute, allday)
+
+    @classmethod
+    def from_local(cls, uid, summary, start, end, startDay, endDay, startMinute, allday):
+        # start and end in epoch seconds, the days and minute already in the display timezone
+        flags = ALLDAY if allday else 0
+        if startDay != endDay:
+            flags |= MULTIDAY
+        return cls(uid, summary, int(start), int(end), startDay, endDay, startMinute, flags)
+
+    @property
+    def allday(self):
+        return bool(self.flags & ALLDAY)
+
+    @property
+    def isMultiday(self):
+        return bool(self.flags & MULTIDAY)
+
+    @property
+    def color(self):
+        return 'red' if self.flags & RED else 'black'
+
+    @property
+    def startTime(self):
+        return datetime.time(self.startMinute // 60, self.startMinute % 60)
+
+    def key(self):
+        # Everything that is shown on screen, used for the render input hash
+        return (self.start, self.end, self.startDay, self.endDay, self.startMinute, self.flags, self.summary)
+
+    def __repr__(self):
+        return 'Event({!r}, {!r}, start={}, end={}, flags={})'.format(self.uid, self.summary, self.start, self.end,
+                                                                     self.flags)
+
+
+def pack_events(events):
+    # Fixed size records followed by the utf-8 text of all uids and summaries
+    records, text = [COUNT.pack(len(events))], []
+    for event in events:
+        uid = event.uid.encode('utf-8')
+        summary = event.summary.encode('utf-8')
+        records.append(RECORD.pack(event.start, event.end, event.startDay, event.endDay, event.startMinute,
+                                   event.flags, len(uid), len(summary)))
+        text.append(uid)
+        text.append(summary)
+    return b''.join(records + text)
+
+
+def unpack_events(data):
+    data = memoryview(data)
+    count, = COUNT.unpack_from(data)
+    textOffset = COUNT.size + count * RECORD.size
+    events = []
+    for start, end, startDay, endDay, startMinute, flags, uidLen, summaryLen in \
+            RECORD.iter_unpack(data[COUNT.size:textOffset]):
+        uid = str(data[textOffset:textOffset + uidLen], 'utf-8')
+        textOffset += uidLen
+        summary = str(data[textOffset:textOffset + summaryLen], 'utf-8')
+        textOffset += summaryLen
+        events.append(Event(uid, summary, start, end, startDay, endDay, startMinute, flags))
+    return events
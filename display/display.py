@@ -5,9 +5,16 @@ This part of the code exposes functions to interface with the eink display
 """
 
 import display.epd12in48b as eink
+import metrics.metrics as metrics
 from PIL import Image
 from PIL import ImageDraw
 import logging
+import mmap
+import os
+import pathlib
+
+# Last packed black and red planes sent to the panel, used to skip unchanged controllers
+FRAME_FILE = str(pathlib.Path(__file__).parent.absolute()) + '/framebuffer.bin'
 
 
 class DisplayHelper:
@@ -18,28 +25,79 @@ class DisplayHelper:
         self.screenwidth = width
         self.screenheight = height
         self.epd = eink.EPD()
-        self.epd.Init()
+        # The panel is left in deep sleep by the last run. It needs a reset and Init before an upload, which is put
+        # off until a stripe actually changed, so an unchanged frame costs no panel power cycle at all
+        self.asleep = True
+
+    def wake(self):
+        # A resident process keeps the helper between refreshes and only re-initialises a sleeping panel
+        if self.asleep:
+            self.epd.Init()
+            self.asleep = False
 
     def update(self, blackimg, redimg):
-        # Updates the display with the grayscale and red images
-        # start displaying on eink display
-        # self.epd.clear()
-        self.epd.display(blackimg, redimg)
-        self.logger.info('E-Ink display update complete.')
+        # Updates the display with the black and red images, renderers hand over 1bpp images of the panel size
+        # which are packed as is without another conversion
+        # only the controllers whose part of the frame changed since the last update are refreshed
+        with metrics.span('pack'):
+            blackbuf, redbuf = self.epd.getbuffers(blackimg, redimg)
+            changed = self.changed_stripes(blackbuf, redbuf)
+        metrics.record('stripesRefreshed', changed)
+        if not changed:
+            self.logger.info('E-Ink display unchanged, skipping refresh.')
+            return
+        self.wake()
+        metrics.mark('upload')
+        busyTimes = self.epd.display_buffers(blackbuf, redbuf, changed)
+        metrics.record('busySeconds', {name: round(busyTimes[name], 3) for name in busyTimes})
+        self.save_frame(blackbuf, redbuf)
+        self.logger.info('E-Ink display update complete. Refresh times: ' +
+                         ', '.join('{} {:.2f}s'.format(name, busyTimes[name]) for name in sorted(busyTimes)))
+
+    def changed_stripes(self, blackbuf, redbuf):
+        # Compares each controller's stripe against the frame file, everything counts as changed without one
+        size = len(blackbuf)
+        if not os.path.exists(FRAME_FILE) or os.path.getsize(FRAME_FILE) != 2 * size:
+            return list(eink.STRIPES)
+        with open(FRAME_FILE, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as frame:
+            view = memoryview(frame)
+            try:
+                return [name for name in eink.STRIPES
+                        if self.epd.stripe(blackbuf, name) != self.epd.stripe(view[:size], name)
+                        or self.epd.stripe(redbuf, name) != self.epd.stripe(view[size:], name)]
+            finally:
+                view.release()
+
+    def save_frame(self, blackbuf, redbuf):
+        tmpFile = FRAME_FILE + '.tmp'
+        with open(tmpFile, 'wb') as f:
+            f.write(blackbuf)
+            f.write(redbuf)
+        os.replace(tmpFile, FRAME_FILE)
+
+    def forget_frame(self):
+        # The panel no longer shows the saved frame, the next update refreshes everything
+        if os.path.exists(FRAME_FILE):
+            os.remove(FRAME_FILE)
 
     def calibrate(self, cycles=1):
         # Calibrates the display to prevent ghosting
         white = Image.new('1', (self.screenwidth, self.screenheight), 255)
         black = Image.new('1', (self.screenwidth, self.screenheight), 255)
+        self.wake()
         for _ in range(cycles):
             self.epd.display(black, white)
             self.epd.display(white, black)
             self.epd.display(white, white)
+        self.forget_frame()
         self.logger.info('E-Ink display calibration complete.')
 
     def sleep(self):
-        # send E-Ink display to deep sleep
+        # send E-Ink display to deep sleep, unless nothing was sent since it last went there
+        if self.asleep:
+            return
         self.epd.EPD_Sleep()
+        self.asleep = True
         self.logger.info('E-Ink display entered deep sleep.')
 
     def displayError(self, message):
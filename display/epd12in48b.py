@@ -28,10 +28,32 @@
 #
 import time
 import display.epdconfig as epdconfig
+import metrics.metrics as metrics
+from PIL import Image
 
 EPD_WIDTH       = 1304
 EPD_HEIGHT      = 984
 
+# Framebuffer region driven by each controller: (pixel rows, byte columns), in upload order.
+# S2 and M1 drive 648*492 pixels, M2 and S1 656*492
+STRIPES = {
+    'S2': (range(0, 492), range(0, 81)),
+    'M2': (range(0, 492), range(81, 163)),
+    'M1': (range(492, 984), range(0, 81)),
+    'S1': (range(492, 984), range(81, 163)),
+}
+
+# A slave shares the gate lines of its master and only drives them during the master's scan, so each pair is
+# uploaded and refreshed as one unit
+PAIRS = {'M1': 'M1S1', 'S1': 'M1S1', 'M2': 'M2S2', 'S2': 'M2S2'}
+
+# Byte lookup table that flips every bit, the red plane is sent inverted
+INVERT_TABLE = bytes(range(255, -1, -1))
+
+# Bounds in seconds of the backing-off sleep between BUSY status reads
+BUSY_POLL_MIN = 0.005
+BUSY_POLL_MAX = 0.1
+
 class EPD(object):
     def __init__(self):
         self.width = EPD_WIDTH
@@ -53,6 +75,13 @@ class EPD(object):
         self.EPD_M2_BUSY_PIN  = epdconfig.EPD_M2_BUSY_PIN
         self.EPD_S2_BUSY_PIN  = epdconfig.EPD_S2_BUSY_PIN
 
+        self.senders = {
+            'M1': (self.M1_SendCommand, self.M1_SendDataBlock),
+            'S1': (self.S1_SendCommand, self.S1_SendDataBlock),
+            'M2': (self.M2_SendCommand, self.M2_SendDataBlock),
+            'S2': (self.S2_SendCommand, self.S2_SendDataBlock),
+        }
+
     def Init(self):
         print("EPD init...")
         epdconfig.module_init()
@@ -132,129 +161,68 @@ class EPD(object):
 
         self.M1_ReadTemperature()
         
+    def getbuffer(self, image):
+        # Pack an image into the panel framebuffer layout: 1bpp rows, MSB first, 1 = white
+        if image.mode != '1':
+            image = image.convert('1')
+        if image.size != (self.width, self.height):
+            canvas = Image.new('1', (self.width, self.height), 0)
+            canvas.paste(image, (0, 0))
+            image = canvas
+        return image.tobytes()
+
+    def getbuffers(self, BlackImage, RedImage):
+        # Returns the black plane and the inverted red plane the controllers expect on 0x13
+        Blackbuf = self.getbuffer(BlackImage)
+        Redbuf = self.getbuffer(RedImage).translate(INVERT_TABLE)
+        return Blackbuf, Redbuf
+
+    def stripe(self, buf, name):
+        # Cut the rectangle driven by one controller out of a packed framebuffer
+        rows, cols = STRIPES[name]
+        stride = self.width // 8
+        return b''.join([buf[y * stride + cols.start:y * stride + cols.stop] for y in rows])
+
     def display(self, BlackImage, RedImage):
-        start = time.perf_counter()
-        
-        Blackbuf = [0x00] * int(self.width * self.height / 8)
-        blackconvert = BlackImage.convert('1')       
-        bimwidth, bimheight = blackconvert.size 
-        Blackpixles = blackconvert.load()
-        temp=0
-        for y in range(0, bimheight):
-            for x in range(0, bimwidth):
-                if Blackpixles[x, y] < 127:           # black
-                    Blackbuf[int((x + y*self.width)/8)] &= ~(0x80>>temp)
-                else:                           # white
-                    Blackbuf[int((x + y*self.width)/8)] |= (0x80>>temp)
-                temp=temp+1
-                if(temp==8):
-                    temp=0
-                    
-        Redbuf = [0x00] * int(self.width * self.height / 8)
-        redconvert = RedImage.convert('1')
-        rimwidth, rimheight = redconvert.size 
-        Redpixles = redconvert.load()
-        temp=0
-        for y in range(0, rimheight):
-            for x in range(0, rimwidth):
-                if Redpixles[x, y] < 127:           # black
-                    Redbuf[int((x + y*self.width)/8)] &= ~(0x80>>temp)
-                else:                           # white
-                    Redbuf[int((x + y*self.width)/8)] |= (0x80>>temp)
-                temp=temp+1
-                if(temp==8):
-                    temp=0
-                    
-        #S2 part 648*492
-        self.S2_SendCommand(0x10)
-        for y in  range(0, 492):
-            for x in  range(0, 81):
-                self.S2_SendData(Blackbuf[y*163 + x])
-        self.S2_SendCommand(0x13)
-        for y in  range(0, 492):
-            for x in  range(0, 81):
-                self.S2_SendData(~Redbuf[y*163 + x])
-                
-        #M2 part 656*492
-        self.M2_SendCommand(0x10)
-        for y in  range(0, 492):
-            for x in  range(81, 163):
-                self.M2_SendData(Blackbuf[y*163 + x])
-        self.M2_SendCommand(0x13)
-        for y in  range(0, 492):
-            for x in  range(81, 163):
-                self.M2_SendData(~Redbuf[y*163 + x])
-
-        #M1 part 648*492    
-        self.M1_SendCommand(0x10)
-        for y in  range(492, 984):
-            for x in  range(0, 81):
-                self.M1_SendData(Blackbuf[y*163 + x])
-        self.M1_SendCommand(0x13)
-        for y in  range(492, 984):
-            for x in  range(0, 81):
-                self.M1_SendData(~Redbuf[y*163 + x])
-        
-        #S1 part 656*492
-        self.S1_SendCommand(0x10)
-        for y in  range(492, 984):
-            for x in  range(81, 163):
-                self.S1_SendData(Blackbuf[y*163 + x])
-        self.S1_SendCommand(0x13)
-        for y in  range(492, 984):
-            for x in  range(81, 163):
-                self.S1_SendData(~Redbuf[y*163 + x])
-                
-        end = time.perf_counter()
-        print("use time: %f"%(end - start))
-        self.TurnOnDisplay()
+        Blackbuf, Redbuf = self.getbuffers(BlackImage, RedImage)
+        return self.display_buffers(Blackbuf, Redbuf)
+
+    def display_buffers(self, Blackbuf, Redbuf, names=None):
+        # Uploads and refreshes only the listed controllers, the others keep showing their current image. Each one
+        # brings the other half of its pair along, uploaded again as its RAM may not survive deep sleep
+        names = tuple(STRIPES) if names is None else names
+        pairs = {PAIRS[name] for name in names}
+        names = tuple(name for name in STRIPES if PAIRS[name] in pairs)
+
+        with metrics.span('upload'):
+            for name in STRIPES:
+                if name not in names:
+                    continue
+                send_command, send_block = self.senders[name]
+                blackStripe = self.stripe(Blackbuf, name)
+                redStripe = self.stripe(Redbuf, name)
+                send_command(0x10)
+                send_block(blackStripe)
+                send_command(0x13)
+                send_block(redStripe)
+                metrics.count('spiBytes', len(blackStripe) + len(redStripe))
+
+        with metrics.span('refresh'):
+            return self.TurnOnDisplay(names)
 
     def clear(self):
         """Clear contents of image buffer"""
-        start = time.perf_counter()
-        
-        self.S2_SendCommand(0x10)
-        for y in  range(0, 492):
-            for x in  range(0, 81):
-                self.S2_SendData(0xff)        
-        self.S2_SendCommand(0x13)
-        for y in  range(0, 492):
-            for x in  range(0, 81):
-                self.S2_SendData(0x00)
-                
-        self.M2_SendCommand(0x10)
-        for y in  range(0, 492):
-            for x in  range(81, 163):
-                self.M2_SendData(0xff)
-        self.M2_SendCommand(0x13)
-        for y in  range(0, 492):
-            for x in  range(81, 163):
-                self.M2_SendData(0x00)       
-                    
-        self.M1_SendCommand(0x10)
-        for y in  range(492, 984):
-            for x in  range(0, 81):
-                self.M1_SendData(0xff)
-        self.M1_SendCommand(0x13)
-        for y in  range(492, 984):
-            for x in  range(0, 81):
-                self.M1_SendData(0x00)
-                
-        self.S1_SendCommand(0x10)
-        for y in  range(492, 984):
-            for x in  range(81, 163):
-                self.S1_SendData(0xff)
-        self.S1_SendCommand(0x13)
-        for y in  range(492, 984):
-            for x in  range(81, 163):
-                self.S1_SendData(0x00)
-                
-        end = time.perf_counter()
-        print (end)
-        print (start)
-        print("use time: %f" %(end - start))
-        
-        self.TurnOnDisplay()
+        with metrics.span('clear'):
+            for name, (rows, cols) in STRIPES.items():
+                send_command, send_block = self.senders[name]
+                size = len(rows) * len(cols)
+                send_command(0x10)
+                send_block(b'\xff' * size)
+                send_command(0x13)
+                send_block(b'\x00' * size)
+
+        with metrics.span('refresh'):
+            return self.TurnOnDisplay()
         
     def Reset(self):
         epdconfig.digital_write(self.EPD_M1S1_RST_PIN, 1) 
@@ -277,14 +245,16 @@ class EPD(object):
         print("module_exit")
         epdconfig.module_exit()
 
-    def TurnOnDisplay(self):
+    def TurnOnDisplay(self, names=None):
         self.M1M2_SendCommand(0x04)  
         time.sleep(0.3) 
-        self.M1S1M2S2_SendCommand(0x12) 
-        self.M1_ReadBusy()
-        self.S1_ReadBusy()
-        self.M2_ReadBusy()
-        self.S2_ReadBusy()   
+        if names is None or len(names) == len(STRIPES):
+            names = tuple(STRIPES)
+            self.M1S1M2S2_SendCommand(0x12) 
+        else:
+            for name in names:
+                self.senders[name][0](0x12)
+        return self.ReadBusy(names)
         
     """   M1S1M2S2 Write register address and data     """
     def M1S1M2S2_SendCommand(self, cmd):
@@ -345,6 +315,12 @@ class EPD(object):
         epdconfig.digital_write(self.EPD_S2_CS_PIN, 0)
         epdconfig.spi_writebyte(val)
         epdconfig.digital_write(self.EPD_S2_CS_PIN, 1)
+    def S2_SendDataBlock(self, buf):
+        # Holds CS low for the whole buffer instead of toggling it per byte
+        epdconfig.digital_write(self.EPD_M2S2_DC_PIN, 1)
+        epdconfig.digital_write(self.EPD_S2_CS_PIN, 0)
+        epdconfig.spi_writebytes(buf)
+        epdconfig.digital_write(self.EPD_S2_CS_PIN, 1)
         
     """   M2 Write register address and data     """
     def M2_SendCommand(self, cmd):
@@ -357,6 +333,11 @@ class EPD(object):
         epdconfig.digital_write(self.EPD_M2_CS_PIN, 0)
         epdconfig.spi_writebyte(val) 
         epdconfig.digital_write(self.EPD_M2_CS_PIN, 1)
+    def M2_SendDataBlock(self, buf):
+        epdconfig.digital_write(self.EPD_M2S2_DC_PIN, 1)
+        epdconfig.digital_write(self.EPD_M2_CS_PIN, 0)
+        epdconfig.spi_writebytes(buf)
+        epdconfig.digital_write(self.EPD_M2_CS_PIN, 1)
 
     """   S1 Write register address and data     """
     def S1_SendCommand(self, cmd):
@@ -369,6 +350,11 @@ class EPD(object):
         epdconfig.digital_write(self.EPD_S1_CS_PIN, 0)
         epdconfig.spi_writebyte(val)
         epdconfig.digital_write(self.EPD_S1_CS_PIN, 1)
+    def S1_SendDataBlock(self, buf):
+        epdconfig.digital_write(self.EPD_M1S1_DC_PIN, 1)
+        epdconfig.digital_write(self.EPD_S1_CS_PIN, 0)
+        epdconfig.spi_writebytes(buf)
+        epdconfig.digital_write(self.EPD_S1_CS_PIN, 1)
         
     """   M1 Write register address and data     """
     def M1_SendCommand(self, cmd):
@@ -381,45 +367,47 @@ class EPD(object):
         epdconfig.digital_write(self.EPD_M1_CS_PIN, 0)
         epdconfig.spi_writebyte(val)
         epdconfig.digital_write(self.EPD_M1_CS_PIN, 1)
+    def M1_SendDataBlock(self, buf):
+        epdconfig.digital_write(self.EPD_M1S1_DC_PIN, 1)
+        epdconfig.digital_write(self.EPD_M1_CS_PIN, 0)
+        epdconfig.spi_writebytes(buf)
+        epdconfig.digital_write(self.EPD_M1_CS_PIN, 1)
 
     #Busy
-    def M1_ReadBusy(self):
-        self.M1_SendCommand(0x71) 
-        busy = epdconfig.digital_read(self.EPD_M1_BUSY_PIN) 
-        busy = not(busy & 0x01) 
-        while(busy):
-            self.M1_SendCommand(0x71) 
-            busy = epdconfig.digital_read(self.EPD_M1_BUSY_PIN) 
-            busy = not(busy & 0x01) 
+    def ReadBusy(self, names):
+        # Polls the BUSY lines of the given controllers together, backing off between status
+        # reads instead of spinning, and returns how long each one stayed busy in seconds
+        controllers = {
+            'M1': (self.M1_SendCommand, self.EPD_M1_BUSY_PIN),
+            'S1': (self.S1_SendCommand, self.EPD_S1_BUSY_PIN),
+            'M2': (self.M2_SendCommand, self.EPD_M2_BUSY_PIN),
+            'S2': (self.S2_SendCommand, self.EPD_S2_BUSY_PIN),
+        }
+        pending = {name: controllers[name] for name in names}
+        busyTimes = {}
+        start = time.perf_counter()
+        interval = BUSY_POLL_MIN
+        while True:
+            for name, (send_command, pin) in list(pending.items()):
+                send_command(0x71)
+                if epdconfig.digital_read(pin) & 0x01:
+                    busyTimes[name] = time.perf_counter() - start
+                    del pending[name]
+            if not pending:
+                break
+            time.sleep(interval)
+            interval = min(interval * 2, BUSY_POLL_MAX)
         time.sleep(0.2)
+        return busyTimes
+
+    def M1_ReadBusy(self):
+        return self.ReadBusy(('M1',))
     def M2_ReadBusy(self):
-        self.M2_SendCommand(0x71) 
-        busy = epdconfig.digital_read(self.EPD_M2_BUSY_PIN) 
-        busy = not(busy & 0x01) 
-        self.M2_SendCommand(0x71) 
-        while(busy):
-            self.M2_SendCommand(0x71) 
-            busy = epdconfig.digital_read(self.EPD_M2_BUSY_PIN) 
-            busy =not(busy & 0x01) 
-        time.sleep(0.2)
+        return self.ReadBusy(('M2',))
     def S1_ReadBusy(self):
-        self.S1_SendCommand(0x71) 
-        busy = epdconfig.digital_read(self.EPD_S1_BUSY_PIN) 
-        busy = not(busy & 0x01) 
-        while(busy):
-            self.S1_SendCommand(0x71) 
-            busy = epdconfig.digital_read(self.EPD_S1_BUSY_PIN) 
-            busy = not(busy & 0x01) 
-        time.sleep(0.2)        
+        return self.ReadBusy(('S1',))
     def S2_ReadBusy(self):
-        self.S2_SendCommand(0x71) 
-        busy = epdconfig.digital_read(self.EPD_S2_BUSY_PIN) 
-        busy = not(busy & 0x01) 
-        while(busy):
-            self.S2_SendCommand(0x71) 
-            busy = epdconfig.digital_read(self.EPD_S2_BUSY_PIN) 
-            busy = not(busy & 0x01) 
-        time.sleep(0.2)            
+        return self.ReadBusy(('S2',))
 
     lut_vcom1 = [
         0x00,   0x10,   0x10,   0x01,   0x08,   0x01,
@@ -26,10 +26,10 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 #
-import RPi.GPIO as GPIO
 import time
 import os
 import logging
+import struct
 import sys
 
 from ctypes import *
@@ -58,19 +58,64 @@ find_dirs = [
     '/usr/local/lib',
     '/usr/lib',
 ]
+# bcm2835 constants for the hardware SPI path
+BCM2835_GPIO_FSEL_OUTP = 1
+BCM2835_GPIO_FSEL_ALT0 = 4
+BCM2835_SPI_BIT_ORDER_MSBFIRST = 1
+BCM2835_SPI_MODE0 = 0
+BCM2835_SPI_CS_NONE = 3
+SPI_CLOCK_DIVIDER = 128  # ~3 MHz on the Zero 2 core clock, below the 4 MHz Waveshare's spidev drivers use
+
+GPIO = None  # RPi.GPIO, imported by module_init so this module loads on any machine
 spi = None
-for find_dir in find_dirs:
-    val = int(os.popen('getconf LONG_BIT').read())
+spi_block = None  # bcm2835_spi_writenb once the SPI0 peripheral is claimed, None while the bytes are bit-banged
+
+
+def load_spi():
+    # Loads the SPI library on first use rather than at import. The build has to match the word size of this
+    # interpreter, which is known without running getconf
+    global spi
+    if spi is not None:
+        return spi
+    val = struct.calcsize('P') * 8
     logging.debug("System is %d bit"%val)
-    if val == 64:
-        so_filename = os.path.join(find_dir, 'DEV_Config_64.so')
-    else:
-        so_filename = os.path.join(find_dir, 'DEV_Config_32.so')
-    if os.path.exists(so_filename):
-        spi = CDLL(so_filename)
-        break
-if spi is None:
-    RuntimeError('Cannot find DEV_Config.so')
+    so_name = 'DEV_Config_64.so' if val == 64 else 'DEV_Config_32.so'
+    for find_dir in find_dirs:
+        so_filename = os.path.join(find_dir, so_name)
+        if os.path.exists(so_filename):
+            spi = CDLL(so_filename)
+            break
+    if spi is None:
+        raise RuntimeError('Cannot find ' + so_name)
+    return spi
+
+
+def load_gpio():
+    global GPIO
+    if GPIO is None:
+        import RPi.GPIO
+        GPIO = RPi.GPIO
+    return GPIO
+
+
+def init_hardware_spi():
+    # DEV_SPI_WriteByte bit-bangs SCK and MOSI with microsecond delays per bit. The 64-bit build links bcm2835, whose
+    # SPI0 peripheral sends whole buffers in one call. It can only be claimed as root, and the 32-bit build (wiringPi)
+    # lacks it, those keep bit-banging. Chip selects stay manual, so CE0/CE1 (the M1 and S1 CS pins) go back to GPIO
+    global spi_block
+    spi_block = None
+    begin = getattr(spi, 'bcm2835_spi_begin', None)
+    if begin is None or not begin():
+        logging.debug("hardware SPI unavailable, bit-banging")
+        return False
+    spi.bcm2835_spi_setBitOrder(BCM2835_SPI_BIT_ORDER_MSBFIRST)
+    spi.bcm2835_spi_setDataMode(BCM2835_SPI_MODE0)
+    spi.bcm2835_spi_setClockDivider(SPI_CLOCK_DIVIDER)
+    spi.bcm2835_spi_chipSelect(BCM2835_SPI_CS_NONE)
+    spi.bcm2835_gpio_fsel(EPD_M1_CS_PIN, BCM2835_GPIO_FSEL_OUTP)
+    spi.bcm2835_gpio_fsel(EPD_S1_CS_PIN, BCM2835_GPIO_FSEL_OUTP)
+    spi_block = spi.bcm2835_spi_writenb
+    return True
 
 
 def digital_write(pin, value):
@@ -80,12 +125,27 @@ def digital_read(pin):
     return GPIO.input(pin)
 
 def spi_writebyte(value): 
-    spi.DEV_SPI_WriteByte(value)
+    if spi_block is not None:
+        spi_block(bytes([value & 0xff]), 1)  # SCK and MOSI belong to the peripheral now
+    else:
+        spi.DEV_SPI_WriteByte(value)
+
+def spi_writebytes(buf):
+    if spi_block is not None:
+        data = bytes(buf)
+        spi_block(data, len(data))
+    else:
+        # last resort, one library call per byte
+        writebyte = spi.DEV_SPI_WriteByte
+        for value in buf:
+            writebyte(value)
  
 def delay_ms(delaytime):
     time.sleep(delaytime / 1000.0)
         
 def module_init():
+    load_gpio()
+    load_spi()
     GPIO.setmode(GPIO.BCM)
     GPIO.setwarnings(False)
     GPIO.setup(EPD_SCK_PIN, GPIO.OUT)    
@@ -118,6 +178,7 @@ def module_init():
     digital_write(EPD_M1S1_DC_PIN, 1)
 
     spi.DEV_ModuleInit()
+    init_hardware_spi()
 
 def module_exit():
     digital_write(EPD_M2S2_RST_PIN, 0)
@@ -130,6 +191,9 @@ def module_exit():
     digital_write(EPD_M2_CS_PIN, 1)
 
 def spi_readbyte(Reg):
+    # Read by bit-banging, with hardware SPI the clock pin is borrowed from the peripheral for the read
+    if spi_block is not None:
+        GPIO.setup(EPD_SCK_PIN, GPIO.OUT)
     GPIO.setup(EPD_MOSI_PIN, GPIO.IN)
     j=0
     # time.sleep(0.01)
@@ -145,6 +209,9 @@ def spi_readbyte(Reg):
         GPIO.output(EPD_SCK_PIN, GPIO.HIGH) 
         # time.sleep(0.01)  
     GPIO.setup(EPD_MOSI_PIN, GPIO.OUT)
+    if spi_block is not None:
+        spi.bcm2835_gpio_fsel(EPD_SCK_PIN, BCM2835_GPIO_FSEL_ALT0)
+        spi.bcm2835_gpio_fsel(EPD_MOSI_PIN, BCM2835_GPIO_FSEL_ALT0)
     return j 
     
 def delay_ms(delaytime):
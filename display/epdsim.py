@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Software stand-in for display.epdconfig. It exposes the same module interface but, instead of driving
+GPIO and SPI, records what each of the four panel controllers (M1/S1/M2/S2) would have received. Call
+install() before importing display.epd12in48b to run the EPD driver off-device.
+"""
+
+import sys
+import time
+
+EPD_SCK_PIN   =11
+EPD_MOSI_PIN  =10
+
+EPD_M1_CS_PIN  =8
+EPD_S1_CS_PIN  =7
+EPD_M2_CS_PIN  =17
+EPD_S2_CS_PIN  =18
+
+EPD_M1S1_DC_PIN  =13
+EPD_M2S2_DC_PIN  =22
+
+EPD_M1S1_RST_PIN =6
+EPD_M2S2_RST_PIN =23
+
+EPD_M1_BUSY_PIN  =5
+EPD_S1_BUSY_PIN  =19
+EPD_M2_BUSY_PIN  =27
+EPD_S2_BUSY_PIN  =24
+
+CS_PINS = {'M1': EPD_M1_CS_PIN, 'S1': EPD_S1_CS_PIN, 'M2': EPD_M2_CS_PIN, 'S2': EPD_S2_CS_PIN}
+DC_PINS = {'M1': EPD_M1S1_DC_PIN, 'S1': EPD_M1S1_DC_PIN, 'M2': EPD_M2S2_DC_PIN, 'S2': EPD_M2S2_DC_PIN}
+
+levels = {}
+transfers = {}  # controller -> list of [command, bytearray of data]
+stats = {}
+
+
+def reset():
+    levels.clear()
+    for pin in CS_PINS.values():
+        levels[pin] = 1
+    for name in CS_PINS:
+        transfers[name] = []
+    stats.update({'gpio_writes': 0, 'gpio_toggles': 0, 'spi_calls': 0, 'spi_bytes': 0})
+
+
+def _clock_out(data):
+    stats['spi_calls'] += 1
+    stats['spi_bytes'] += len(data)
+    for name, cs_pin in CS_PINS.items():
+        if levels.get(cs_pin, 1):
+            continue
+        if levels.get(DC_PINS[name], 1):
+            if not transfers[name]:
+                transfers[name].append([None, bytearray()])
+            transfers[name][-1][1].extend(data)
+        else:
+            for cmd in data:
+                transfers[name].append([cmd, bytearray()])
+
+
+def frames(name):
+    # Latest payload per command for one controller, e.g. frames('M1')[0x10] is its black stripe
+    return {cmd: bytes(data) for cmd, data in transfers[name]}
+
+
+def load_spi():
+    return None
+
+def digital_write(pin, value):
+    stats['gpio_writes'] += 1
+    if levels.get(pin) != value:
+        stats['gpio_toggles'] += 1  # writes that actually change the line level
+    levels[pin] = value
+
+def digital_read(pin):
+    # BUSY lines read high, every controller is always idle
+    return levels.get(pin, 1)
+
+def spi_writebyte(value):
+    _clock_out(bytes([value & 0xff]))
+
+def spi_writebytes(buf):
+    _clock_out(bytes(buf))
+
+def spi_readbyte(Reg):
+    return 0
+
+def delay_ms(delaytime):
+    time.sleep(delaytime / 1000.0)
+
+def module_init():
+    reset()
+
+def module_exit():
+    for pin in CS_PINS.values():
+        levels[pin] = 1
+
+
+def install():
+    # Route every later `import display.epdconfig` (and an already imported driver) to this module
+    module = sys.modules[__name__]
+    sys.modules['display.epdconfig'] = module
+    driver = sys.modules.get('display.epd12in48b')
+    if driver is not None:
+        driver.epdconfig = module
+    return module
+
+
+reset()
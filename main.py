@@ -6,15 +6,61 @@ import sys
 
 from pytz import timezone
 from cal.cal import CalHelper
-from render.render import RenderHelper
 from weather.weather import WeatherHelper
 from power.power import PowerHelper
-from display.display import DisplayHelper
+from power.scheduler import WakeScheduler
+import metrics.metrics as metrics
+# The renderers (PIL) and the display driver (RPi.GPIO and the SPI library) are imported by the stages that use
+# them, so a run that fails early or finds the calendar unchanged does not pay for loading them
 import json
 import logging
 import os
 import traceback
 import time
+import threading
+from concurrent.futures import Future, wait
+
+CHARGE_CHECK_SECONDS = 30  # how often the plugged state is read while staying up on external power
+DAEMON_CHECK_SECONDS = 60  # the daemon re-reads the clock this often while waiting, so clock steps do not delay a refresh
+
+def fetch_sources(sources, deadline, logger, fallbacks=None):
+    # Runs the named fetch functions concurrently and returns their results, bounded by one overall deadline.
+    # Optional sources have a function in fallbacks whose value replaces theirs when they fail or are still running
+    # at the deadline. For the others errors are re-raised here and a source still running raises TimeoutError
+    fallbacks = fallbacks or {}
+
+    def timed(name, func):
+        start = time.perf_counter()
+        try:
+            return func()
+        finally:
+            logger.info("{} retrieved in {:.2f}s".format(name, time.perf_counter() - start))
+
+    def run(future, name, func):
+        try:
+            future.set_result(timed(name, func))
+        except Exception as e:
+            future.set_exception(e)
+
+    # Daemon threads rather than an executor, whose workers are joined at exit: a fetch hung past the deadline
+    # must not hold up the interpreter exit and the shutdown after it
+    futures = {}
+    for name, func in sources.items():
+        futures[name] = Future()
+        threading.Thread(target=run, args=(futures[name], name, func), name='fetch ' + name, daemon=True).start()
+    done, _ = wait(futures.values(), timeout=deadline)
+    results = {}
+    for name, future in futures.items():
+        try:
+            if future not in done:
+                raise TimeoutError("{} not retrieved within {}s".format(name, deadline))
+            results[name] = future.result()
+        except Exception as e:
+            if name not in fallbacks:
+                raise
+            logger.warning("{}, continuing without it: {}".format(name, e))
+            results[name] = fallbacks[name]()
+    return results
 
 def main():
     # Basic configuration settings (user replaceable)
@@ -34,12 +80,25 @@ def main():
     imageWidth = config['imageWidth']  # Width of image to be generated for display.
     imageHeight = config['imageHeight'] # Height of image to be generated for display.
     rotateAngle = config['rotateAngle']  # If image is rendered in portrait orientation, angle to rotate to fit screen
-    calendar = config['calendar']  # calendar url
+    calendar = config['calendar']  # calendar url, or a list of urls / {"url", "color": "black"|"red", "label"} entries
     latitude = config['lat'] # latitude for open weather call
     longitude = config['long'] # longitude for open weather call
     apiKey = config['openweatherapi'] # api key for open weather clal
     tempUnit = config['tempUnit'] # unit to use for temperature forcast
-    updateTime = config['dailyUpdateTime'] # hour of day data is refreshed, this ensures device wont shut down during testing
+    updateTime = config['dailyUpdateTime'] # hour of day the device wakes to refresh the data
+    renderEngine = config.get('renderEngine', 'html') # 'html' renders through wkhtmltoimage, 'pillow' draws the page natively
+    calendarStreaming = config.get('calendarStreaming', False) # only parse the events of large feeds that can be in view
+    fetchTimeout = config.get('fetchTimeout', 90) # seconds the calendar, weather and battery fetches may take together
+    weatherCacheMinutes = config.get('weatherCacheMinutes', 180) # minutes a downloaded forecast is reused without calling the API
+    updateMinute = config.get('dailyUpdateMinute', 0) # minute of the daily update hour the device wakes at
+    wakeAtRollover = config.get('wakeAtRollover', False) # also wake just after midnight so the current day is right all day, one more wake a day
+    eventWakeMinutes = config.get('eventWakeMinutes', 0) # wake this long before timed events to show last minute changes, 0 disables
+    chargeRefreshMinutes = config.get('chargeRefreshMinutes', 60) # refresh interval while staying up on external power
+    minWakeGapMinutes = config.get('minWakeGapMinutes', 60) # shortest time between two wake-ups, bounds the refreshes a day
+    batteryCapacityMah = config.get('batteryCapacityMah', 1200) # PiSugar battery capacity, turns the level drop of a run into mAh
+    runMode = config.get('runMode', 'oneshot') # 'oneshot' updates once and shuts down, 'daemon' stays resident for plugged-in installs
+    refreshMinutes = config.get('refreshMinutes', 30) # daemon refresh interval
+    refreshAtEvents = config.get('refreshAtEvents', True) # daemon also refreshes when a timed event starts or ends
 
     # Create and configure logger
     logging.basicConfig(filename="logfile.log", format='%(asctime)s %(levelname)s - %(message)s', filemode='a')
@@ -47,65 +106,178 @@ def main():
     logger.addHandler(logging.StreamHandler(sys.stdout))  # print logger to stdout
     logger.setLevel(logging.INFO)
     logger.info("Starting daily calendar update")
-    currDatetime = dt.datetime.now(displayTZ)
     powerService = PowerHelper()
+    scheduler = WakeScheduler(displayTZ, updateTime, updateMinute, atRollover=wakeAtRollover,
+                              eventLeadMinutes=eventWakeMinutes, minGapMinutes=minWakeGapMinutes)
+    # The helpers live as long as the process, so a daemon keeps their sessions, parsed feeds and the panel
+    calService = CalHelper(streaming=calendarStreaming)
+    weatherService = WeatherHelper(cacheMinutes=weatherCacheMinutes)
+    displayService = None
 
-    try:
-        # Establish current date and time information
-        # Note: For Python datetime.weekday() - Monday = 0, Sunday = 6
-        # For this implementation, each week starts on a Sunday and the calendar begins on the nearest elapsed Sunday
-        # The calendar will also display 5 weeks of events to cover the upcoming month, ending on a Saturday
-        powerService.sync_time()
-        currBatteryLevel = powerService.get_battery()
-        logger.info('Battery level at start: {:.3f}'.format(currBatteryLevel))
-
-        currDatetime = dt.datetime.now(displayTZ)
-        logger.info("Time synchronised to {}".format(currDatetime))
-        currDate = currDatetime.date()
-        calStartDate = currDate - dt.timedelta(days=((currDate.weekday() + (7 - weekStartDay)) % 7))
-        calEndDate = calStartDate + dt.timedelta(days=(5 * 7 - 1))
-        calStartDatetime = displayTZ.localize(dt.datetime.combine(calStartDate, dt.datetime.min.time()))
-        calEndDatetime = displayTZ.localize(dt.datetime.combine(calEndDate, dt.datetime.max.time()))
-
-        # Using Google Calendar to retrieve all events within start and end date (inclusive)
-        start = dt.datetime.now()
-        calService = CalHelper()
-        eventList = calService.retrieve_events(calendar, calStartDatetime, calEndDatetime, displayTZ, thresholdHours)
-        logger.info("Calendar events retrieved in " + str(dt.datetime.now() - start))
-
-        # Populate dictionary with information to be rendered on e-ink display
-        calDict = {'events': eventList, 'calStartDate': calStartDate, 'today': currDate, 'lastRefresh': currDatetime,
-                   'batteryLevel': currBatteryLevel, 'batteryDisplayMode': batteryDisplayMode,
-                   'dayOfWeekText': dayOfWeekText, 'weekStartDay': weekStartDay, 'maxEventsPerDay': maxEventsPerDay}
-        
-        weatherService = WeatherHelper()
-        start = dt.datetime.now()
-        weatherDict = weatherService.get_weather(latitude, longitude, apiKey, tempUnit)
-        logger.info("Weather events retrieved in " + str(dt.datetime.now() - start))
-
-        renderService = RenderHelper(imageWidth, imageHeight, rotateAngle)
-        calBlackImage = renderService.process_inputs(calDict, weatherDict, red=False)
-        calRedImage = renderService.process_inputs(calDict, weatherDict, red=True)
-
-        if isDisplayToScreen:
+    def get_display():
+        # Created on first use, the GPIO setup and library load happen once and a sleeping panel is woken on upload
+        nonlocal displayService
+        if displayService is None:
+            with metrics.importing('display.display'):
+                from display.display import DisplayHelper
             displayService = DisplayHelper(screenWidth, screenHeight)
-            displayService.update(calBlackImage, calRedImage)
-            displayService.sleep()
+        return displayService
+
+    def get_renderer():
+        if renderEngine == 'pillow':
+            with metrics.importing('render.native'):
+                from render.native import NativeRenderHelper
+            return NativeRenderHelper(imageWidth, imageHeight, rotateAngle)
+        with metrics.importing('render.render'):
+            from render.render import RenderHelper
+        return RenderHelper(imageWidth, imageHeight, rotateAngle)
+
+    def save_metrics():
+        try:
+            metrics.finish()
+        except OSError as e:
+            logger.error("Could not write the run metrics: {}".format(e))
+
+    def update():
+        # One refresh of the display, returns the events shown so the next wake-up can be planned around them
+        eventList = []
+        metrics.begin(renderEngine=renderEngine)
+        try:
+            # Establish current date and time information
+            # Note: For Python datetime.weekday() - Monday = 0, Sunday = 6
+            # For this implementation, each week starts on a Sunday and the calendar begins on the nearest elapsed Sunday
+            # The calendar will also display 5 weeks of events to cover the upcoming month, ending on a Saturday
+            # The window is computed from the system clock, which is already NTP synced when the service starts,
+            # so the calendar download does not have to wait for the PiSugar RTC sync
+            currDatetime = dt.datetime.now(displayTZ)
+            currDate = currDatetime.date()
+            calStartDate = currDate - dt.timedelta(days=((currDate.weekday() + (7 - weekStartDay)) % 7))
+            calEndDate = calStartDate + dt.timedelta(days=(5 * 7 - 1))
+            calStartDatetime = displayTZ.localize(dt.datetime.combine(calStartDate, dt.datetime.min.time()))
+            calEndDatetime = displayTZ.localize(dt.datetime.combine(calEndDate, dt.datetime.max.time()))
+
+            def fetch_power():
+                powerService.sync_time()
+                return powerService.get_battery()
 
-        currBatteryLevel = powerService.get_battery()
-        logger.info('Battery level at end: {:.3f}'.format(currBatteryLevel))
-        logger.info("Completed daily calendar update")
+            # Using Google Calendar to retrieve all events within start and end date (inclusive)
+            metrics.mark('fetch')
+            with metrics.span('fetch'):
+                results = fetch_sources({
+                    'Calendar events': lambda: calService.retrieve_events(calendar, calStartDatetime, calEndDatetime,
+                                                                          displayTZ, thresholdHours),
+                    'Weather': lambda: weatherService.get_forecast(latitude, longitude, apiKey, tempUnit),
+                    'Battery level': fetch_power,
+                }, fetchTimeout, logger, fallbacks={
+                    # only the calendar is needed to draw the page
+                    'Weather': lambda: weatherService.get_cached_forecast(latitude, longitude, tempUnit),
+                    'Battery level': lambda: None,
+                })
+            eventList = results['Calendar events']
+            if calService.stale:
+                logger.warning("Calendar could not be downloaded, showing events from the cached feed")
+            forecast = results['Weather']
+            weatherDict = forecast.get(currDate, {})
+            if weatherService.stale:
+                logger.warning("Weather could not be downloaded, showing the cached forecast")
+            currBatteryLevel = results['Battery level']
+            metrics.record('batteryStart', currBatteryLevel)
+            metrics.count('events', len(eventList))
+            if currBatteryLevel is not None:
+                logger.info('Battery level at start: {:.3f}'.format(currBatteryLevel))
+            logger.info("Time synchronised to {}".format(dt.datetime.now(displayTZ)))
 
+            # Populate dictionary with information to be rendered on e-ink display
+            calDict = {'events': eventList, 'calStartDate': calStartDate, 'today': currDate, 'lastRefresh': currDatetime,
+                       'batteryLevel': currBatteryLevel, 'batteryDisplayMode': batteryDisplayMode,
+                       'dayOfWeekText': dayOfWeekText, 'weekStartDay': weekStartDay, 'maxEventsPerDay': maxEventsPerDay,
+                       'forecast': forecast}
+
+            renderService = get_renderer()
+            renderHash = renderService.get_input_hash(calDict, weatherDict)
+            if isDisplayToScreen and renderService.is_unchanged(renderHash):
+                metrics.record('unchanged', True)
+                logger.info("Calendar unchanged since last update, skipping render and display")
+            else:
+                start = dt.datetime.now()
+                with metrics.span('render'):
+                    calBlackImage, calRedImage = renderService.render(calDict, weatherDict)
+                logger.info("Calendar rendered in " + str(dt.datetime.now() - start))
+
+                if isDisplayToScreen:
+                    get_display().update(calBlackImage, calRedImage)
+                    get_display().sleep()
+                    renderService.save_state(renderHash)
+
+            if currBatteryLevel is not None:
+                startBatteryLevel = currBatteryLevel
+                currBatteryLevel = powerService.get_battery(maxAge=0)
+                metrics.record('batteryEnd', currBatteryLevel)
+                metrics.record('batteryUsedMah', round((startBatteryLevel - currBatteryLevel) / 100 * batteryCapacityMah, 1))
+                logger.info('Battery level at end: {:.3f}'.format(currBatteryLevel))
+            logger.info("Completed daily calendar update")
+
+        except Exception as e:
+            traceback.print_exc()
+            get_renderer().forget_state()
+            get_display().displayError(str(e))
+            metrics.record('error', str(e))
+            logger.error(e)
+        return eventList
+
+    if runMode == 'daemon':
+        # Refreshes until the service is stopped, the device is never shut down and no RTC wake-up is set
+        logger.info("Running as a daemon, refreshing every {} minutes".format(refreshMinutes))
+        while True:
+            # A fault while showing the error screen (GPIO, SPI) must not end the process, the next refresh retries
+            try:
+                eventList = update()
+            except Exception as e:
+                traceback.print_exc()
+                metrics.record('error', str(e))
+                logger.error("Refresh failed: {}".format(e))
+                eventList = []
+            save_metrics()
+            refreshTime, reason = scheduler.next_refresh(dt.datetime.now(displayTZ), eventList, refreshMinutes,
+                                                         refreshAtEvents)
+            logger.info("Next refresh at {} ({})".format(refreshTime.isoformat(), reason))
+            remaining = (refreshTime - dt.datetime.now(displayTZ)).total_seconds()
+            while remaining > 0:
+                time.sleep(min(remaining, DAEMON_CHECK_SECONDS))
+                remaining = (refreshTime - dt.datetime.now(displayTZ)).total_seconds()
+
+    try:
+        # Arm the daily update before any work, a run woken at another time that dies would otherwise leave the
+        # alarm at that time
+        powerService.set_wake(scheduler.next_daily(dt.datetime.now(displayTZ)))
     except Exception as e:
-        traceback.print_exc()
-        displayErrorService = DisplayHelper(screenWidth, screenHeight)
-        displayErrorService.displayError(str(e))
-        logger.error(e)
-        
+        logger.error("Could not arm the daily wake-up: {}".format(e))
+
+    eventList = []
+    try:
+        eventList = update()
     finally:
         logger.info("Entering shutdown flow")
-        while powerService.is_charging():
-            time.sleep(30)
+        try:
+            # Stay up while on external power, refreshing every chargeRefreshMinutes or right away on a single tap
+            # of the PiSugar button. Waiting on the button event connection replaces the plain sleep, there is no
+            # event for unplugging so the plugged state is read again every CHARGE_CHECK_SECONDS
+            nextRefresh = time.monotonic() + chargeRefreshMinutes * 60
+            while powerService.is_charging(maxAge=0):
+                event = powerService.wait_event(CHARGE_CHECK_SECONDS)
+                if event == 'single' or time.monotonic() >= nextRefresh:
+                    logger.info("Refreshing while charging")
+                    save_metrics()
+                    eventList = update()
+                    nextRefresh = time.monotonic() + chargeRefreshMinutes * 60
+            with metrics.span('shutdown'):
+                wakeTime, reason = scheduler.next_wake(dt.datetime.now(displayTZ), eventList)
+                powerService.set_wake(wakeTime)
+            metrics.record('nextWake', wakeTime.isoformat())
+            logger.info("Next wake-up at {} ({})".format(wakeTime.isoformat(), reason))
+        except Exception as e:
+            logger.error("Could not schedule the next wake-up: {}".format(e))
+        save_metrics()
         logger.info("Device not charging — shutting down safely.")
         os.system("sudo shutdown -h now")
 
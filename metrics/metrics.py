@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Lightweight per-run instrumentation. The stages of an update are wrapped in span() and the helpers add counters
+and values with count() and record(). Everything lands in the current run, which finish() appends as one JSON line
+to a size rotated metrics file, e.g.
+
+    metrics.begin()
+    with metrics.span('render'):
+        ...
+    metrics.finish()
+
+Spans and counters outside a run are measured but dropped, so the helpers can be used from wifi.py or a bench.
+Modules imported on first use are timed with importing(), those times are kept until the next run is written.
+"""
+
+import contextlib
+import datetime as dt
+import json
+import os
+import pathlib
+import resource
+import sys
+import threading
+import time
+
+METRICS_FILE = str(pathlib.Path(__file__).parent.absolute()) + '/runs.jsonl'
+MAX_BYTES = 256 * 1024  # the metrics file is rotated once it grows past this
+BACKUP_COUNT = 3  # rotated files kept as runs.jsonl.1 ... runs.jsonl.3
+
+
+class MetricsRecorder:
+
+    def __init__(self, metricsFile=METRICS_FILE, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT):
+        self.metricsFile = metricsFile
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        self.lock = threading.Lock()  # spans of the concurrent fetches end on other threads
+        self.run = None
+        self.imports = {}  # module -> seconds its first import took, reported with the next finished run
+
+    def begin(self, **fields):
+        # Starts collecting a new run, fields are stored with it as they are
+        with self.lock:
+            self.run = dict(fields, start=dt.datetime.now().astimezone().isoformat(), stages={}, counters={},
+                            marks={}, processSeconds=self.process_age())
+            self.startTime = time.perf_counter()
+            self.startCpu = time.process_time()
+            self.startChildren = self.children_cpu()
+
+    def process_age(self):
+        # Seconds since this process was started, interpreter startup and imports included. Linux only
+        try:
+            with open('/proc/self/stat', 'r') as file:
+                fields = file.read().rsplit(')', 1)[1].split()
+            with open('/proc/uptime', 'r') as file:
+                uptime = float(file.read().split()[0])
+        except (OSError, IndexError, ValueError):
+            return None
+        return round(uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK'), 3)
+
+    def children_cpu(self):
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+
+    @contextlib.contextmanager
+    def span(self, name):
+        # Wall and cpu time of one stage. Repeated or concurrent spans of the same name add up, calls counts them
+        start = time.perf_counter()
+        startCpu = time.thread_time()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            cpuSeconds = time.thread_time() - startCpu
+            with self.lock:
+                if self.run is not None:
+                    stage = self.run['stages'].setdefault(name, {'seconds': 0.0, 'cpuSeconds': 0.0, 'calls': 0})
+                    stage['seconds'] += seconds
+                    stage['cpuSeconds'] += cpuSeconds
+                    stage['calls'] += 1
+
+    @contextlib.contextmanager
+    def importing(self, name):
+        # Times the import of a module loaded on first use, like python -X importtime does for the whole process.
+        # Nothing is recorded when the module is already loaded
+        loaded = name in sys.modules
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if not loaded and name in sys.modules:
+                with self.lock:
+                    self.imports[name] = round(time.perf_counter() - start, 4)
+
+    def mark(self, name):
+        # Process age the first time a point of the run is reached, e.g. the first byte sent to the panel
+        age = self.process_age()
+        with self.lock:
+            if self.run is not None and name not in self.run['marks']:
+                self.run['marks'][name] = age
+
+    def count(self, name, value=1):
+        with self.lock:
+            if self.run is not None:
+                self.run['counters'][name] = self.run['counters'].get(name, 0) + value
+
+    def record(self, name, value):
+        with self.lock:
+            if self.run is not None:
+                self.run[name] = value
+
+    def finish(self):
+        # Closes the current run with its totals and peak memory and appends it to the metrics file
+        with self.lock:
+            run, self.run = self.run, None
+            if run is None:
+                return None
+            run['imports'], self.imports = self.imports, {}
+        run['seconds'] = time.perf_counter() - self.startTime
+        run['cpuSeconds'] = time.process_time() - self.startCpu
+        run['childCpuSeconds'] = self.children_cpu() - self.startChildren  # wkhtmltoimage and other subprocesses
+        # ru_maxrss is in kilobytes on Linux and the peak of the whole process, not of this run alone
+        run['peakRssKb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        run['childPeakRssKb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        for stage in run['stages'].values():
+            stage['seconds'] = round(stage['seconds'], 4)
+            stage['cpuSeconds'] = round(stage['cpuSeconds'], 4)
+        for key in ('seconds', 'cpuSeconds', 'childCpuSeconds'):
+            run[key] = round(run[key], 4)
+        self.append(json.dumps(run, default=str))
+        return run
+
+    def append(self, line):
+        data = line.encode('utf-8') + b'\n'
+        os.makedirs(os.path.dirname(self.metricsFile), exist_ok=True)
+        if os.path.exists(self.metricsFile) and os.path.getsize(self.metricsFile) + len(data) > self.maxBytes:
+            self.rotate()
+        with open(self.metricsFile, 'ab') as file:
+            file.write(data)
+
+    def rotate(self):
+        for i in range(self.backupCount - 1, 0, -1):
+            if os.path.exists('{}.{}'.format(self.metricsFile, i)):
+                os.replace('{}.{}'.format(self.metricsFile, i), '{}.{}'.format(self.metricsFile, i + 1))
+        if self.backupCount:
+            os.replace(self.metricsFile, self.metricsFile + '.1')
+        else:
+            os.remove(self.metricsFile)
+
+    def last_runs(self, count):
+        # The newest runs, oldest first, read from the current file and as many rotated ones as needed
+        runs = []
+        for i in range(self.backupCount + 1):
+            path = self.metricsFile if i == 0 else '{}.{}'.format(self.metricsFile, i)
+            try:
+                with open(path, 'r') as file:
+                    lines = file.read().splitlines()
+            except OSError:
+                break
+            for line in reversed(lines):
+                try:
+                    runs.append(json.loads(line))
+                except ValueError:
+                    continue  # a line cut short by a power loss
+                if len(runs) >= count:
+                    return runs[::-1]
+        return runs[::-1]
+
+
+_recorder = MetricsRecorder()
+
+begin = _recorder.begin
+span = _recorder.span
+importing = _recorder.importing
+mark = _recorder.mark
+count = _recorder.count
+record = _recorder.record
+finish = _recorder.finish
+last_runs = _recorder.last_runs
+
+
+def set_metrics_file(metricsFile):
+    # Sends the runs of this process somewhere else, e.g. the benchmark keeps them out of the device's history
+    _recorder.metricsFile = metricsFile
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stand-in for pisugar-server. Answers the TCP text protocol from an in-memory state so PowerHelper, the wifi.py
+battery endpoint and anything else talking to PiSugar can run and be benchmarked off-device, e.g.
+
+    server = FakePiSugarServer(port=0).start()
+    power = PowerHelper(port=server.port)
+"""
+
+import socket
+import socketserver
+import threading
+import time
+
+DEFAULT_STATE = {
+    'version': '1.7.0',
+    'model': 'PiSugar 3',
+    'battery': 87.5,
+    'battery_v': 4.05,
+    'battery_i': 0.12,
+    'battery_charging': False,
+    'battery_power_plugged': False,
+    'temperature': 31.0,
+    'rtc_time': '2024-01-01T06:00:00.000+00:00',
+    'rtc_alarm_time': '2024-01-01T06:00:00.000+00:00',
+    'rtc_alarm_enabled': True,
+    'alarm_repeat': 127,
+    'auto_power_on': True,
+}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.fake.connections.append(self.wfile)
+
+    def finish(self):
+        self.server.fake.connections.remove(self.wfile)
+        super().finish()
+
+    def handle(self):
+        # Like the real server every received chunk is one request, with or without a trailing newline (the
+        # pisugar package sends none). Several commands pipelined into one write are not split up, the chunk as a
+        # whole is answered as invalid
+        fake = self.server.fake
+        while True:
+            data = self.request.recv(4096)
+            if not data:
+                return
+            request = data.decode('utf-8').strip()
+            if not request:
+                continue
+            fake.requests.append(request)
+            if fake.latency:
+                time.sleep(fake.latency)
+            response = 'Invalid request.' if '\n' in request else fake.respond(request)
+            self.wfile.write(response.encode('utf-8') + b'\n')
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakePiSugarServer:
+
+    def __init__(self, host='127.0.0.1', port=8423, state=None, latency=0):
+        # port 0 picks a free port, latency is added to every answer to mimic the I2C reads of the real server
+        self.state = dict(DEFAULT_STATE, **(state or {}))
+        self.latency = latency
+        self.requests = []  # every command received, in order
+        self.connections = []
+        self.server = _Server((host, port), _Handler)
+        self.server.fake = self
+        self.host, self.port = self.server.server_address
+
+    def respond(self, request):
+        parts = request.split(' ')
+        if parts[0] == 'get' and len(parts) > 1:
+            name = parts[1]
+            if name not in self.state:
+                return 'Invalid request.'
+            value = self.state[name]
+            return '{}: {}'.format(name, str(value).lower() if isinstance(value, bool) else value)
+        name, args = parts[0], parts[1:]
+        if name == 'rtc_alarm_set' and args:
+            self.state['rtc_alarm_time'] = args[0]
+            self.state['rtc_alarm_enabled'] = True
+            if len(args) > 1:
+                self.state['alarm_repeat'] = int(args[1])
+        elif name == 'rtc_alarm_disable':
+            self.state['rtc_alarm_enabled'] = False
+        elif name == 'set_auto_power_on' and args:
+            self.state['auto_power_on'] = args[0] == 'true'
+        elif name not in ('rtc_web', 'rtc_pi2rtc', 'rtc_rtc2pi'):
+            return 'Invalid request.'
+        return '{}: done'.format(name)
+
+    def push_event(self, event):
+        # Sends a button event ('single', 'double' or 'long') to every open connection
+        for wfile in list(self.connections):
+            wfile.write(event.encode('utf-8') + b'\n')
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    print('Fake PiSugar server listening on 127.0.0.1:8423')
+    FakePiSugarServer().server.serve_forever()
@@ -5,24 +5,176 @@ This script exposes the functions to interface with PiSugar. Mainly to retrieve
 to trigger the syncing of the PiSugar
 """
 
-from pisugar import *
+import select
 import socket
 import logging
+import threading
+import time
 
 HOST = "127.0.0.1"
 PORT = 8423
+CACHE_SECONDS = 2  # battery status younger than this is served without asking the server again
+
+# Battery status fields read together by PiSugarClient.status(), with the server property and value parser of each
+STATUS_FIELDS = {
+    'level': ('battery', float),
+    'charging': ('battery_charging', lambda value: value.lower() == 'true'),
+    'plugged': ('battery_power_plugged', lambda value: value.lower() == 'true'),
+    'model': ('model', str),
+    'temperature': ('temperature', float),
+}
+
+BUTTON_EVENTS = ('single', 'double', 'long')
+
+_clients = {}
+_clientsLock = threading.Lock()
+
+
+class PiSugarClient:
+    # Speaks the pisugar-server text protocol over one connection kept open for the life of the process.
+    # Like the official client every command is its own write, answered with one "name: value" line before the
+    # next one is sent. Calls are serialised, the client is shared between threads
+
+    def __init__(self, host=HOST, port=PORT, timeout=5):
+        self.logger = logging.getLogger('einkcal')
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+        self.eventSock = None
+        self.lock = threading.Lock()
+        self.cache = None
+        self.cacheTime = 0
+        self.lastGood = {}  # last successfully parsed value of each status field
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), self.timeout)
+        self.reader = self.sock.makefile('rb')
+
+    def close(self):
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+        self.sock = None
+        self.reader = None
+
+    def wait_event(self, timeout):
+        # Blocks on the server's event connection until a button event arrives or the timeout passes, then returns
+        # 'single', 'double', 'long' or None. Without a connection it still waits out the timeout, so callers
+        # polling in a loop never spin
+        deadline = time.monotonic() + timeout
+        try:
+            if self.eventSock is None:
+                self.eventSock = socket.create_connection((self.host, self.port), self.timeout)
+            readable, _, _ = select.select([self.eventSock], [], [], timeout)
+            if not readable:
+                return None
+            data = self.eventSock.recv(4096)
+            if not data:
+                raise ConnectionError('PiSugar server closed the event connection')
+        except OSError:
+            if self.eventSock is not None:
+                self.eventSock.close()
+            self.eventSock = None
+            time.sleep(max(0, deadline - time.monotonic()))
+            return None
+        for event in data.decode('utf-8').split():
+            if event in BUTTON_EVENTS:
+                return event
+        return None
+
+    def exchange(self, commands):
+        # Sends the commands one by one on the open connection and returns their response lines in order
+        return [self.round_trip(command) for command in commands]
+
+    def round_trip(self, command):
+        # One command and its response line. A dropped connection is reopened and the command retried once
+        payload = command.encode('utf-8') + b'\n'
+        for attempt in range(2):
+            try:
+                if self.sock is None:
+                    self.connect()
+                self.sock.sendall(payload)
+                while True:
+                    line = self.reader.readline()
+                    if not line:
+                        raise ConnectionError('PiSugar server closed the connection')
+                    line = line.decode('utf-8').strip()
+                    # button events can arrive on the command connection as well
+                    if line and line not in BUTTON_EVENTS:
+                        return line
+            except OSError:
+                self.close()
+                if attempt:
+                    raise
+
+    def query(self, *names):
+        # Reads several properties over the open connection, e.g. query('battery', 'model') -> {'battery': '85.3', ...}
+        with self.lock:
+            lines = self.exchange(['get ' + name for name in names])
+        values = {}
+        for name, line in zip(names, lines):
+            key, _, value = line.partition(':')
+            values[name] = value.strip() if key.strip() == name else None
+        return values
+
+    def command(self, name, *args):
+        with self.lock:
+            line, = self.exchange([' '.join((name,) + args)])
+        if 'done' not in line:
+            raise RuntimeError('PiSugar {} failed: {}'.format(name, line))
+
+    def status(self, maxAge=CACHE_SECONDS):
+        # Level, charging, plugged, model and temperature read together, cached for maxAge seconds
+        if self.cache is not None and time.monotonic() - self.cacheTime < maxAge:
+            return self.cache
+        values = self.query(*[prop for prop, _ in STATUS_FIELDS.values()])
+        status = {}
+        for field, (prop, parse) in STATUS_FIELDS.items():
+            try:
+                status[field] = parse(values[prop])
+            except (TypeError, ValueError):
+                # a garbled reply keeps the last good value, None only if there never was one (e.g. no
+                # temperature sensor on this model)
+                status[field] = self.lastGood.get(field)
+            if status[field] is not None:
+                self.lastGood[field] = status[field]
+        self.cache = status
+        self.cacheTime = time.monotonic()
+        return status
+
+    def invalidate(self):
+        self.cache = None
+
+
+def get_client(host=HOST, port=PORT):
+    # One shared client per server address and process
+    with _clientsLock:
+        if (host, port) not in _clients:
+            _clients[(host, port)] = PiSugarClient(host, port)
+        return _clients[(host, port)]
+
 
 class PowerHelper:
-    def __init__(self):
+    def __init__(self, host=HOST, port=PORT):
         self.logger = logging.getLogger('einkcal')
-        conn, event_conn = connect_tcp("127.0.0.1", 8423)
-        self.pisugar = PiSugarServer(conn, event_conn)
+        self.pisugar = get_client(host, port)
 
     def sync_time(self) -> None:
-        self.pisugar.rtc_web()
+        self.pisugar.command('rtc_web')
+
+    def get_battery(self, maxAge=CACHE_SECONDS) -> float:
+        return self.pisugar.status(maxAge)['level']
+
+    def is_charging(self, maxAge=CACHE_SECONDS) -> bool:
+        return self.pisugar.status(maxAge)['plugged']
 
-    def get_battery(self) -> float:
-        return self.pisugar.get_battery_level()
+    def wait_event(self, timeout):
+        return self.pisugar.wait_event(timeout)
 
-    def is_charging(self) -> bool:
-        return self.pisugar.get_battery_power_plugged()
+    def set_wake(self, wakeTime, repeat=127):
+        # Re-arms the RTC alarm. It repeats daily so the device still wakes if a later run fails to re-arm it
+        self.pisugar.command('set_auto_power_on', 'false')
+        self.pisugar.command('rtc_alarm_set', wakeTime.isoformat(), str(repeat))
+        self.pisugar.command('set_auto_power_on', 'true')
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chooses when the PiSugar RTC should wake the calendar next. Besides the daily update time the display can be
+refreshed at the day rollover and ahead of upcoming timed events so last minute changes show up, both off by
+default. A minimum gap between wakes bounds how many refreshes a day can cost. Refreshes while charging happen in
+main.py, the device stays up on external power. A resident process asks for its next refresh instead, which also
+follows the starts and ends of the events on screen.
+"""
+
+import datetime as dt
+
+
+class WakeScheduler:
+
+    def __init__(self, tz, updateHour, updateMinute=0, atRollover=False, eventLeadMinutes=0, minGapMinutes=60):
+        self.tz = tz
+        self.updateTime = dt.time(updateHour, updateMinute)
+        self.atRollover = atRollover
+        self.eventLead = dt.timedelta(minutes=eventLeadMinutes)  # 0 disables the wakes ahead of events
+        self.minGap = dt.timedelta(minutes=minGapMinutes)
+
+    def at(self, date, time):
+        return self.tz.localize(dt.datetime.combine(date, time))
+
+    def candidates(self, now, events):
+        # (wake time, reason) pairs, not all of them in the future
+        today = now.date()
+        tomorrow = today + dt.timedelta(days=1)
+        yield self.at(today, self.updateTime), 'daily update'
+        yield self.at(tomorrow, self.updateTime), 'daily update'
+        yield self.at(tomorrow + dt.timedelta(days=1), self.updateTime), 'daily update'
+        if self.atRollover:
+            yield self.at(tomorrow, dt.time(0, 1)), 'day rollover'
+        if self.eventLead:
+            for event in events:
+                if not event.allday:
+                    yield dt.datetime.fromtimestamp(event.start, self.tz) - self.eventLead, 'upcoming event'
+
+    def next_wake(self, now, events=()):
+        # Earliest candidate at least minGap away, the daily update is always one of them. A gap longer than the
+        # candidates reach falls back to the next daily update
+        earliest = now + self.minGap
+        wake, reason = min(((time, reason) for time, reason in self.candidates(now, events)
+                            if time >= earliest), key=lambda candidate: candidate[0], default=(None, None))
+        if wake is None:
+            return self.next_daily(now), 'daily update'
+        return wake, reason
+
+    def next_daily(self, now):
+        # Next daily update after now. The alarm repeats daily at the time it is set to, so arming this first
+        # keeps the daily update even if a run woken for something else dies before it re-arms the alarm
+        return min(time for time, reason in self.candidates(now, ()) if reason == 'daily update' and time > now)
+
+    def next_refresh(self, now, events=(), intervalMinutes=30, atEvents=True):
+        # Next refresh of a process that stays up: the regular interval, the day rollover or, when atEvents is set,
+        # the next start or end of a timed event. A refresh that changes nothing on screen skips the panel anyway
+        candidates = [(now + dt.timedelta(minutes=intervalMinutes), 'interval'),
+                      (self.at(now.date() + dt.timedelta(days=1), dt.time(0, 0, 5)), 'day rollover')]
+        if atEvents:
+            for event in events:
+                if event.allday:
+                    continue
+                for boundary in (dt.datetime.fromtimestamp(event.start, self.tz) - self.eventLead,
+                                 dt.datetime.fromtimestamp(event.end, self.tz)):
+                    if boundary > now:
+                        candidates.append((boundary, 'event boundary'))
+        return min(candidates, key=lambda candidate: candidate[0])
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Day bucketing of the calendar page shared by every renderer. CalendarGrid takes the sorted event list once and
+lays it out over the 35 day cells: which events each cell shows, how many lines each may wrap to, the "N more"
+overflow count, the text of every entry and the forecast of the day, so the renderers only have to draw.
+"""
+
+from datetime import timedelta
+import math
+
+
+class CalendarGrid:
+
+    def __init__(self, calDict, shortTime, days=35):
+        # shortTime formats an event start time, e.g. RenderHelper.get_short_time
+        self.startDate = calDict['calStartDate']
+        self.startDay = self.startDate.toordinal()
+        self.today = calDict['today']
+        self.maxEventsPerDay = calDict['maxEventsPerDay']
+        self.forecast = calDict.get('forecast', {})
+        self.days = days
+        self.timeCache = {}
+        self.cells = [self.new_cell(i) for i in range(days)]
+        self.fill(calDict['events'], shortTime)
+
+    def new_cell(self, i):
+        date = self.startDate + timedelta(days=i)
+        return {'date': date, 'isToday': date == self.today, 'muted': date.month != self.today.month,
+                'forecast': self.forecast.get(date), 'events': [], 'count': 0, 'lineLimit': 1, 'more': 0}
+
+    def day_range(self, event):
+        # First and last cell covered by the event, clamped to the page. Both ends are inclusive
+        first = event.startDay - self.startDay
+        last = event.endDay - self.startDay if event.isMultiday else first
+        return max(first, 0), min(last, self.days - 1)
+
+    def fill(self, events, shortTime):
+        maxEventsPerDay = self.maxEventsPerDay
+        ranges = [self.day_range(event) for event in events]
+
+        # Events per cell from a difference array over the day indexes, so truncation is known up front
+        diff = [0] * (self.days + 1)
+        for first, last in ranges:
+            if first <= last:
+                diff[first] += 1
+                diff[last + 1] -= 1
+        count = 0
+        for i, cell in enumerate(self.cells):
+            count += diff[i]
+            cell['count'] = count
+            if count:
+                cell['lineLimit'] = max(math.floor(maxEventsPerDay / count), 1)
+            cell['more'] = max(count - maxEventsPerDay, 0)
+
+        # Events arrive sorted by start, so the first maxEventsPerDay placed in a cell are the ones shown.
+        # Cells that are already full are skipped, an event only costs the cells it can still appear in
+        for event, (first, last) in zip(events, ranges):
+            if first > last:
+                continue
+            startIdx = event.startDay - self.startDay
+            text = None
+            for i in range(first, last + 1):
+                cellEvents = self.cells[i]['events']
+                if len(cellEvents) >= maxEventsPerDay:
+                    continue
+                if text is None:
+                    text = self.event_text(event, shortTime)
+                # ► on the first day of a multi-day event, ◄ on the days it continues into
+                arrow = None
+                if event.isMultiday:
+                    arrow = 'right' if i == startIdx else 'left'
+                cellEvents.append({'event': event, 'text': text, 'arrow': arrow})
+
+    def event_text(self, event, shortTime):
+        if event.isMultiday or event.allday:
+            return event.summary
+        if event.startMinute not in self.timeCache:
+            self.timeCache[event.startMinute] = shortTime(event.startTime)
+        return self.timeCache[event.startMinute] + ' ' + event.summary
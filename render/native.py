@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Native Pillow renderer. Draws the same calendar page as the HTML template directly with ImageDraw, producing
+the black and red planes in memory without starting wkhtmltoimage. Fonts and weather icons are taken from the
+data URIs embedded in css/styles.css so both renderers share the same assets.
+"""
+
+from io import BytesIO
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+from render.render import RenderHelper
+import base64
+import html
+import re
+
+# Layout in CSS pixels of the portrait page, taken from styles.css and bootstrap (1rem = 16px)
+PAGE_PADDING = 16
+ICON_SIZE = 208
+FORECAST_TOP = 240
+FORECAST_SIZE = 32
+DAY_NAMES_TOP = 330
+DAY_NAMES_SIZE = 16
+ROW_HEIGHT = 184
+DATE_SIZE = 48
+DATE_MARGIN = 8
+CIRCLE_SIZE = 64
+EVENT_SIZE = 16
+EVENT_LINE_HEIGHT = 24
+CELL_FORECAST_MARGIN = 4
+CELL_ICON_SIZE = 20
+CELL_TEMP_SIZE = 12
+CELL_TEMP_LINE_HEIGHT = 14
+BATTERY_BOX = (925, 5, 53, 27)
+BATTERY_OFFSETS = {'battery80': 0, 'battery60': 44, 'battery40': 89, 'battery20': 134, 'battery0': 178}
+
+BLACK = 0
+MUTED = 0x6c  # bootstrap text-muted, dithered to a gray tone when converted to 1bpp
+WHITE = 255
+
+_fonts = {}
+_assets = {}
+_icons = {}  # rasterised weather icons and the battery sprite, kept for the life of the process
+
+
+def _load_assets(cssPath):
+    # Parses styles.css once per process: embedded font files, the weather icon SVG font and the
+    # OpenWeatherMap condition id to icon codepoint table
+    if _assets:
+        return _assets
+    with open(cssPath, 'r') as file:
+        css = file.read()
+    for name, data in re.findall(r"font-family:\s*'([^']+)';[^}]*?src:\s*url\('?data:[^;]+;(?:charset=utf-8;)?base64,"
+                                 r"([A-Za-z0-9+/=]+)", css):
+        _assets[name] = base64.b64decode(data)
+    _assets['owm'] = {int(owmId): int(code, 16)
+                      for owmId, code in re.findall(r'\.wi-owm-(\d+):before\{content:"\\(f[0-9a-f]+)"\}', css)}
+    svg = _assets.get('weathericons', b'').decode('utf-8')
+    face = re.search(r'<font-face[^>]*units-per-em="(\d+)"[^>]*ascent="(-?\d+)"[^>]*descent="(-?\d+)"', svg)
+    _assets['iconMetrics'] = tuple(int(v) for v in face.groups()) if face else (2048, 1755, -293)
+    glyphs = {}
+    for tag in re.findall(r'<glyph[^>]*>', svg):
+        unicode = re.search(r'unicode="([^"]+)"', tag)
+        path = re.search(r' d="([^"]*)"', tag)
+        if unicode and path:
+            char = html.unescape(unicode.group(1))
+            if len(char) == 1:
+                glyphs[ord(char)] = path.group(1)
+    _assets['glyphs'] = glyphs
+    return _assets
+
+
+def _svg_subpaths(path):
+    # Flattens the SVG glyph path data (M/L/H/V/Q/T/Z, absolute and relative) into closed polygons
+    tokens = re.findall(r'[MmLlHhVvQqTtZz]|-?(?:\d+\.?\d*|\.\d+)(?:[eE]-?\d+)?', path)
+    subpaths, points = [], []
+    x = y = 0.0
+    ctrl = None
+    cmd = None
+    i = 0
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            cmd = tokens[i]
+            i += 1
+            if cmd in 'Zz':
+                if points:
+                    subpaths.append(points)
+                    x, y = points[0]
+                points, ctrl = [], None
+                continue
+        rel = cmd.islower()
+        op = cmd.upper()
+        if op in 'ML':
+            nx, ny = float(tokens[i]), float(tokens[i + 1])
+            i += 2
+            if rel:
+                nx, ny = x + nx, y + ny
+            if op == 'M':
+                if points:
+                    subpaths.append(points)
+                points = []
+                cmd = 'l' if rel else 'L'
+            x, y = nx, ny
+            points.append((x, y))
+            ctrl = None
+        elif op in 'HV':
+            value = float(tokens[i])
+            i += 1
+            if op == 'H':
+                x = x + value if rel else value
+            else:
+                y = y + value if rel else value
+            points.append((x, y))
+            ctrl = None
+        elif op in 'QT':
+            if op == 'Q':
+                cx, cy = float(tokens[i]), float(tokens[i + 1])
+                i += 2
+                if rel:
+                    cx, cy = x + cx, y + cy
+            else:
+                cx, cy = (2 * x - ctrl[0], 2 * y - ctrl[1]) if ctrl else (x, y)
+            nx, ny = float(tokens[i]), float(tokens[i + 1])
+            i += 2
+            if rel:
+                nx, ny = x + nx, y + ny
+            for step in range(1, 9):
+                t = step / 8
+                points.append(((1 - t) ** 2 * x + 2 * (1 - t) * t * cx + t * t * nx,
+                               (1 - t) ** 2 * y + 2 * (1 - t) * t * cy + t * t * ny))
+            x, y, ctrl = nx, ny, (cx, cy)
+        else:
+            i += 1
+    if points:
+        subpaths.append(points)
+    return subpaths
+
+
+class NativeRenderHelper(RenderHelper):
+
+    def __init__(self, width, height, angle):
+        super().__init__(width, height, angle)
+        self.assets = _load_assets(self.currPath + '/css/styles.css')
+        self.iconCache = _icons
+
+    def get_font(self, name, size):
+        key = (name, size)
+        if key not in _fonts:
+            _fonts[key] = ImageFont.truetype(BytesIO(self.assets[name]), size)
+        return _fonts[key]
+
+    def get_icon(self, owmId, size):
+        # Rasterises a weather icon glyph once into a 1bpp mask, even-odd filled
+        key = (owmId, size)
+        if key in self.iconCache:
+            return self.iconCache[key]
+        icon = None
+        path = self.assets['glyphs'].get(self.assets['owm'].get(owmId))
+        if path:
+            unitsPerEm, ascent, descent = self.assets['iconMetrics']
+            scale = size / unitsPerEm
+            icon = Image.new('1', (int(size * 1.5), int((ascent - descent) * scale) + 1), 0)
+            for points in _svg_subpaths(path):
+                if len(points) < 3:
+                    continue
+                layer = Image.new('1', icon.size, 0)
+                ImageDraw.Draw(layer).polygon([(px * scale, (ascent - py) * scale) for px, py in points], fill=1)
+                icon = ImageChops.logical_xor(icon, layer)
+            bbox = icon.getbbox()
+            icon = icon.crop(bbox) if bbox else None
+        self.iconCache[key] = icon
+        return icon
+
+    def wrap_text(self, text, font, width):
+        lines, line = [], ''
+        for word in text.split(' '):
+            candidate = word if not line else line + ' ' + word
+            if font.getlength(candidate) <= width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            line = ''
+            for char in word:
+                if font.getlength(line + char) > width and line:
+                    lines.append(line)
+                    line = ''
+                line += char
+        lines.append(line)
+        return lines
+
+    def draw_centered(self, draw, box, text, font, fill, bold=False):
+        x0, y0, x1, y1 = box
+        stroke = 1 if bold else 0
+        left, top, right, bottom = draw.textbbox((0, 0), text, font=font, stroke_width=stroke)
+        draw.text((x0 + (x1 - x0 - (right - left)) / 2 - left, y0 + (y1 - y0 - (bottom - top)) / 2 - top), text,
+                  font=font, fill=fill, stroke_width=stroke, stroke_fill=fill)
+
+    def draw_arrow(self, draw, x, y, right, fill):
+        # The ► and ◄ markers of multi-day events, the embedded font subset has no such glyphs
+        if right:
+            draw.polygon([(x, y + 6), (x + 10, y + 12), (x, y + 18)], fill=fill)
+        else:
+            draw.polygon([(x + 10, y + 6), (x, y + 12), (x + 10, y + 18)], fill=fill)
+        return 13
+
+    def draw_header(self, draw, image, calDict, weatherDict):
+        width = self.imageWidth
+        if weatherDict:
+            icon = self.get_icon(weatherDict.get('id'), ICON_SIZE)
+            if icon is not None:
+                draw.bitmap(((width - icon.width) // 2, PAGE_PADDING + (FORECAST_TOP - PAGE_PADDING - icon.height) // 2),
+                            icon, fill=BLACK)
+            forecast = "{0}% | {1}-{2}°".format(weatherDict.get('pop'), weatherDict.get('low'), weatherDict.get('high'))
+            self.draw_centered(draw, (0, FORECAST_TOP, width, FORECAST_TOP + FORECAST_SIZE * 2), forecast,
+                               self.get_font('NotoSansBold', FORECAST_SIZE), BLACK, bold=True)
+
+        battText = self.get_battery_text(calDict['batteryLevel'], calDict['batteryDisplayMode'])
+        if battText in BATTERY_OFFSETS:
+            if 'battery' not in self.iconCache:
+                self.iconCache['battery'] = Image.open(self.currPath + '/battery.png').convert('RGBA')
+            left, top, boxWidth, boxHeight = BATTERY_BOX
+            offset = BATTERY_OFFSETS[battText]
+            sprite = self.iconCache['battery'].crop((0, offset, boxWidth, offset + boxHeight))
+            image.paste(sprite.convert('L'), (left, top), sprite)
+
+        columnWidth = (width - 2 * PAGE_PADDING) / 7
+        font = self.get_font('NotoSansBold', DAY_NAMES_SIZE)
+        for i in range(7):
+            x = PAGE_PADDING + i * columnWidth
+            text = calDict['dayOfWeekText'][(i + calDict['weekStartDay']) % 7].upper()
+            self.draw_centered(draw, (x, DAY_NAMES_TOP, x + columnWidth, DAY_NAMES_TOP + DAY_NAMES_SIZE), text, font,
+                               BLACK, bold=True)
+
+    def draw_cell(self, black, red, box, cell):
+        x0, y0, x1, y1 = box
+        currDate = cell['date']
+        dateFont = self.get_font('NotoSansBold', DATE_SIZE)
+        if cell['isToday']:
+            cx = (x0 + x1) / 2
+            red.ellipse((cx - CIRCLE_SIZE / 2, y0, cx + CIRCLE_SIZE / 2, y0 + CIRCLE_SIZE), fill=BLACK)
+            self.draw_centered(red, (x0, y0, x1, y0 + CIRCLE_SIZE), str(currDate.day),
+                               self.get_font('NotoSans', DATE_SIZE), WHITE)
+            top = y0 + CIRCLE_SIZE
+        else:
+            fill = MUTED if cell['muted'] else BLACK
+            self.draw_centered(black, (x0, y0 + DATE_MARGIN, x1, y0 + DATE_MARGIN + DATE_SIZE), str(currDate.day),
+                               dateFont, fill, bold=True)
+            top = y0 + DATE_MARGIN * 2 + DATE_SIZE
+        if cell['forecast']:
+            self.draw_cell_forecast(black, box, cell['forecast'])
+
+        fill = MUTED if cell['muted'] else BLACK
+        eventFont = self.get_font('NotoSansBold', EVENT_SIZE)
+        event_line_limit = cell['lineLimit']
+        for entry in cell['events']:
+            # events of red calendars are drawn in the red plane
+            draw, eventFill = (red, BLACK) if entry['event'].color == 'red' else (black, fill)
+            x = x0
+            if entry['arrow']:
+                x += self.draw_arrow(draw, x, top, entry['arrow'] == 'right', eventFill)
+            lines = self.wrap_text(entry['text'], eventFont, x1 - x - 2)
+            for k, line in enumerate(lines[:event_line_limit]):
+                lineTop = top + k * EVENT_LINE_HEIGHT
+                if lineTop + EVENT_LINE_HEIGHT > y1:
+                    return
+                draw.text((x, lineTop + (EVENT_LINE_HEIGHT - EVENT_SIZE) / 2), line, font=eventFont, fill=eventFill,
+                          stroke_width=1, stroke_fill=eventFill)
+                x = x0
+            top += EVENT_LINE_HEIGHT * event_line_limit
+        if cell['more'] and top + EVENT_LINE_HEIGHT <= y1:
+            black.text((x0, top), '{0} more'.format(cell['more']),
+                       font=self.get_font('NotoSans', EVENT_SIZE), fill=MUTED)
+
+    def draw_cell_forecast(self, draw, box, forecast):
+        # Icon in the top left corner of the cell, high over low in the top right corner
+        x0, y0, x1, y1 = box
+        icon = self.get_icon(forecast['id'], CELL_ICON_SIZE)
+        if icon is not None:
+            draw.bitmap((x0 + CELL_FORECAST_MARGIN, y0 + CELL_FORECAST_MARGIN), icon, fill=BLACK)
+        font = self.get_font('NotoSansBold', CELL_TEMP_SIZE)
+        for k, value in enumerate((forecast['high'], forecast['low'])):
+            text = '{}°'.format(value)
+            draw.text((x1 - CELL_FORECAST_MARGIN - font.getlength(text), y0 + CELL_FORECAST_MARGIN + k * CELL_TEMP_LINE_HEIGHT),
+                      text, font=font, fill=BLACK)
+
+    def process_inputs(self, calDict, weatherDict):
+        # Draws both planes in one pass and converts them to 1bpp once. Black pixels in the red plane are shown in red
+        blackImage = Image.new('L', (self.imageWidth, self.imageHeight), WHITE)
+        redImage = Image.new('L', (self.imageWidth, self.imageHeight), WHITE)
+        black = ImageDraw.Draw(blackImage)
+        red = ImageDraw.Draw(redImage)
+        self.draw_header(black, blackImage, calDict, weatherDict)
+
+        columnWidth = (self.imageWidth - 2 * PAGE_PADDING) / 7
+        gridTop = self.imageHeight - PAGE_PADDING - 5 * ROW_HEIGHT
+        for i, cell in enumerate(self.get_grid(calDict).cells):
+            x0 = PAGE_PADDING + (i % 7) * columnWidth
+            y0 = gridTop + (i // 7) * ROW_HEIGHT
+            self.draw_cell(black, red, (x0, y0, x0 + columnWidth, y0 + ROW_HEIGHT), cell)
+
+        self.logger.info('Calendar drawn natively.')
+        return self.rotate(blackImage).convert('1'), self.rotate(redImage).convert('1')
@@ -1,43 +1,91 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from datetime import timedelta
+from io import BytesIO
 import pathlib
 from PIL import Image
+from PIL import ImageChops
+from render.grid import CalendarGrid
+from render.template import get_template
+import metrics.metrics as metrics
+import hashlib
+import json
 import logging
+import os
 import subprocess
-import math
+
+# Minimum amount by which red must exceed green and blue for a pixel to be drawn in red
+RED_THRESHOLD = 64
+
+# Image.rotate angles that are lossless transposes
+TRANSPOSE = {90: Image.ROTATE_90, 180: Image.ROTATE_180, 270: Image.ROTATE_270}
+
+# Markup fragments of the generated day of week row and day cells
+DAY_NAME = '<li class="text-uppercase" style="color:black;">{0}</li>\n'
+DATE_TODAY = '<li><div class="datecircle">{0}</div>\n'
+DATE_MUTED = '<li><div class="date text-muted">{0}</div>\n'
+DATE = '<li><div class="date" style="color:black;">{0}</div>\n'
+EVENT = '<div style="overflow:hidden;font-weight:bold;line-height:1.5em;height:{0}em;{1}">{2}{3}</div>\n'
+EVENT_RED = 'color: #ff0000;'
+EVENT_MUTED = 'color: #6c757d!important;'
+EVENT_BLACK = 'color:black;'
+ARROWS = {'right': '►', 'left': '◄', None: ''}
+MORE = '<div class="event text-muted">{0} more'
+CELL_FORECAST = '<i class="wi wi-owm-{0} cell-forecast-icon"></i><div class="cell-forecast-temp">{1}°<br>{2}°</div>\n'
+
+# Classes and elements used by the fragments above and the placeholder values, the css rules that can match
+# them are kept when the template is compiled
+GENERATED_CLASSES = ('text-uppercase', 'datecircle', 'date', 'text-muted', 'event', 'wi', 'cell-forecast-icon',
+                     'cell-forecast-temp')
+GENERATED_CLASS_PREFIXES = ('wi-owm-', 'battery')
+GENERATED_TAGS = ('li', 'div', 'i', 'br')
 
 class RenderHelper:
 
     def __init__(self, width, height, angle):
         self.logger = logging.getLogger('einkcal')
         self.currPath = str(pathlib.Path(__file__).parent.absolute())
-        self.htmlFile = self.currPath + '/calendar.html'
+        self.stateFile = self.currPath + '/render_state.json'
         self.imageWidth = width
         self.imageHeight = height
         self.rotateAngle = angle
 
-    def get_screenshot(self, red):
-        if red:
-            name = '/calendar_red.png'
-        else:
-            name = '/calendar_black.png'
-        result = subprocess.check_output(['wkhtmltoimage', 
-                                          '--enable-local-file-access',
-                                          '--height',
-                                          '1304',
-                                          '--width',
-                                          '984',
-                                          self.htmlFile,
-                                          self.currPath + name
-                                          ])
-        result_str = result.decode('utf-8').rstrip()
-        self.logger.info(result_str)
-        self.logger.info('Screenshot captured and saved to file.')
-        img = Image.open(self.currPath + name)  # get image)
-        img = img.rotate(self.rotateAngle, expand=True)
-        return img
+    def get_screenshot(self, html):
+        # The page is piped in on stdin and the bitmap read back from stdout, nothing touches the disk
+        with metrics.span('wkhtmltoimage'):
+            result = subprocess.run(['wkhtmltoimage',
+                                     '--enable-local-file-access',
+                                     '--format',
+                                     'bmp',
+                                     '--height',
+                                     '1304',
+                                     '--width',
+                                     '984',
+                                     '-',
+                                     '-'
+                                     ], input=html.encode('utf-8'), stdout=subprocess.PIPE, check=True).stdout
+        self.logger.info('Screenshot captured.')
+        img = Image.open(BytesIO(result)).convert('RGB')
+        return self.rotate(img)
+
+    def rotate(self, img):
+        # Quarter turns are exact pixel transposes, any other angle is resampled
+        angle = self.rotateAngle % 360
+        if angle in TRANSPOSE:
+            return img.transpose(TRANSPOSE[angle])
+        return img.rotate(self.rotateAngle, expand=True) if angle else img
+
+    def split_planes(self, img):
+        # Splits a colour render into the black and red 1bpp planes the display packs as is. Pixels clearly
+        # redder than they are green or blue go to the red plane (as black), everything else keeps its gray level
+        # in the black plane and is dithered there
+        r, g, b = img.split()
+        redness = ImageChops.darker(ImageChops.subtract(r, g), ImageChops.subtract(r, b))
+        redMask = redness.point(lambda v: 255 if v > RED_THRESHOLD else 0)
+        blackImage = img.convert('L')
+        blackImage.paste(255, mask=redMask)
+        redImage = ImageChops.invert(redMask)
+        return blackImage.convert('1'), redImage.convert('1')
 
     def get_day_in_cal(self, startDate, eventDate):
         delta = eventDate - startDate
@@ -58,42 +106,9 @@ class RenderHelper:
             datetime_str = '{}{}am'.format(str(datetimeObj.hour), datetime_str)
         return datetime_str
 
-    def process_inputs(self, calDict, weatherDict, red=False):
-        # calDict = {'events': eventList, 'calStartDate': calStartDate, 'today': currDate, 'lastRefresh': currDatetime, 'batteryLevel': batteryLevel}
-        # weatherDict = {'high': 75, "low": 55, "pop": 10, "id": 501}
-        # first setup list to represent the 5 weeks in our calendar
-        calList = []
-        for i in range(35):
-            calList.append([])
-
-        # retrieve calendar configuration
-        maxEventsPerDay = calDict['maxEventsPerDay']
-        batteryDisplayMode = calDict['batteryDisplayMode']
-        dayOfWeekText = calDict['dayOfWeekText']
-        weekStartDay = calDict['weekStartDay']
-
-        # for each item in the eventList, add them to the relevant day in our calendar list
-        for event in calDict['events']:
-            idx = self.get_day_in_cal(calDict['calStartDate'], event['startDatetime'].date())
-            if idx >= 0:
-                calList[idx].append(event)
-            if event['isMultiday']:
-                idx = self.get_day_in_cal(calDict['calStartDate'], event['endDatetime'].date())
-                if idx < len(calList):
-                    calList[idx].append(event)
-
-        # Read html template
-        with open(self.currPath + '/calendar_template.html', 'r') as file:
-            calendar_template = file.read()
-
-        # Insert month header
-        month_name = str(calDict['today'].month)
-
-        # Insert battery icon
+    def get_battery_text(self, battLevel, batteryDisplayMode):
         # batteryDisplayMode - 0: do not show / 1: always show / 2: show when battery is low
-        battLevel = calDict['batteryLevel']
-
-        if batteryDisplayMode == 0:
+        if batteryDisplayMode == 0 or battLevel is None:  # None when the level could not be read in time
             battText = 'batteryHide'
         elif batteryDisplayMode == 1:
             if battLevel >= 80:
@@ -104,62 +119,100 @@ class RenderHelper:
                 battText = 'battery40'
             elif battLevel >= 20:
                 battText = 'battery20'
-            elif battLevel < 12:
+            else:
                 battText = 'battery0'
 
         elif batteryDisplayMode == 2 and battLevel < 20.0:
             battText = 'battery0'
         elif batteryDisplayMode == 2 and battLevel >= 20.0:
             battText = 'batteryHide'
-        if red:
-            battText = 'batteryHide'
+        return battText
+
+    def get_input_hash(self, calDict, weatherDict):
+        # Hash of everything that ends up on screen, equal hashes render identical images
+        events = [event.key() for event in calDict['events']]
+        inputs = {'events': events, 'weather': weatherDict,
+                  'battery': self.get_battery_text(calDict['batteryLevel'], calDict['batteryDisplayMode']),
+                  'today': calDict['today'].isoformat(), 'calStartDate': calDict['calStartDate'].isoformat(),
+                  'maxEventsPerDay': calDict['maxEventsPerDay'], 'dayOfWeekText': calDict['dayOfWeekText'],
+                  'weekStartDay': calDict['weekStartDay'],
+                  'forecast': {date.isoformat(): day for date, day in calDict.get('forecast', {}).items()},
+                  'image': [self.imageWidth, self.imageHeight, self.rotateAngle], 'engine': type(self).__name__}
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def is_unchanged(self, inputHash):
+        # True when the last image sent to the display was rendered from the same inputs
+        try:
+            with open(self.stateFile, 'r') as file:
+                return json.load(file).get('hash') == inputHash
+        except (OSError, ValueError):
+            return False
+
+    def save_state(self, inputHash):
+        with open(self.stateFile, 'w') as file:
+            json.dump({'hash': inputHash}, file)
+
+    def forget_state(self):
+        if os.path.exists(self.stateFile):
+            os.remove(self.stateFile)
+
+    def get_grid(self, calDict):
+        return CalendarGrid(calDict, self.get_short_time)
+
+    def render(self, calDict, weatherDict):
+        # Returns the black and red images
+        return self.process_inputs(calDict, weatherDict)
+
+    def process_inputs(self, calDict, weatherDict):
+        # calDict = {'events': eventList, 'calStartDate': calStartDate, 'today': currDate, 'lastRefresh': currDatetime, 'batteryLevel': batteryLevel}
+        # weatherDict = {'high': 75, "low": 55, "pop": 10, "id": 501}
+        # retrieve calendar configuration
+        batteryDisplayMode = calDict['batteryDisplayMode']
+        dayOfWeekText = calDict['dayOfWeekText']
+        weekStartDay = calDict['weekStartDay']
+
+        # lay the events out over the 5 weeks in our calendar
+        grid = self.get_grid(calDict)
+
+        # Insert month header
+        month_name = str(calDict['today'].month)
+
+        # Insert battery icon
+        battText = self.get_battery_text(calDict['batteryLevel'], batteryDisplayMode)
 
         # Populate the day of week row
-        cal_days_of_week = ''
-        for i in range(0, 7):
-            cal_days_of_week += '<li class="text-uppercase" style="color:{0};">{1}</li>\n'.format("white" if red else "black", dayOfWeekText[
-                (i + weekStartDay) % 7])
+        cal_days_of_week = ''.join(DAY_NAME.format(dayOfWeekText[(i + weekStartDay) % 7]) for i in range(0, 7))
 
         # Populate the date and events
-        cal_events_text = ''
-        for i in range(len(calList)):
-            currDate = calDict['calStartDate'] + timedelta(days=i)
-            dayOfMonth = currDate.day
-            if currDate == calDict['today']:
-                cal_events_text += '<li><div class="{0}">{1}</div>\n'.format("datecircle" if red else "datecircle-white", str(dayOfMonth))
-            elif currDate.month != calDict['today'].month:
-                cal_events_text += '<li><div class="date {0}">{1}</div>\n'.format("text-white" if red else "text-muted", str(dayOfMonth))
+        parts = []
+        for cell in grid.cells:
+            if cell['isToday']:
+                parts.append(DATE_TODAY.format(cell['date'].day))
+            elif cell['muted']:
+                parts.append(DATE_MUTED.format(cell['date'].day))
             else:
-                cal_events_text += '<li><div class="date" style="color:{0};">{1}</div>\n'.format("white" if red else "black", str(dayOfMonth))
-
-            event_count = len(calList[i])
-            for j in range(min(event_count, maxEventsPerDay)):
-                event = calList[i][j]
-                event_line_limit = max(math.floor(maxEventsPerDay / event_count), 1)
-                event_color = "color:white;" if red else "color: #6c757d!important;" if currDate.month != calDict['today'].month and not red else "color:black;"
-                cal_events_text += '<div {0}'.format('style="overflow:hidden;font-weight:bold;line-height:1.5em;height:{0}em;{1}'.format(1.5 * event_line_limit, event_color))
-                if event['isMultiday']:
-                    if event['startDatetime'].date() == currDate:
-                        cal_events_text += '">►' + event['summary']
-                    else:
-                        cal_events_text += '">◄' + event['summary']
-                elif event['allday']:
-                    cal_events_text += '">' + event['summary']
+                parts.append(DATE.format(cell['date'].day))
+            if cell['forecast']:
+                parts.append(CELL_FORECAST.format(cell['forecast']['id'], cell['forecast']['high'], cell['forecast']['low']))
+
+            height = 1.5 * cell['lineLimit']
+            for entry in cell['events']:
+                if entry['event'].color == 'red':
+                    event_color = EVENT_RED
+                elif cell['muted']:
+                    event_color = EVENT_MUTED
                 else:
-                    cal_events_text += '">' + self.get_short_time(event['startDatetime']) + ' ' + event[
-                        'summary']
-                cal_events_text += '</div>\n'
-            if len(calList[i]) > maxEventsPerDay:
-                cal_events_text += '<div class="{0}">{1} more'.format("event-white" if red else "event text-muted", str(len(calList[i]) - maxEventsPerDay))
-
-            cal_events_text += '</li>\n'
-
-        # Append the bottom and write the file
-        htmlFile = open(self.currPath + '/calendar.html', "w")
-        htmlFile.write(calendar_template.format(month=month_name, battText=battText, dayOfWeek=cal_days_of_week,
-                                                events=cal_events_text, forcastImage=weatherDict.get('id'), 
-                                                forcastString="{0}% | {1}-{2}°".format(weatherDict.get('pop'), weatherDict.get('low'), weatherDict.get('high')), 
-                                                forcastStyle="text-white" if red else "text-uppercase"))
-        htmlFile.close()
-        image = self.get_screenshot(red)
-        return image
+                    event_color = EVENT_BLACK
+                parts.append(EVENT.format(height, event_color, ARROWS[entry['arrow']], entry['text']))
+            if cell['more']:
+                parts.append(MORE.format(cell['more']))
+            parts.append('</li>\n')
+
+        template = get_template(self.currPath + '/calendar_template.html', classes=GENERATED_CLASSES,
+                                classPrefixes=GENERATED_CLASS_PREFIXES, tags=GENERATED_TAGS)
+        html = template.fill(month=month_name, battText=battText, dayOfWeek=cal_days_of_week, events=''.join(parts),
+                             forcastImage=weatherDict.get('id'),
+                             forcastString="{0}% | {1}-{2}°".format(weatherDict.get('pop'), weatherDict.get('low'), weatherDict.get('high')) if weatherDict else '',
+                             forcastStyle="text-uppercase")
+        image = self.get_screenshot(html)
+        return self.split_planes(image)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compiled HTML page for the wkhtmltoimage renderer. The template is read once, its stylesheets are stripped down
+to the rules the page can match and inlined, and the result is kept in memory as a list of literal fragments and
+placeholder names. Filling it is a single str.join, and wkhtmltoimage gets one self-contained document instead of
+parsing the full bootstrap and styles sheets on every render.
+"""
+
+import os
+import pathlib
+import re
+
+_templates = {}
+
+PLACEHOLDER = re.compile(r'\{(\w+)\}')
+STYLESHEET = re.compile(r'<link rel="stylesheet" href="([^"]+)">')
+
+
+def _css_items(css):
+    # Splits a stylesheet into top level (prelude, body) pairs, body is None for statements such as @charset.
+    # Strings and comments are skipped over so braces inside them (data URIs, content values) do not count
+    items = []
+    start = i = 0
+    depth = 0
+    bodyStart = None
+    while i < len(css):
+        char = css[i]
+        if css.startswith('/*', i):
+            end = css.find('*/', i + 2)
+            i = len(css) if end < 0 else end + 2
+            continue
+        if char in '"\'':
+            i += 1
+            while i < len(css) and css[i] != char:
+                i += 2 if css[i] == '\\' else 1
+        elif char == '{':
+            if depth == 0:
+                bodyStart = i
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                items.append((css[start:bodyStart].strip(), css[bodyStart + 1:i]))
+                start = i + 1
+        elif char == ';' and depth == 0:
+            items.append((css[start:i].strip(), None))
+            start = i + 1
+        i += 1
+    return items
+
+
+def _strip_comments(text):
+    return re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+
+
+def _selector_used(selector, classes, classPrefixes, tags):
+    for name in re.findall(r'\.([\w-]+)', selector):
+        if name not in classes and not name.startswith(classPrefixes):
+            return False
+    # what is left after removing pseudo classes, attributes, ids and classes are the element names
+    rest = re.sub(r'::?[\w-]+(\([^)]*\))?|\[[^\]]*\]|#[\w-]+|\.[\w-]+', ' ', selector)
+    return all(tag.lower() in tags for tag in re.findall(r'[a-zA-Z][\w-]*', rest))
+
+
+def strip_css(css, classes, classPrefixes, tags):
+    # Keeps the rules with at least one selector the page can match, the @media/@supports blocks that still hold
+    # rules afterwards, and only the @font-face and @keyframes the kept rules refer to
+    kept, fontFaces, keyframes = [], [], []
+    for prelude, body in _css_items(css):
+        prelude = _strip_comments(prelude).strip()
+        if body is None:
+            if prelude.startswith('@charset'):
+                kept.append(prelude + ';')
+        elif prelude.startswith('@font-face'):
+            fontFaces.append(body)
+        elif prelude.startswith('@keyframes') or prelude.startswith('@-webkit-keyframes'):
+            keyframes.append((prelude.split()[-1], prelude, body))
+        elif prelude.startswith('@media') or prelude.startswith('@supports'):
+            inner = strip_css(body, classes, classPrefixes, tags)
+            if inner:
+                kept.append('{}{{{}}}'.format(prelude, inner))
+        elif prelude.startswith('@'):
+            continue
+        else:
+            selectors = [selector.strip() for selector in prelude.split(',')
+                         if _selector_used(selector, classes, classPrefixes, tags)]
+            if selectors:
+                kept.append('{}{{{}}}'.format(','.join(selectors), _strip_comments(body).strip()))
+    rules = ''.join(kept)
+    families = set(name.strip().strip('\'"') for value in re.findall(r'font-family\s*:\s*([^;}]+)', rules)
+                   for name in value.split(','))
+    for body in fontFaces:
+        family = re.search(r'font-family\s*:\s*[\'"]?([^;\'"]+)', body)
+        if family and family.group(1).strip() in families:
+            rules = '@font-face{{{}}}'.format(_strip_comments(body).strip()) + rules
+    for name, prelude, body in keyframes:
+        if re.search(r'animation(-name)?\s*:[^;}]*\b' + re.escape(name) + r'\b', rules):
+            rules += '{}{{{}}}'.format(prelude, body)
+    return rules
+
+
+class PageTemplate:
+
+    def __init__(self, templateFile, classes=(), classPrefixes=(), tags=()):
+        # classes, classPrefixes and tags describe the markup generated into the placeholders
+        self.templateFile = templateFile
+        basePath = str(pathlib.Path(templateFile).parent.absolute())
+        with open(templateFile, 'r') as file:
+            html = file.read()
+
+        stylesheets = [basePath + '/' + href for href in STYLESHEET.findall(html)]
+        self.sources = [templateFile] + stylesheets
+        self.signature = self.get_signature(self.sources)
+        static = PLACEHOLDER.sub(' ', html)
+        usedClasses = set(classes)
+        for value in re.findall(r'class="([^"]*)"', static):
+            usedClasses.update(value.split())
+        usedTags = set(tag.lower() for tag in re.findall(r'<([a-zA-Z][\w-]*)', static))
+        usedTags.update(tags)
+        usedTags.update(('html', 'body'))
+
+        css = []
+        for path in stylesheets:
+            with open(path, 'r') as file:
+                css.append(strip_css(file.read(), usedClasses, tuple(classPrefixes), usedTags))
+        html = STYLESHEET.sub('', html)
+        # The page is piped to wkhtmltoimage, so local images need absolute urls
+        html = re.sub(r'src="(?!data:|file:|https?:)([^"]+)"',
+                      lambda match: 'src="{}"'.format(pathlib.Path(basePath, match.group(1)).as_uri()), html)
+
+        # Split around the placeholders first, the inlined css goes into a literal so its braces are left alone
+        style = '<style>{}</style>\n</head>'.format('\n'.join(css))
+        self.fragments = []
+        position = 0
+        for match in PLACEHOLDER.finditer(html):
+            self.fragments.append((html[position:match.start()].replace('</head>', style), None))
+            self.fragments.append((None, match.group(1)))
+            position = match.end()
+        self.fragments.append((html[position:].replace('</head>', style), None))
+
+    def get_signature(self, paths):
+        return [(os.stat(path).st_mtime_ns, os.stat(path).st_size) for path in paths]
+
+    def is_current(self):
+        try:
+            return self.get_signature(self.sources) == self.signature
+        except OSError:
+            return False
+
+    def fill(self, **fields):
+        return ''.join(literal if name is None else str(fields[name]) for literal, name in self.fragments)
+
+
+def get_template(templateFile, **kwargs):
+    # Compiled once per process, recompiled only when the template or a stylesheet changes on disk
+    template = _templates.get(templateFile)
+    if template is None or not template.is_current():
+        template = _templates[templateFile] = PageTemplate(templateFile, **kwargs)
+    return template
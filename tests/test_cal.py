@@ -0,0 +1,241 @@
+"""
+CalHelper against feeds served from a local HTTP server: conditional downloads into the feed cache and the
+incremental index of expanded events.
+"""
+
+import datetime as dt
+import http.server
+import json
+import threading
+
+import pytest
+import requests
+from pytz import timezone
+
+import cal.cal
+from bench.synthetic import make_feed
+from cal.cal import CalHelper
+
+FEED = (b'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//einkcal//test//EN\r\n'
+        b'BEGIN:VEVENT\r\nUID:a@test\r\nDTSTAMP:20261001T000000Z\r\nSUMMARY:Dentist\r\n'
+        b'DTSTART:20261020T090000Z\r\nDTEND:20261020T100000Z\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n')
+
+
+class FeedHandler(http.server.BaseHTTPRequestHandler):
+    # Serves the feed of the test server with an ETag and Last-Modified, and answers 304 to a matching request
+
+    def do_GET(self):
+        feed = self.server.feed
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == feed['etag']:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/calendar')
+        self.send_header('Content-Length', str(len(feed['body'])))
+        self.send_header('ETag', feed['etag'])
+        self.send_header('Last-Modified', 'Mon, 12 Oct 2026 08:00:00 GMT')
+        self.end_headers()
+        self.wfile.write(feed['body'])
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def feed_server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+    server.feed = {'body': FEED, 'etag': '"v1"'}
+    server.requests = []
+    server.url = 'http://127.0.0.1:{}/feed.ics'.format(server.server_address[1])
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def helper(tmp_path):
+    helper = CalHelper()
+    helper.cacheDir = str(tmp_path / 'cache')
+    return helper
+
+
+class TrackingSession(requests.Session):
+    # A session without retries that keeps every response, to check they are all closed
+    def __init__(self):
+        super().__init__()
+        self.responses = []
+
+    def get(self, *args, **kwargs):
+        response = super().get(*args, **kwargs)
+        self.responses.append(response)
+        return response
+
+
+def test_download_writes_metadata(helper, feed_server):
+    session = TrackingSession()
+    bodyFile = helper.fetch_feed(session, feed_server.url)
+    with open(bodyFile, 'rb') as file:
+        assert file.read() == FEED
+    with open(helper.cache_paths(feed_server.url)[1]) as file:
+        meta = json.load(file)
+    assert meta['url'] == feed_server.url
+    assert meta['etag'] == '"v1"'
+    assert meta['lastModified'] == 'Mon, 12 Oct 2026 08:00:00 GMT'
+    assert not helper.stale
+    assert all(response.raw.closed for response in session.responses)
+
+
+def test_not_modified_returns_cache(helper, feed_server):
+    session = TrackingSession()
+    bodyFile = helper.fetch_feed(session, feed_server.url)
+    feed_server.feed['body'] = b'changed, but the etag is not'
+    assert helper.fetch_feed(session, feed_server.url) == bodyFile
+    assert feed_server.requests[-1]['If-None-Match'] == '"v1"'
+    assert feed_server.requests[-1]['If-Modified-Since'] == 'Mon, 12 Oct 2026 08:00:00 GMT'
+    with open(bodyFile, 'rb') as file:
+        assert file.read() == FEED
+    assert not helper.stale
+    assert len(session.responses) == 2 and all(response.raw.closed for response in session.responses)
+
+
+def test_changed_feed_replaces_cache(helper, feed_server):
+    session = TrackingSession()
+    helper.fetch_feed(session, feed_server.url)
+    feed_server.feed.update(body=FEED.replace(b'Dentist', b'Doctor'), etag='"v2"')
+    bodyFile = helper.fetch_feed(session, feed_server.url)
+    with open(bodyFile, 'rb') as file:
+        assert b'Doctor' in file.read()
+    with open(helper.cache_paths(feed_server.url)[1]) as file:
+        assert json.load(file)['etag'] == '"v2"'
+
+
+def test_network_error_uses_stale_cache(helper, feed_server):
+    session = requests.Session()
+    url = feed_server.url
+    bodyFile = helper.fetch_feed(session, url)
+    feed_server.shutdown()
+    feed_server.server_close()
+    assert helper.fetch_feed(session, url) == bodyFile
+    assert helper.stale
+
+
+def test_network_error_without_cache(helper, feed_server):
+    url = feed_server.url
+    feed_server.shutdown()
+    feed_server.server_close()
+    assert helper.fetch_feed(requests.Session(), url) is None
+    assert not helper.stale
+
+
+TZ = timezone('Europe/London')
+DAY = dt.date(2026, 10, 4)
+
+
+def window(day):
+    # the five weeks main.py shows, starting on the given day
+    start = TZ.localize(dt.datetime.combine(day, dt.time.min))
+    end = TZ.localize(dt.datetime.combine(day + dt.timedelta(days=34), dt.time.max))
+    return start, end
+
+
+def fields(events):
+    return [(event.uid, event.summary, event.start, event.end, event.startDay, event.endDay, event.startMinute,
+             event.flags) for event in events]
+
+
+def cold_events(tmp_path, url, day, name='cold'):
+    helper = CalHelper()
+    helper.cacheDir = str(tmp_path / name)
+    return helper.retrieve_calendar_events(requests.Session(), url, *window(day), TZ)
+
+
+def track_parses(monkeypatch, helper):
+    # start of the range each parse_feed call asked for
+    starts = []
+    parse_feed = helper.parse_feed
+    monkeypatch.setattr(helper, 'parse_feed', lambda bodyFile, startDate, endDate: starts.append(startDate) or
+                        parse_feed(bodyFile, startDate, endDate))
+    return starts
+
+
+@pytest.fixture
+def synthetic_server(feed_server):
+    feed_server.feed['body'] = make_feed(400, 0.3, DAY, 'Europe/London', seed=7)
+    return feed_server
+
+
+@pytest.mark.parametrize('shift', [7, 21, 40, 60])
+def test_sliding_window_matches_cold_expansion(tmp_path, monkeypatch, synthetic_server, shift):
+    url = synthetic_server.url
+    warm = CalHelper()
+    warm.cacheDir = str(tmp_path / 'warm')
+    warm.retrieve_calendar_events(requests.Session(), url, *window(DAY), TZ)
+
+    # a new process, the index comes from disk
+    warm = CalHelper()
+    warm.cacheDir = str(tmp_path / 'warm')
+    starts = track_parses(monkeypatch, warm)
+    events = warm.retrieve_calendar_events(requests.Session(), url, *window(DAY + dt.timedelta(days=shift)), TZ)
+    assert fields(events) == fields(cold_events(tmp_path, url, DAY + dt.timedelta(days=shift)))
+    assert events
+
+    start, end = window(DAY)
+    if shift == 7:
+        assert starts == []  # still covered by the lookahead, the index is used as it is
+        return
+    if shift == 60:
+        # the window starts past the saved index, which is rebuilt
+        assert starts == [window(DAY + dt.timedelta(days=shift))[0]]
+    else:
+        # only the days past the saved index are expanded
+        assert starts == [end + dt.timedelta(days=cal.cal.LOOKAHEAD_DAYS)]
+
+    # events that ended before the window are pruned from the rewritten index
+    windowStart = window(DAY + dt.timedelta(days=shift))[0].timestamp()
+    index = next(iter(warm.indexes.values()))[2]
+    assert all(event.end >= windowStart for event in index['events'])
+    assert index['start'] == window(DAY + dt.timedelta(days=shift))[0]
+
+
+def test_changed_feed_invalidates_index(tmp_path, monkeypatch, synthetic_server):
+    url = synthetic_server.url
+    helper = CalHelper()
+    helper.cacheDir = str(tmp_path / 'warm')
+    helper.retrieve_calendar_events(requests.Session(), url, *window(DAY), TZ)
+    synthetic_server.feed.update(body=make_feed(400, 0.3, DAY, 'Europe/London', seed=8), etag='"v2"')
+    starts = track_parses(monkeypatch, helper)
+    events = helper.retrieve_calendar_events(requests.Session(), url, *window(DAY), TZ)
+    assert starts == [window(DAY)[0]]
+    assert fields(events) == fields(cold_events(tmp_path, url, DAY))
+
+
+def test_index_invalidated_by_hash_tz_and_version(tmp_path, monkeypatch, synthetic_server):
+    helper = CalHelper()
+    helper.cacheDir = str(tmp_path / 'warm')
+    helper.retrieve_calendar_events(requests.Session(), synthetic_server.url, *window(DAY), TZ)
+    bodyFile = helper.cache_paths(synthetic_server.url)[0]
+    indexFile = bodyFile[:-len('.ics')] + '.idx'
+    feedHash = helper.file_hash(bodyFile)
+
+    index = helper.load_index(indexFile, feedHash, TZ)
+    assert index is not None and index['events']
+    assert helper.load_index(indexFile, 'another hash', TZ) is None
+    assert helper.load_index(indexFile, feedHash, timezone('Europe/Paris')) is None
+    monkeypatch.setattr(cal.cal, 'INDEX_VERSION', cal.cal.INDEX_VERSION + 1)
+    assert helper.load_index(indexFile, feedHash, TZ) is None
+
+
+def test_other_timezone_expands_again(tmp_path, monkeypatch, synthetic_server):
+    url = synthetic_server.url
+    helper = CalHelper()
+    helper.cacheDir = str(tmp_path / 'warm')
+    helper.retrieve_calendar_events(requests.Session(), url, *window(DAY), TZ)
+    starts = track_parses(monkeypatch, helper)
+    paris = timezone('Europe/Paris')
+    start = paris.localize(dt.datetime.combine(DAY, dt.time.min))
+    end = paris.localize(dt.datetime.combine(DAY + dt.timedelta(days=34), dt.time.max))
+    helper.retrieve_calendar_events(requests.Session(), url, start, end, paris)
+    assert starts == [start]
@@ -0,0 +1,95 @@
+"""
+LocalClock gives the same epoch seconds, local day and minute as pytz's astimezone() and localize(is_dst=False),
+including wall times in the gaps and overlaps around DST changes and all-day dates.
+"""
+
+import datetime as dt
+import random
+
+import pytest
+from pytz import timezone, utc
+
+from cal.clock import LocalClock
+
+ZONES = ['Europe/London', 'America/New_York', 'Australia/Lord_Howe', 'Africa/Casablanca', 'Pacific/Chatham',
+         'Europe/Dublin', 'Asia/Kolkata', 'UTC']
+# Expansion windows like main.py's five weeks, around the DST changes of the zones above
+STARTS = [dt.date(2026, 3, 1), dt.date(2026, 9, 13), dt.date(2026, 10, 18), dt.date(2027, 1, 31),
+          dt.date(2026, 2, 1)]
+
+
+def make_clock(tz, start):
+    startDatetime = tz.localize(dt.datetime.combine(start, dt.time.min))
+    endDatetime = tz.localize(dt.datetime.combine(start + dt.timedelta(days=34), dt.time.max))
+    return LocalClock(tz, startDatetime, endDatetime), startDatetime, endDatetime
+
+
+def expected(tz, value, offset=0):
+    if not isinstance(value, dt.datetime):
+        day = value + dt.timedelta(days=offset)
+        return tz.localize(dt.datetime.combine(day, dt.time.min)).timestamp(), day.toordinal(), 0, True
+    if value.tzinfo is None:
+        return tz.localize(value).timestamp(), value.toordinal(), value.hour * 60 + value.minute, False
+    local = value.astimezone(tz)
+    return value.timestamp(), local.toordinal(), local.hour * 60 + local.minute, False
+
+
+def transition_walls(tz, clock):
+    # Wall times just before, in and after every gap and overlap of the window
+    for transition in clock.transitions[1:]:
+        before = dt.datetime.fromtimestamp(transition - 1, tz).replace(tzinfo=None)
+        after = dt.datetime.fromtimestamp(transition, tz).replace(tzinfo=None)
+        for wall in (before, after):
+            for minutes in (-61, -60, -31, -30, -1, 0, 1, 29, 30, 59, 60, 61):
+                yield wall + dt.timedelta(minutes=minutes)
+            yield wall + dt.timedelta(seconds=1)
+            yield wall + dt.timedelta(microseconds=500000)
+
+
+def period(tz, instant):
+    local = dt.datetime.fromtimestamp(instant, tz)
+    return int(local.utcoffset().total_seconds()), bool(local.dst())
+
+
+@pytest.mark.parametrize('zone', ZONES)
+def test_transitions_match_pytz(zone):
+    # Every offset change of the window is found to the second, and nothing else
+    tz = timezone(zone)
+    for start in STARTS:
+        clock, _, _ = make_clock(tz, start)
+        for transition in clock.transitions[1:]:
+            assert period(tz, transition - 1) != period(tz, transition)
+        for instant in range(clock.first, clock.last, 1800):
+            assert clock.period_at(instant) == period(tz, instant)
+
+
+@pytest.mark.parametrize('zone', ZONES)
+def test_gaps_and_overlaps(zone):
+    tz = timezone(zone)
+    for start in STARTS:
+        clock, _, _ = make_clock(tz, start)
+        for wall in transition_walls(tz, clock):
+            assert clock.convert(wall) == expected(tz, wall), wall
+            aware = tz.localize(wall)
+            assert clock.convert(aware) == expected(tz, aware), aware
+            assert clock.convert(wall.date()) == expected(tz, wall.date()), wall.date()
+            assert clock.convert(wall.date(), offset=-1) == expected(tz, wall.date(), -1), wall.date()
+
+
+@pytest.mark.parametrize('zone', ZONES)
+def test_random_values(zone):
+    tz = timezone(zone)
+    rng = random.Random(zone)
+    for start in STARTS:
+        clock, startDatetime, endDatetime = make_clock(tz, start)
+        # mostly inside the window, some far outside where the clock asks the timezone directly
+        first, last = startDatetime.timestamp() - 10 * 86400, endDatetime.timestamp() + 10 * 86400
+        for _ in range(300):
+            instant = rng.choice((rng.uniform(first, last), rng.uniform(0, 2e9)))
+            aware = dt.datetime.fromtimestamp(int(instant), utc)
+            assert clock.convert(aware) == expected(tz, aware), aware
+            assert clock.convert(aware.astimezone(timezone('Asia/Tokyo'))) == expected(tz, aware), aware
+            wall = aware.replace(tzinfo=None)
+            assert clock.convert(wall) == expected(tz, wall), wall
+            assert clock.convert(wall.date()) == expected(tz, wall.date()), wall.date()
+            assert clock.convert(wall.date(), offset=-1) == expected(tz, wall.date(), -1), wall.date()
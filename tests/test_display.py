@@ -0,0 +1,70 @@
+"""
+DisplayHelper only wakes the panel for a frame that differs from the last one sent, and only puts it back to sleep
+when it was woken.
+"""
+
+from PIL import Image, ImageDraw
+
+from display import epdsim
+epdsim.install()
+
+import display.display as display
+import display.epd12in48b as eink
+
+
+def make_frame(text):
+    black = Image.new('1', (eink.EPD_WIDTH, eink.EPD_HEIGHT), 255)
+    ImageDraw.Draw(black).text((100, 100), text, fill=0)
+    return black, Image.new('1', (eink.EPD_WIDTH, eink.EPD_HEIGHT), 255)
+
+
+def make_helper(monkeypatch, tmp_path):
+    monkeypatch.setattr(display, 'FRAME_FILE', str(tmp_path / 'framebuffer.bin'))
+    monkeypatch.setattr(eink.time, 'sleep', lambda seconds: None)
+    calls = []
+    helper = display.DisplayHelper(eink.EPD_WIDTH, eink.EPD_HEIGHT)
+    for method in ('Init', 'EPD_Sleep'):
+        original = getattr(helper.epd, method)
+        monkeypatch.setattr(helper.epd, method,
+                            lambda original=original, method=method: calls.append(method) or original())
+    return helper, calls
+
+
+def test_unchanged_frame_skips_panel(monkeypatch, tmp_path):
+    helper, calls = make_helper(monkeypatch, tmp_path)
+    frame = make_frame('Monday')
+    helper.update(*frame)
+    helper.sleep()
+    assert calls == ['Init', 'EPD_Sleep']
+
+    # a later run with the same frame never resets, powers or sleeps the panel
+    helper, calls = make_helper(monkeypatch, tmp_path)
+    epdsim.reset()
+    helper.update(*frame)
+    helper.sleep()
+    assert calls == []
+    assert epdsim.stats['spi_calls'] == 0 and epdsim.stats['gpio_writes'] == 0
+
+
+def test_changed_frame_wakes_panel(monkeypatch, tmp_path):
+    helper, calls = make_helper(monkeypatch, tmp_path)
+    helper.update(*make_frame('Monday'))
+    helper.sleep()
+    helper.update(*make_frame('Tuesday'))
+    helper.sleep()
+    assert calls == ['Init', 'EPD_Sleep', 'Init', 'EPD_Sleep']
+
+
+def test_master_change_refreshes_its_slave(monkeypatch, tmp_path):
+    helper, calls = make_helper(monkeypatch, tmp_path)
+    helper.update(*make_frame('Monday'))
+    helper.sleep()
+    # text only in the M1 stripe (lower rows, left columns)
+    black, red = make_frame('Monday')
+    ImageDraw.Draw(black).text((100, 700), 'Dentist', fill=0)
+    helper.update(black, red)
+    commands = {name: [command for command, _ in epdsim.transfers[name]] for name in eink.STRIPES}
+    for name in ('M1', 'S1'):
+        assert 0x10 in commands[name] and 0x13 in commands[name] and 0x12 in commands[name]
+    for name in ('M2', 'S2'):
+        assert 0x10 not in commands[name] and 0x12 not in commands[name]
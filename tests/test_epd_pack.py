@@ -0,0 +1,96 @@
+"""
+The packed framebuffers and controller stripes must be byte-identical to what the per-pixel loops of the original
+Waveshare driver sent, for every image mode the renderers can hand over.
+"""
+
+import random
+
+from PIL import Image
+
+from display import epdsim
+epdsim.install()  # the driver imports epdconfig, which needs the Pi
+
+import display.epd12in48b as eink
+
+WIDTH = eink.EPD_WIDTH
+HEIGHT = eink.EPD_HEIGHT
+# Controller regions of the original display(): (pixel rows, byte columns)
+ORIGINAL_STRIPES = {
+    'S2': (range(0, 492), range(0, 81)),
+    'M2': (range(0, 492), range(81, 163)),
+    'M1': (range(492, 984), range(0, 81)),
+    'S1': (range(492, 984), range(81, 163)),
+}
+
+
+def reference_buffer(image):
+    # The packing loop of the original EPD.display()
+    buf = [0x00] * int(WIDTH * HEIGHT / 8)
+    converted = image.convert('1')
+    imwidth, imheight = converted.size
+    pixels = converted.load()
+    temp = 0
+    for y in range(0, imheight):
+        for x in range(0, imwidth):
+            if pixels[x, y] < 127:
+                buf[int((x + y * WIDTH) / 8)] &= ~(0x80 >> temp)
+            else:
+                buf[int((x + y * WIDTH) / 8)] |= (0x80 >> temp)
+            temp = temp + 1
+            if temp == 8:
+                temp = 0
+    return buf
+
+
+def reference_stripe(buf, name, invert=False):
+    # The bytes the original sent to one controller, ~value went out as its low eight bits
+    rows, cols = ORIGINAL_STRIPES[name]
+    return bytes((~buf[y * 163 + x] if invert else buf[y * 163 + x]) & 0xff for y in rows for x in cols)
+
+
+def make_image(mode, seed):
+    # Noise with solid blocks, so dithering, runs of white and black and the stripe edges are all exercised
+    rng = random.Random(seed)
+    image = Image.frombytes('L', (WIDTH, HEIGHT), rng.randbytes(WIDTH * HEIGHT))
+    for _ in range(20):
+        x, y = rng.randrange(WIDTH), rng.randrange(HEIGHT)
+        image.paste(rng.choice((0, 255)), (x, y, min(x + 300, WIDTH), min(y + 200, HEIGHT)))
+    if mode == 'RGB':
+        return Image.merge('RGB', (image, image.rotate(180), image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    return image.convert(mode)
+
+
+def check_mode(mode):
+    epd = eink.EPD()
+    black, red = make_image(mode, 1), make_image(mode, 2)
+    blackbuf, redbuf = epd.getbuffers(black, red)
+    blackReference, redReference = reference_buffer(black), reference_buffer(red)
+    assert blackbuf == bytes(blackReference)
+    assert redbuf == bytes(~value & 0xff for value in redReference)
+    for name in eink.STRIPES:
+        assert epd.stripe(blackbuf, name) == reference_stripe(blackReference, name)
+        assert epd.stripe(redbuf, name) == reference_stripe(redReference, name, invert=True)
+
+
+def test_pack_mode_1():
+    check_mode('1')
+
+
+def test_pack_mode_l():
+    check_mode('L')
+
+
+def test_pack_mode_rgb():
+    check_mode('RGB')
+
+
+def test_red_plane_inverted():
+    # An all white red image means no red, which the controllers expect as all zero bits on 0x13
+    epd = eink.EPD()
+    white = Image.new('1', (WIDTH, HEIGHT), 255)
+    black = Image.new('1', (WIDTH, HEIGHT), 0)
+    blackbuf, redbuf = epd.getbuffers(white, white)
+    assert blackbuf == b'\xff' * (WIDTH * HEIGHT // 8)
+    assert redbuf == b'\x00' * (WIDTH * HEIGHT // 8)
+    _, redbuf = epd.getbuffers(white, black)
+    assert redbuf == b'\xff' * (WIDTH * HEIGHT // 8)
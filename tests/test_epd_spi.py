@@ -0,0 +1,51 @@
+"""
+Uploads through display.epdsim: every controller stripe goes out as one block write with its chip select held low,
+and each controller receives exactly its part of the frame.
+"""
+
+import random
+
+from display import epdsim
+epdsim.install()
+
+import display.epd12in48b as eink
+
+
+def make_buffers(seed):
+    rng = random.Random(seed)
+    size = eink.EPD_WIDTH * eink.EPD_HEIGHT // 8
+    return rng.randbytes(size), rng.randbytes(size)
+
+
+def upload(names=None):
+    epd = eink.EPD()
+    epdsim.module_init()
+    blackbuf, redbuf = make_buffers(3)
+    epd.display_buffers(blackbuf, redbuf, names)
+    return epd, blackbuf, redbuf
+
+
+def test_stripes_sent_as_blocks(monkeypatch):
+    monkeypatch.setattr(eink.time, 'sleep', lambda seconds: None)
+    epd, blackbuf, redbuf = upload()
+    for name in eink.STRIPES:
+        frames = epdsim.frames(name)
+        assert frames[0x10] == epd.stripe(blackbuf, name)
+        assert frames[0x13] == epd.stripe(redbuf, name)
+    # Two data blocks per controller, everything else is single command bytes
+    blocks = sum(len(epd.stripe(blackbuf, name)) + len(epd.stripe(redbuf, name)) for name in eink.STRIPES)
+    assert epdsim.stats['spi_bytes'] - blocks == epdsim.stats['spi_calls'] - 2 * len(eink.STRIPES)
+    assert blocks == 2 * len(blackbuf)
+
+
+def test_only_listed_controllers_uploaded(monkeypatch):
+    # S2 brings its master M2 along, every controller is part of a listed pair
+    monkeypatch.setattr(eink.time, 'sleep', lambda seconds: None)
+    epd, blackbuf, redbuf = upload(('S2',))
+    for name in eink.STRIPES:
+        frames = epdsim.frames(name)
+        if name in ('M2', 'S2'):
+            assert frames[0x10] == epd.stripe(blackbuf, name)
+            assert frames[0x13] == epd.stripe(redbuf, name)
+        else:
+            assert 0x10 not in frames and 0x13 not in frames
@@ -0,0 +1,58 @@
+"""
+display.epdconfig imports without the Pi and picks the SPI path the loaded library supports. The library is a
+stand-in recording its calls, the real ones only load on the device.
+"""
+
+import importlib.util
+import pathlib
+
+import display
+
+PATH = pathlib.Path(display.__file__).parent / 'epdconfig.py'
+
+
+def load_epdconfig():
+    # A private copy, the other tests route display.epdconfig to epdsim
+    spec = importlib.util.spec_from_file_location('epdconfig_under_test', PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeLibrary:
+    # The calls of DEV_Config_64.so used by epdconfig
+    def __init__(self, hardware=True):
+        self.hardware = hardware
+        self.calls = []
+
+    def __getattr__(self, name):
+        if name.startswith('bcm2835_') and not self.hardware:
+            raise AttributeError(name)  # the 32-bit wiringPi build
+        return lambda *args: self.calls.append((name,) + args) or 1
+
+
+def test_import_needs_no_gpio():
+    epdconfig = load_epdconfig()
+    assert epdconfig.GPIO is None and epdconfig.spi is None
+
+
+def test_buffers_sent_in_one_hardware_call():
+    epdconfig = load_epdconfig()
+    epdconfig.spi = library = FakeLibrary()
+    assert epdconfig.init_hardware_spi()
+    # the chip selects driven by hand are taken back from the peripheral
+    assert ('bcm2835_gpio_fsel', epdconfig.EPD_M1_CS_PIN, epdconfig.BCM2835_GPIO_FSEL_OUTP) in library.calls
+    assert ('bcm2835_gpio_fsel', epdconfig.EPD_S1_CS_PIN, epdconfig.BCM2835_GPIO_FSEL_OUTP) in library.calls
+    library.calls.clear()
+    epdconfig.spi_writebytes(bytearray(range(256)) * 100)
+    epdconfig.spi_writebyte(0x12)
+    assert library.calls == [('bcm2835_spi_writenb', bytes(range(256)) * 100, 25600),
+                             ('bcm2835_spi_writenb', b'\x12', 1)]
+
+
+def test_bit_banged_without_hardware_spi():
+    epdconfig = load_epdconfig()
+    epdconfig.spi = library = FakeLibrary(hardware=False)
+    assert not epdconfig.init_hardware_spi()
+    epdconfig.spi_writebytes(b'\x01\x02\x03')
+    assert library.calls == [('DEV_SPI_WriteByte', 1), ('DEV_SPI_WriteByte', 2), ('DEV_SPI_WriteByte', 3)]
@@ -0,0 +1,58 @@
+"""
+Events pack into fixed size records followed by their utf-8 text for the on-disk index, and unpack to equal events.
+"""
+
+import datetime as dt
+
+import pytest
+
+from cal.event import ALLDAY, COUNT, MULTIDAY, RECORD, RED, Event, pack_events, unpack_events
+
+
+def fields(event):
+    return tuple(getattr(event, name) for name in Event.__slots__)
+
+
+EVENTS = [
+    Event('', '', 0, 0, 1, 1, 0, 0),
+    Event('a@example.com', 'Standup', 1791100800, 1791102600, 740000, 740000, 9 * 60, 0),
+    Event('x' * 300, 'Holiday', 1791072000, 1791331200, 740000, 740002, 0, ALLDAY | MULTIDAY),
+    Event('red', 'Dentist', -86400, 1 << 40, -5, 800000, 1439, RED),
+    Event('ünï', 'Café ☕ mit Jürgen — 東京 🎉', 1791100800, 1791100800, 740000, 740000, 12 * 60,
+          ALLDAY | MULTIDAY | RED),
+    Event('uid-' + 'ö' * 70000, 'long uid', 1, 2, 3, 4, 5, MULTIDAY),
+]
+
+
+def test_round_trip():
+    events = unpack_events(pack_events(EVENTS))
+    assert [fields(event) for event in events] == [fields(event) for event in EVENTS]
+    assert [(event.allday, event.isMultiday, event.color) for event in events] == \
+        [(event.allday, event.isMultiday, event.color) for event in EVENTS]
+
+
+@pytest.mark.parametrize('events', [[], EVENTS[:1], EVENTS[4:5]])
+def test_round_trip_small(events):
+    assert [fields(event) for event in unpack_events(pack_events(events))] == [fields(event) for event in events]
+
+
+def test_layout():
+    # Lengths are in utf-8 bytes, not characters
+    event = EVENTS[4]
+    data = pack_events([event])
+    assert len(data) == COUNT.size + RECORD.size + len('ünï'.encode()) + len(event.summary.encode())
+    *_, uidLen, summaryLen = RECORD.unpack_from(data, COUNT.size)
+    assert (uidLen, summaryLen) == (len('ünï'.encode()), len(event.summary.encode()))
+
+
+def test_unpacks_from_memoryview_and_bytearray():
+    data = pack_events(EVENTS)
+    for view in (memoryview(data), bytearray(data)):
+        assert [fields(event) for event in unpack_events(view)] == [fields(event) for event in EVENTS]
+
+
+def test_from_datetimes_flags():
+    start = dt.datetime(2026, 10, 4, 23, 30, tzinfo=dt.timezone.utc)
+    event = Event.from_datetimes('u', 's', start, start + dt.timedelta(hours=1), False)
+    assert (event.flags, event.startMinute, event.endDay - event.startDay) == (MULTIDAY, 23 * 60 + 30, 1)
+    assert fields(unpack_events(pack_events([event]))[0]) == fields(event)
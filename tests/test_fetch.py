@@ -0,0 +1,54 @@
+"""
+Only the calendar is needed to draw the page: a slow or failing weather or battery source falls back, a calendar
+that is not retrieved in time fails the run.
+"""
+
+import logging
+import pathlib
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from main import fetch_sources
+
+logger = logging.getLogger('einkcal')
+
+
+def test_optional_sources_fall_back():
+    release = threading.Event()
+
+    def failing():
+        raise OSError('PiSugar server not running')
+
+    try:
+        results = fetch_sources({'Calendar events': lambda: ['event'], 'Weather': release.wait,
+                                 'Battery level': failing}, 0.2, logger,
+                                fallbacks={'Weather': lambda: {'cached': True}, 'Battery level': lambda: None})
+    finally:
+        release.set()
+    assert results == {'Calendar events': ['event'], 'Weather': {'cached': True}, 'Battery level': None}
+
+
+def test_calendar_timeout_is_fatal():
+    release = threading.Event()
+    try:
+        with pytest.raises(TimeoutError):
+            fetch_sources({'Calendar events': release.wait, 'Weather': dict}, 0.2, logger, fallbacks={'Weather': dict})
+    finally:
+        release.set()
+
+
+def test_hung_source_does_not_delay_exit():
+    # The interpreter exits right after the deadline although the weather fetch never returns
+    script = (
+        "import logging, time\n"
+        "from main import fetch_sources\n"
+        "fetch_sources({'Calendar events': list, 'Weather': lambda: time.sleep(60)}, 0.2, logging.getLogger(),\n"
+        "              fallbacks={'Weather': dict})\n"
+    )
+    start = time.monotonic()
+    subprocess.run([sys.executable, '-c', script], cwd=pathlib.Path(__file__).parent.parent, check=True, timeout=30)
+    assert time.monotonic() - start < 10
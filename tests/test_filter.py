@@ -0,0 +1,116 @@
+"""
+The streaming pre-filter of large feeds: in_window decides from the raw properties of one VEVENT, filter_feed keeps
+everything that can overlap the window, so the expanded events equal those of a full parse.
+"""
+
+import datetime as dt
+import io
+
+import pytest
+from pytz import timezone
+
+from bench.synthetic import make_feed
+from cal.cal import CalHelper
+
+TZ = timezone('Europe/London')
+START = TZ.localize(dt.datetime(2026, 10, 4))
+END = TZ.localize(dt.datetime(2026, 11, 7, 23, 59, 59))
+
+
+def props(**values):
+    return {name.replace('_', '-').encode(): value.encode() for name, value in values.items()}
+
+
+@pytest.mark.parametrize('values, expected', [
+    (dict(DTSTART='20261010T090000Z', DTEND='20261010T100000Z'), True),
+    (dict(DTSTART='20260910T090000Z', DTEND='20260910T100000Z'), False),
+    (dict(DTSTART='20261210T090000Z', DTEND='20261210T100000Z'), False),
+    # the day of slack around the window covers timezone offsets
+    (dict(DTSTART='20261003T230000Z', DTEND='20261003T233000Z'), True),
+    (dict(DTSTART='20260901', DTEND='20261005'), True),
+    # RRULE with and without UNTIL
+    (dict(DTSTART='20250101T090000Z', RRULE='FREQ=WEEKLY;UNTIL=20260901T000000Z'), False),
+    (dict(DTSTART='20250101T090000Z', RRULE='FREQ=WEEKLY;UNTIL=20261020T000000Z'), True),
+    (dict(DTSTART='20250101T090000Z', RRULE='FREQ=WEEKLY;COUNT=5'), True),
+    (dict(DTSTART='20250101T090000Z', RRULE='FREQ=DAILY'), True),
+    (dict(DTSTART='20250101T090000Z', RDATE='20261010T090000Z'), True),
+    # DURATION instead of DTEND
+    (dict(DTSTART='20260920', DURATION='P3W'), True),
+    (dict(DTSTART='20260920', DURATION='P2D'), False),
+    (dict(DTSTART='20260920T090000Z', DURATION='PT1H'), False),
+    (dict(DTSTART='20261020T090000Z', DURATION='PT1H'), True),
+    # an override moved out of the window still cancels the occurrence it replaces
+    (dict(DTSTART='20261210T090000Z', DTEND='20261210T100000Z', RECURRENCE_ID='20261014T090000Z'), True),
+    (dict(DTSTART='20261210T090000Z', DTEND='20261210T100000Z', RECURRENCE_ID='20261201T090000Z'), False),
+    (dict(DTSTART='20261012T090000Z', DTEND='20261012T100000Z', RECURRENCE_ID='20261201T090000Z'), True),
+    # undecidable values are kept
+    (dict(SUMMARY='no start'), True),
+    (dict(DTSTART='garbage', DTEND='20260910'), True),
+])
+def test_in_window(values, expected):
+    assert CalHelper().in_window(props(**values), START, END) is expected
+
+
+def feed(*events):
+    return ('BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//einkcal//test//EN\r\n' + ''.join(events) +
+            'END:VCALENDAR\r\n').encode()
+
+
+def event(uid, *lines):
+    return 'BEGIN:VEVENT\r\nUID:{}\r\nDTSTAMP:20261001T000000Z\r\nSUMMARY:{}\r\n{}END:VEVENT\r\n'.format(
+        uid, uid, ''.join(line + '\r\n' for line in lines))
+
+
+ALARM_FIRST = event('alarm-first', 'DTSTART;VALUE=DATE:20260920', 'BEGIN:VALARM', 'ACTION:DISPLAY',
+                    'TRIGGER:-PT15M', 'DURATION:PT15M', 'REPEAT:2', 'END:VALARM', 'DURATION:P30D')
+ALARM_ONLY = event('alarm-only', 'DTSTART:20260601T090000Z', 'BEGIN:VALARM', 'ACTION:DISPLAY', 'TRIGGER:-P1D',
+                   'DURATION:P365D', 'REPEAT:1', 'END:VALARM')
+
+
+def kept_uids(data):
+    filtered = CalHelper().filter_feed(io.BytesIO(data), START, END)
+    return [line.split(b':', 1)[1].strip().decode() for line in filtered.splitlines() if line.startswith(b'UID:')]
+
+
+def test_filter_ignores_alarm_properties():
+    # the alarm's DURATION comes first but the event lasts 30 days, into the window. An event without an end is
+    # over the day it starts, however long its alarm repeats
+    assert kept_uids(feed(ALARM_FIRST, ALARM_ONLY)) == ['alarm-first']
+
+
+def test_filter_keeps_calendar_properties_and_folded_lines():
+    data = feed(event('folded', 'DTSTART:2026101', ' 0T090000Z', 'DTEND:20261010T100000Z'),
+                event('outside', 'DTSTART:20250101T090000Z', 'DTEND:20250101T100000Z'))
+    filtered = CalHelper().filter_feed(io.BytesIO(data), START, END)
+    assert filtered.startswith(b'BEGIN:VCALENDAR\r\nVERSION:2.0\r\n')
+    assert filtered.endswith(b'END:VCALENDAR\r\n')
+    assert kept_uids(data) == ['folded']
+
+
+def expand(tmp_path, data, streaming):
+    path = tmp_path / 'feed.ics'
+    path.write_bytes(data)
+    helper = CalHelper(streaming=streaming)
+    cal, badEvents = helper.parse_feed(str(path), START, END)
+    events = helper.expand_events(cal, badEvents, START, END, TZ)
+    return sorted((event.uid, event.summary, event.start, event.end, event.flags) for event in events)
+
+
+def test_streaming_equals_full_parse(tmp_path):
+    synthetic = make_feed(1500, 0.3, START.date(), 'Europe/London', seed=11)
+    extra = feed(ALARM_FIRST, ALARM_ONLY,
+                 event('moved', 'DTSTART:20250107T090000Z', 'DTEND:20250107T100000Z',
+                       'RRULE:FREQ=WEEKLY;UNTIL=20261231T000000Z'),
+                 event('moved', 'RECURRENCE-ID:20261013T090000Z', 'DTSTART:20261215T090000Z',
+                       'DTEND:20261215T100000Z'),
+                 event('ended', 'DTSTART:20250107T090000Z', 'DTEND:20250107T100000Z',
+                       'RRULE:FREQ=WEEKLY;UNTIL=20260101T000000Z'))
+    # both calendars' events in one feed
+    data = synthetic.replace(b'END:VCALENDAR\r\n', extra.split(b'PRODID:-//einkcal//test//EN\r\n', 1)[1])
+    full = expand(tmp_path, data, streaming=False)
+    assert full == expand(tmp_path, data, streaming=True)
+    uids = {uid for uid, *_ in full}
+    assert 'alarm-first' in uids and 'moved' in uids and 'ended' not in uids
+    # the moved occurrence is gone from the window
+    assert not any(uid == 'moved' and start == dt.datetime(2026, 10, 13, 9, tzinfo=dt.timezone.utc).timestamp()
+                   for uid, _, start, *_ in full)
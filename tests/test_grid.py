@@ -0,0 +1,161 @@
+"""
+CalendarGrid lays the sorted events out over the 35 day cells in one pass. It is compared with the placement the
+renderers did before it, which bucketed every event on its first and last day only, and with a plain per-cell
+reference for events that span three days or more.
+"""
+
+import datetime as dt
+import math
+import random
+
+import pytest
+
+from cal.event import Event
+from render.grid import CalendarGrid
+
+START = dt.date(2026, 9, 28)
+TODAY = dt.date(2026, 10, 4)
+
+
+def short_time(time):
+    return time.strftime('%H:%M')
+
+
+def event(summary, startDay, endDay=None, minute=9 * 60, allday=False):
+    # days relative to START
+    endDay = startDay if endDay is None else endDay
+    first, last = START.toordinal() + startDay, START.toordinal() + endDay
+    return Event.from_local(summary, summary, first * 86400 + minute * 60, last * 86400, first, last, minute, allday)
+
+
+def grid(events, maxEventsPerDay=3):
+    events = sorted(events, key=lambda x: x.start)
+    return CalendarGrid({'calStartDate': START, 'today': TODAY, 'maxEventsPerDay': maxEventsPerDay,
+                         'events': events}, short_time)
+
+
+def old_placement(events, maxEventsPerDay):
+    # The bucketing of RenderHelper.process_inputs before the grid: start day, and end day of multi-day events
+    calList = [[] for _ in range(35)]
+    for event in events:
+        idx = event.startDay - START.toordinal()
+        if idx >= 0:
+            calList[idx].append(event)
+        if event.isMultiday:
+            idx = event.endDay - START.toordinal()
+            if idx < len(calList):
+                calList[idx].append(event)
+    return [reference_cell(i, cellEvents, maxEventsPerDay) for i, cellEvents in enumerate(calList)]
+
+
+def per_cell_placement(events, maxEventsPerDay):
+    # Every day an event covers, found by checking each cell against each event
+    cells = []
+    for i in range(35):
+        day = START.toordinal() + i
+        cellEvents = [event for event in events
+                      if event.startDay <= day <= (event.endDay if event.isMultiday else event.startDay)]
+        cells.append(reference_cell(i, cellEvents, maxEventsPerDay))
+    return cells
+
+
+def reference_cell(i, cellEvents, maxEventsPerDay):
+    currDate = START + dt.timedelta(days=i)
+    count = len(cellEvents)
+    shown = []
+    for event in cellEvents[:maxEventsPerDay]:
+        if event.isMultiday:
+            arrow = 'right' if event.startDay == currDate.toordinal() else 'left'
+            shown.append((event.summary, event.summary, arrow))
+        elif event.allday:
+            shown.append((event.summary, event.summary, None))
+        else:
+            shown.append((event.summary, short_time(event.startTime) + ' ' + event.summary, None))
+    lineLimit = max(math.floor(maxEventsPerDay / count), 1) if count else 1
+    return count, lineLimit, max(count - maxEventsPerDay, 0), shown
+
+
+def placement(calendarGrid):
+    return [(cell['count'], cell['lineLimit'], cell['more'],
+             [(entry['event'].summary, entry['text'], entry['arrow']) for entry in cell['events']])
+            for cell in calendarGrid.cells]
+
+
+def random_events(rng, maxSpan, n):
+    events = []
+    for i in range(n):
+        first = rng.randrange(-3 if maxSpan > 1 else 0, 35)
+        last = min(first + rng.randrange(maxSpan), 34)
+        if last < 0:
+            continue
+        allday = rng.random() < 0.3
+        events.append(event('e{}'.format(i), first, last, 0 if allday else rng.randrange(0, 1440, 15), allday))
+    return sorted(events, key=lambda x: x.start)
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('maxEventsPerDay', [1, 2, 3, 5])
+def test_matches_old_placement(seed, maxEventsPerDay):
+    # Events of one or two days have no middle days, the old bucketing placed them in full
+    events = random_events(random.Random(seed), 2, 80)
+    assert placement(grid(events, maxEventsPerDay)) == old_placement(events, maxEventsPerDay)
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('maxEventsPerDay', [1, 3, 5])
+def test_matches_per_cell_placement(seed, maxEventsPerDay):
+    events = random_events(random.Random(seed), 12, 60)
+    assert placement(grid(events, maxEventsPerDay)) == per_cell_placement(events, maxEventsPerDay)
+
+
+def test_counts_line_limit_and_more():
+    events = [event('a', 1), event('b', 1), event('c', 2), event('d', 2), event('e', 2), event('f', 2),
+              event('g', 2), event('h', 3)]
+    cells = grid(events, maxEventsPerDay=3).cells
+    assert [(cell['count'], cell['lineLimit'], cell['more'], len(cell['events'])) for cell in cells[:5]] == \
+        [(0, 1, 0, 0), (2, 1, 0, 2), (5, 1, 2, 3), (1, 3, 0, 1), (0, 1, 0, 0)]
+    assert [entry['text'] for entry in cells[2]['events']] == ['09:00 c', '09:00 d', '09:00 e']
+
+
+def test_full_cells_are_skipped():
+    # The first day of the long event is full by the time it is placed, it still shows on the days it continues into
+    events = [event('x', 3, minute=480), event('long', 3, 6, minute=600), event('y', 5, minute=480)]
+    cells = grid(events, maxEventsPerDay=1).cells
+    assert [[(entry['event'].summary, entry['arrow']) for entry in cell['events']] for cell in cells[2:8]] == \
+        [[], [('x', None)], [('long', 'left')], [('long', 'left')], [('long', 'left')], []]
+    assert [cell['more'] for cell in cells[2:8]] == [0, 1, 0, 1, 0, 0]
+
+
+def test_arrows_of_overlapping_multiday_events():
+    events = [event('trip', 5, 8, allday=True), event('course', 7, 9, minute=540), event('party', 7, minute=1200)]
+    cells = grid(events, maxEventsPerDay=3).cells
+    entries = [[(entry['text'], entry['arrow']) for entry in cell['events']] for cell in cells[5:11]]
+    assert entries == [
+        [('trip', 'right')],
+        [('trip', 'left')],
+        [('trip', 'left'), ('course', 'right'), ('20:00 party', None)],
+        [('trip', 'left'), ('course', 'left')],
+        [('course', 'left')],
+        [],
+    ]
+    assert [cell['lineLimit'] for cell in cells[5:11]] == [3, 3, 1, 1, 3, 1]
+
+
+def test_events_clamped_to_the_page():
+    # Started before the first cell, or running past the last one
+    events = [event('before', -4, 1, allday=True), event('after', 33, 40, allday=True)]
+    cells = grid(events).cells
+    assert [(entry['text'], entry['arrow']) for entry in cells[0]['events']] == [('before', 'left')]
+    assert [(entry['text'], entry['arrow']) for entry in cells[34]['events']] == [('after', 'left')]
+    assert [(entry['text'], entry['arrow']) for entry in cells[33]['events']] == [('after', 'right')]
+    assert sum(cell['count'] for cell in cells) == 2 + 2
+
+
+def test_cells_dates_and_forecast():
+    forecast = {TODAY: {'high': 18}}
+    cells = CalendarGrid({'calStartDate': START, 'today': TODAY, 'maxEventsPerDay': 3, 'events': [],
+                          'forecast': forecast}, short_time).cells
+    assert len(cells) == 35
+    assert cells[6]['isToday'] and cells[6]['forecast'] == {'high': 18}
+    assert cells[0]['muted'] and not cells[6]['muted'] and cells[34]['muted']
+    assert sum(cell['isToday'] for cell in cells) == 1
@@ -0,0 +1,75 @@
+"""
+Several calendars are fetched concurrently and their sorted event lists merged: the result is in start order across
+feeds, an event shared by two calendars is shown once, and a failing feed only loses its own events.
+"""
+
+import datetime as dt
+
+import pytest
+from pytz import timezone
+
+from cal.cal import CalHelper
+from cal.event import RED, Event
+
+TZ = timezone('Europe/London')
+START = TZ.localize(dt.datetime(2026, 10, 4))
+END = TZ.localize(dt.datetime(2026, 11, 7, 23, 59, 59))
+
+
+def event(uid, day, hour, summary=None):
+    start = TZ.localize(dt.datetime(2026, 10, day, hour))
+    return Event.from_datetimes(uid, summary or uid, start, start + dt.timedelta(hours=1), False)
+
+
+@pytest.fixture
+def helper(monkeypatch):
+    # url -> the sorted events the feed expands to, or an exception to raise
+    feeds = {}
+
+    def retrieve(session, calendar, startDate, endDate, localTZ):
+        if isinstance(feeds[calendar], Exception):
+            raise feeds[calendar]
+        return list(feeds[calendar])
+
+    helper = CalHelper()
+    helper.feeds = feeds
+    monkeypatch.setattr(helper, 'retrieve_calendar_events', retrieve)
+    return helper
+
+
+def summaries(events):
+    return [event.summary for event in events]
+
+
+def test_merge_is_in_start_order_across_feeds(helper):
+    helper.feeds['a'] = [event('a1', 5, 9), event('a2', 6, 12), event('a3', 9, 8)]
+    helper.feeds['b'] = [event('b1', 4, 18), event('b2', 6, 10), event('b3', 20, 7)]
+    helper.feeds['c'] = []
+    events = helper.retrieve_events(['a', 'b', 'c'], START, END, TZ, 1)
+    assert summaries(events) == ['b1', 'a1', 'b2', 'a2', 'a3', 'b3']
+    assert [event.start for event in events] == sorted(event.start for event in events)
+
+
+def test_equal_starts_keep_the_feed_order(helper):
+    helper.feeds['a'] = [event('a1', 5, 9)]
+    helper.feeds['b'] = [event('b1', 5, 9)]
+    assert summaries(helper.retrieve_events(['a', 'b'], START, END, TZ, 1)) == ['a1', 'b1']
+    assert summaries(helper.retrieve_events(['b', 'a'], START, END, TZ, 1)) == ['b1', 'a1']
+
+
+def test_shared_events_are_shown_once(helper):
+    # The same invitation in two calendars, one occurrence moved in the second one only
+    helper.feeds['work'] = [event('meeting', 5, 9, 'work'), event('meeting', 12, 9, 'work')]
+    helper.feeds['home'] = [event('meeting', 5, 9, 'home'), event('meeting', 12, 11, 'home'),
+                            event('', 12, 11, 'no uid'), event('', 12, 11, 'no uid')]
+    events = helper.retrieve_events([{'url': 'work', 'color': 'red'}, 'home'], START, END, TZ, 1)
+    # the first calendar listed wins, events without a uid are never merged
+    assert summaries(events) == ['work', 'work', 'home', 'no uid', 'no uid']
+    assert [bool(event.flags & RED) for event in events] == [True, True, False, False, False]
+
+
+def test_failing_feed_keeps_the_others(helper):
+    helper.feeds['a'] = [event('a1', 5, 9)]
+    helper.feeds['broken'] = OSError('unreachable')
+    helper.feeds['b'] = [event('b1', 4, 9)]
+    assert summaries(helper.retrieve_events(['a', 'broken', 'b'], START, END, TZ, 1)) == ['b1', 'a1']
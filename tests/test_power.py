@@ -0,0 +1,72 @@
+"""
+PiSugarClient against power.fakepisugar: one command per write, garbled readings keep the last good value and
+waiting for a button event without a server still takes the whole timeout.
+"""
+
+import socket
+import time
+
+from power.fakepisugar import FakePiSugarServer
+from power.power import PiSugarClient
+
+
+def test_garbled_reading_keeps_last_value():
+    server = FakePiSugarServer(port=0).start()
+    try:
+        client = PiSugarClient(port=server.port)
+        assert client.status(maxAge=0)['level'] == 87.5
+        server.state['battery'] = 'I2C error'
+        status = client.status(maxAge=0)
+        assert status['level'] == 87.5
+        assert status['model'] == 'PiSugar 3'
+        server.state['battery'] = 80.25
+        assert client.status(maxAge=0)['level'] == 80.25
+        client.close()
+    finally:
+        server.stop()
+
+
+def test_garbled_first_reading_is_none():
+    server = FakePiSugarServer(port=0, state={'temperature': 'n/a'}).start()
+    try:
+        client = PiSugarClient(port=server.port)
+        assert client.status(maxAge=0)['temperature'] is None
+        client.close()
+    finally:
+        server.stop()
+
+
+def test_wait_event_without_server_waits():
+    # a port nobody listens on
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    client = PiSugarClient(port=port, timeout=1)
+    start = time.monotonic()
+    assert client.wait_event(0.3) is None
+    assert time.monotonic() - start >= 0.3
+
+
+def test_one_command_per_write():
+    server = FakePiSugarServer(port=0).start()
+    try:
+        client = PiSugarClient(port=server.port)
+        client.status(maxAge=0)
+        client.command('rtc_web')
+        assert server.requests == ['get battery', 'get battery_charging', 'get battery_power_plugged', 'get model',
+                                   'get temperature', 'rtc_web']
+        client.close()
+    finally:
+        server.stop()
+
+
+def test_fake_server_rejects_pipelined_commands():
+    server = FakePiSugarServer(port=0).start()
+    try:
+        with socket.create_connection((server.host, server.port), 1) as sock:
+            sock.sendall(b'get battery\nget model\n')
+            reader = sock.makefile('rb')
+            assert reader.readline() == b'Invalid request.\n'
+    finally:
+        server.stop()
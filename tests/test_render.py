@@ -0,0 +1,16 @@
+"""
+Battery icon choice of the renderers, it runs for the input hash before every render.
+"""
+
+import pytest
+
+from render.render import RenderHelper
+
+
+@pytest.mark.parametrize('level, mode, expected', [
+    (95, 1, 'battery80'), (60, 1, 'battery60'), (45, 1, 'battery40'), (20, 1, 'battery20'), (15, 1, 'battery0'),
+    (12, 1, 'battery0'), (5, 1, 'battery0'), (15, 2, 'battery0'), (50, 2, 'batteryHide'), (50, 0, 'batteryHide'),
+    (None, 1, 'batteryHide'),
+])
+def test_battery_text(level, mode, expected):
+    assert RenderHelper(984, 1304, 90).get_battery_text(level, mode) == expected
@@ -0,0 +1,46 @@
+"""
+WakeScheduler plans one wake-up a day by default, the extra wakes are opt-in.
+"""
+
+import datetime as dt
+
+from pytz import timezone
+
+from power.scheduler import WakeScheduler
+
+TZ = timezone('Europe/London')
+
+
+def at(day, hour, minute=0):
+    return TZ.localize(dt.datetime(2026, 10, day, hour, minute))
+
+
+def test_default_wakes_once_a_day():
+    scheduler = WakeScheduler(TZ, 6, 30)
+    assert scheduler.next_wake(at(17, 6, 31)) == (at(18, 6, 30), 'daily update')
+    assert scheduler.next_wake(at(17, 3)) == (at(17, 6, 30), 'daily update')
+
+
+def test_rollover_is_opt_in():
+    scheduler = WakeScheduler(TZ, 6, 30, atRollover=True)
+    assert scheduler.next_wake(at(17, 6, 31)) == (at(18, 0, 1), 'day rollover')
+
+
+def test_next_daily_after_now():
+    scheduler = WakeScheduler(TZ, 6, 30, atRollover=True)
+    assert scheduler.next_daily(at(18, 0, 1)) == at(18, 6, 30)
+    assert scheduler.next_daily(at(18, 6, 30)) == at(19, 6, 30)
+
+
+def test_min_gap_beyond_every_candidate():
+    # The last candidate is the daily update two days ahead, a longer gap must not leave nothing to arm
+    scheduler = WakeScheduler(TZ, 6, 30, atRollover=True, eventLeadMinutes=15, minGapMinutes=3 * 24 * 60)
+    assert scheduler.next_wake(at(17, 6, 31)) == (at(18, 6, 30), 'daily update')
+    assert scheduler.next_wake(at(17, 3)) == (at(17, 6, 30), 'daily update')
+
+
+def test_min_gap_skips_earlier_candidates():
+    scheduler = WakeScheduler(TZ, 6, 30, atRollover=True, minGapMinutes=12 * 60)
+    assert scheduler.next_wake(at(17, 12)) == (at(18, 0, 1), 'day rollover')
+    assert scheduler.next_wake(at(17, 13)) == (at(18, 6, 30), 'daily update')
+    assert scheduler.next_wake(at(17, 20)) == (at(19, 6, 30), 'daily update')
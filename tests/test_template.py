@@ -0,0 +1,117 @@
+"""
+The HTML page template is compiled once: its stylesheets are stripped to the rules the page can match and inlined.
+The compiled page must keep every rule and font the calendar needs and be rebuilt when a source file changes.
+"""
+
+import os
+import pathlib
+import re
+
+import pytest
+
+from render.render import GENERATED_CLASSES, GENERATED_CLASS_PREFIXES, GENERATED_TAGS
+from render.template import get_template, strip_css
+
+RENDER = pathlib.Path(__file__).parent.parent / 'render'
+
+CSS = """@charset "utf-8";
+/* a comment with a { brace */
+@import url(other.css);
+@font-face { font-family: 'Used'; src: url(data:font/woff2;base64,AAAA{}) }
+@font-face { font-family: "Unused"; src: url(unused.woff2) }
+body, .unused { font-family: Used, sans-serif; }
+.date, .missing > a { color: black; }
+.wi-owm-501:before { content: "{"; }
+.wi-owm-502 { animation: spin 2s; }
+@keyframes spin { from { transform: rotate(0) } to { transform: rotate(1turn) } }
+@keyframes unusedSpin { from { opacity: 0 } }
+table td { padding: 0; }
+@media print { .date { color: red; } .unused { color: blue; } }
+@media print { .unused { color: blue; } }
+"""
+
+
+@pytest.fixture
+def stripped():
+    return strip_css(CSS, {'date'}, ('wi-owm-',), {'html', 'body', 'li', 'div'})
+
+
+def test_strip_css_keeps_matching_rules(stripped):
+    assert 'body{font-family: Used, sans-serif;}' in stripped
+    assert '.date{color: black;}' in stripped
+    assert '.wi-owm-501:before{content: "{";}' in stripped
+    assert '@media print{.date{color: red;}}' in stripped
+    assert stripped.startswith('@font-face') and '@charset "utf-8";' in stripped
+
+
+def test_strip_css_drops_unused_rules(stripped):
+    for text in ('.unused', '.missing', 'table', '@import', 'a comment', 'unusedSpin'):
+        assert text not in stripped
+    assert stripped.count('@media') == 1
+
+
+def test_strip_css_keeps_referenced_fonts_and_keyframes(stripped):
+    assert "@font-face{font-family: 'Used'; src: url(data:font/woff2;base64,AAAA{})}" in stripped
+    assert 'Unused' not in stripped
+    assert '@keyframes spin{' in stripped
+
+
+def test_calendar_template_keeps_needed_rules():
+    template = get_template(str(RENDER / 'calendar_template.html'), classes=GENERATED_CLASSES,
+                            classPrefixes=GENERATED_CLASS_PREFIXES, tags=GENERATED_TAGS)
+    html = template.fill(month='10', battText='battery80', dayOfWeek='<li>Mon</li>', events='<li>event</li>',
+                         forcastImage=501, forcastString='10% | 8-15°', forcastStyle='text-uppercase')
+    style = re.search(r'<style>(.*)</style>', html, re.S).group(1)
+    for selector in ('.datecircle', '.text-muted', '.text-uppercase', '.wi-owm-501:before', '.battery80',
+                     '.calendar', '.days'):
+        assert selector in style
+    families = set(re.findall(r'@font-face\{font-family:\s*[\'"]?([^;\'"]+)', style))
+    assert {'NotoSans', 'NotoSansBold'} <= families
+    assert '<link rel="stylesheet"' not in html
+    assert 'src="file://' in html
+    sheets = sum(path.stat().st_size for path in (RENDER / 'css').glob('*.css'))
+    assert len(style) < sheets
+
+
+@pytest.fixture
+def page(tmp_path):
+    (tmp_path / 'css').mkdir()
+    (tmp_path / 'css' / 'styles.css').write_text('.a { color: red; }\n.b { color: blue; }\n')
+    (tmp_path / 'page.html').write_text('<html><head>\n<link rel="stylesheet" href="css/styles.css">\n</head>\n'
+                                        '<body><div class="a">{text}</div></body></html>\n')
+    return tmp_path
+
+
+def test_template_is_compiled_once(page):
+    template = get_template(str(page / 'page.html'))
+    assert template.fill(text='x') == \
+        '<html><head>\n\n<style>.a{color: red;}</style>\n</head>\n<body><div class="a">x</div></body></html>\n'
+    assert get_template(str(page / 'page.html')) is template
+
+
+@pytest.mark.parametrize('changed, old, new', [('page.html', '<body>', '<BODY>'), ('css/styles.css', 'red', 'tan')])
+def test_changed_file_invalidates(page, changed, old, new):
+    template = get_template(str(page / 'page.html'))
+    path = page / changed
+    # Same size, only the modification time differs
+    path.write_text(path.read_text().replace(old, new))
+    os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 10 ** 9))
+    recompiled = get_template(str(page / 'page.html'))
+    assert recompiled is not template
+    assert new in recompiled.fill(text='x')
+    assert get_template(str(page / 'page.html')) is recompiled
+
+
+def test_size_change_invalidates(page):
+    template = get_template(str(page / 'page.html'))
+    stat = (page / 'css' / 'styles.css').stat()
+    (page / 'css' / 'styles.css').write_text('.a { color: green; font-weight: bold; }\n')
+    os.utime(page / 'css' / 'styles.css', ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert 'green' in get_template(str(page / 'page.html')).fill(text='x')
+    assert template.signature != template.get_signature(template.sources)
+
+
+def test_removed_stylesheet_invalidates(page):
+    template = get_template(str(page / 'page.html'))
+    (page / 'css' / 'styles.css').unlink()
+    assert not template.is_current()
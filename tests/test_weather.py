@@ -0,0 +1,153 @@
+"""
+The daily forecast is cached per location and unit: a fresh entry is served without an API call, an expired one is
+downloaded again and only used when that fails. Values the API leaves out fall back to the cached ones, or blank.
+"""
+
+import json
+import types
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+import weather.weather as weather
+from weather.weather import WeatherHelper
+
+TODAY = datetime.today().date()
+NOON = int(datetime(TODAY.year, TODAY.month, TODAY.day, 12, tzinfo=timezone.utc).timestamp())
+
+
+def daily(days=3, **values):
+    # One Call "daily" entries from today on
+    entries = []
+    for i in range(days):
+        entry = {'dt': NOON + i * 86400, 'temp': {'max': 20.6 + i, 'min': 9.4 + i}, 'pop': 0.234,
+                 'weather': [{'id': 500 + i}]}
+        entry.update(values)
+        entries.append(entry)
+    return entries
+
+
+class FakeSession:
+
+    def __init__(self):
+        self.urls = []
+        self.responses = []  # bodies returned in turn, the last one repeated, or an exception to raise
+
+    def get(self, url, timeout):
+        self.urls.append(url)
+        body = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        if isinstance(body, Exception):
+            raise body
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps({'daily': body}).encode()
+        return response
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=1_800_000_000.0)
+    monkeypatch.setattr(weather, 'time', types.SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture
+def helper(tmp_path, monkeypatch, clock):
+    monkeypatch.setattr(weather, 'CACHE_FILE', str(tmp_path / 'cache.json'))
+    helper = WeatherHelper(cacheMinutes=60)
+    helper.session = FakeSession()
+    helper.session.responses = [daily()]
+    return helper
+
+
+def test_forecast_per_day(helper):
+    forecast = helper.get_forecast(51.5, -0.1, 'key')
+    assert sorted(forecast) == [TODAY + timedelta(days=i) for i in range(3)]
+    assert forecast[TODAY] == {'high': 21, 'low': 9, 'pop': 23, 'id': 500}
+    assert helper.get_weather(51.5, -0.1, 'key') == forecast[TODAY]
+
+
+def test_cache_hit_within_ttl(helper, clock):
+    first = helper.get_forecast(51.5, -0.1, 'key')
+    clock.now += 59 * 60
+    assert helper.get_forecast(51.5, -0.1, 'key') == first
+    assert len(helper.session.urls) == 1
+    # a new helper, as after a restart, reads the same file
+    restarted = WeatherHelper(cacheMinutes=60)
+    restarted.session = helper.session
+    assert restarted.get_forecast(51.5, -0.1, 'key') == first
+    assert len(helper.session.urls) == 1 and not restarted.stale
+
+
+def test_cache_expiry(helper, clock):
+    helper.get_forecast(51.5, -0.1, 'key')
+    clock.now += 60 * 60
+    helper.session.responses = [daily(temp={'max': 30, 'min': 15})]
+    assert helper.get_forecast(51.5, -0.1, 'key')[TODAY]['high'] == 30
+    assert len(helper.session.urls) == 2 and not helper.stale
+
+
+def test_cache_without_today_is_a_miss(helper, clock):
+    helper.session.responses = [[entry for entry in daily() if entry['dt'] != NOON]]
+    helper.get_forecast(51.5, -0.1, 'key')
+    helper.session.responses = [daily()]
+    assert TODAY in helper.get_forecast(51.5, -0.1, 'key')
+    assert len(helper.session.urls) == 2
+
+
+def test_cache_key_covers_location_and_unit(helper):
+    for lat, lon, unit in [(51.5, -0.1, 'metric'), (51.5, -0.1, 'imperial'), (48.9, -0.1, 'metric'),
+                           (51.5, 2.3, 'metric'), (51.5, -0.1, 'metric')]:
+        helper.get_forecast(lat, lon, 'key', unit)
+    assert len(helper.session.urls) == 4
+    assert 'units=imperial' in helper.session.urls[1] and 'lat=48.9' in helper.session.urls[2]
+    with open(weather.CACHE_FILE) as file:
+        assert sorted(json.load(file)) == ['48.9,-0.1,metric', '51.5,-0.1,imperial', '51.5,-0.1,metric',
+                                           '51.5,2.3,metric']
+
+
+def test_failed_download_uses_expired_cache(helper, clock):
+    first = helper.get_forecast(51.5, -0.1, 'key')
+    clock.now += 24 * 3600
+    helper.session.responses = [requests.exceptions.ConnectionError('offline')]
+    assert helper.get_forecast(51.5, -0.1, 'key') == first
+    assert helper.stale
+
+
+def test_failed_download_without_cache(helper):
+    helper.session.responses = [requests.exceptions.ConnectionError('offline')]
+    assert helper.get_forecast(51.5, -0.1, 'key') == {}
+    assert helper.get_cached_forecast(51.5, -0.1) == {}
+
+
+@pytest.mark.parametrize('values', [
+    {'temp': None, 'pop': None, 'weather': []},
+    {'temp': {'max': None}, 'pop': None, 'weather': [{}]},
+])
+def test_missing_values_are_blank(helper, values):
+    entries = daily(**values)
+    for entry in entries:
+        if values['pop'] is None:
+            del entry['pop']
+    helper.session.responses = [entries]
+    assert helper.get_forecast(51.5, -0.1, 'key')[TODAY] == {'high': '', 'low': '', 'pop': '', 'id': None}
+
+
+def test_missing_values_keep_the_cached_ones(helper, clock):
+    helper.get_forecast(51.5, -0.1, 'key')
+    clock.now += 2 * 3600
+    update = daily(temp={'max': None, 'min': 3.2}, pop=None)
+    update[1]['weather'] = None
+    added = daily(4)[3:]
+    del added[0]['pop']
+    helper.session.responses = [update + added]
+    forecast = helper.get_forecast(51.5, -0.1, 'key')
+    assert forecast[TODAY] == {'high': 21, 'low': 3, 'pop': 23, 'id': 500}
+    assert forecast[TODAY + timedelta(days=1)]['id'] == 501
+    # a day that was not cached yet has nothing to fall back to
+    assert forecast[TODAY + timedelta(days=3)] == {'high': 24, 'low': 12, 'pop': '', 'id': 503}
+    # the filled values are cached, the next fallback does not depend on the older entry
+    clock.now += 2 * 3600
+    helper.session.responses = [requests.exceptions.ConnectionError('offline')]
+    assert helper.get_forecast(51.5, -0.1, 'key') == forecast
@@ -0,0 +1,44 @@
+"""
+The /api/battery endpoint reads the battery through the shared, cached PiSugar client.
+"""
+
+import pytest
+
+flask = pytest.importorskip('flask')
+
+import wifi
+from power.fakepisugar import FakePiSugarServer
+from power.power import get_client
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakePiSugarServer(port=0).start()
+    monkeypatch.setattr(wifi.pisugar, 'port', server.port)
+    wifi.pisugar.close()
+    wifi.pisugar.invalidate()
+    yield server
+    wifi.pisugar.close()
+    wifi.pisugar.invalidate()
+    server.stop()
+
+
+def test_battery_uses_shared_client(server):
+    assert wifi.pisugar is get_client()
+    client = wifi.app.test_client()
+    response = client.get('/api/battery')
+    assert response.status_code == 200
+    assert response.get_json() == {'status': 'ok', 'level': 87.5, 'charging': False, 'plugged': False,
+                                   'model': 'PiSugar 3', 'temperature': 31.0}
+    requests = len(server.requests)
+    # a second request within the cache period is answered without asking the server again
+    server.state['battery'] = 50.0
+    assert client.get('/api/battery').get_json()['level'] == 87.5
+    assert len(server.requests) == requests
+
+
+def test_battery_without_server(monkeypatch, server):
+    server.stop()
+    monkeypatch.setattr(wifi.pisugar, 'port', 1)
+    response = wifi.app.test_client().get('/api/battery')
+    assert response.status_code == 503
@@ -4,15 +4,24 @@ signed up for an OWM account and also obtained a valid API key that is specified
 """
 
 import logging
+import os
+import pathlib
 import requests
 import json
 import string
-from datetime import datetime
+import time
+from datetime import datetime, timezone
+
+# Daily forecasts per location and unit, so a wake within the cache period or without network needs no API call
+CACHE_FILE = str(pathlib.Path(__file__).parent.absolute()) + '/cache.json'
 
 
 class WeatherHelper:
-    def __init__(self):
+    def __init__(self, cacheMinutes=180):
         self.logger = logging.getLogger('einkcal')
+        self.cacheSeconds = cacheMinutes * 60
+        self.stale = False  # set when the forecast comes from an expired cache because the download failed
+        self.session = None  # kept for the next download when the helper stays alive
 
     def retry_strategy(self):
         return requests.adapters.Retry(
@@ -22,17 +31,98 @@ class WeatherHelper:
             allowed_methods=False
         )
 
-    def get_weather(self, lat, lon, api_key, unit="metric"):
+    def load_cache(self):
+        try:
+            with open(CACHE_FILE, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def save_cache(self, cache):
+        with open(CACHE_FILE + '.tmp', 'w') as file:
+            json.dump(cache, file)
+        os.replace(CACHE_FILE + '.tmp', CACHE_FILE)
+
+    def fetch_daily(self, lat, lon, api_key, unit):
+        # All daily entries of the One Call response, reduced to the fields that are rendered
         url = "https://api.openweathermap.org/data/3.0/onecall?lat={0}&lon={1}&appid={2}&exclude=current,minutely,hourly,alerts&units={3}".format(
         lat, lon, api_key, unit)
-        session = requests.Session()
-        session.mount("https://", requests.adapters.HTTPAdapter(max_retries=self.retry_strategy()))
-        response = session.get(url)
+        if self.session is None:
+            self.session = requests.Session()
+            self.session.mount("https://", requests.adapters.HTTPAdapter(max_retries=self.retry_strategy()))
+        response = self.session.get(url, timeout=10)
+        response.raise_for_status()
         data = json.loads(response.text)
-        for forecast in data.get('daily'):
-            if datetime.utcfromtimestamp(forecast.get('dt')).date() == datetime.today().date():
-                w = {'high': round(forecast.get('temp', {}).get('max')),
-                     'low': round(forecast.get('temp', {}).get('min')),
-                     'pop': round(forecast.get('pop') * 100),
-                     'id': forecast.get('weather', [{}])[0].get('id')}
-                return w
+        return [{'dt': forecast['dt'],
+                 'high': (forecast.get('temp') or {}).get('max'),
+                 'low': (forecast.get('temp') or {}).get('min'),
+                 'pop': forecast.get('pop'),
+                 'id': (forecast.get('weather') or [{}])[0].get('id')} for forecast in data['daily']]
+
+    def fill_missing(self, daily, entry):
+        # A value the API left out or sent as null keeps the one cached for that day, if there is one
+        cached = {} if entry is None else {self.get_date(forecast): forecast for forecast in entry['daily']}
+        for forecast in daily:
+            previous = cached.get(self.get_date(forecast), {})
+            for field in ('high', 'low', 'pop', 'id'):
+                if forecast.get(field) is None:
+                    forecast[field] = previous.get(field)
+        return daily
+
+    def get_date(self, forecast):
+        return datetime.fromtimestamp(forecast['dt'], timezone.utc).date()
+
+    def get_day(self, forecast):
+        # Values still missing are drawn blank
+        high, low, pop = forecast.get('high'), forecast.get('low'), forecast.get('pop')
+        return {'high': '' if high is None else round(high),
+                'low': '' if low is None else round(low),
+                'pop': '' if pop is None else round(pop * 100),
+                'id': forecast.get('id')}
+
+    def get_forecast(self, lat, lon, api_key, unit="metric"):
+        # Forecast per date from today on, e.g. {date(2024, 5, 1): {'high': 75, "low": 55, "pop": 10, "id": 501}}.
+        # Served from the cache while it is fresh. When the download fails an expired cache is used, and without
+        # one the calendar is drawn without weather
+        self.stale = False
+        today = datetime.today().date()
+        key = '{},{},{}'.format(lat, lon, unit)
+        cache = self.load_cache()
+        entry = cache.get(key)
+        if entry is not None and time.time() - entry['fetched'] < self.cacheSeconds and \
+                any(self.get_date(forecast) == today for forecast in entry['daily']):
+            self.logger.info("Weather forecast served from cache")
+        else:
+            try:
+                daily = self.fill_missing(self.fetch_daily(lat, lon, api_key, unit), entry)
+                entry = {'fetched': time.time(), 'daily': daily}
+                cache[key] = entry
+                self.save_cache(cache)
+            except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+                if entry is None:
+                    self.logger.error("Error retrieving weather: {}".format(e))
+                    return {}
+                self.logger.warning("Error retrieving weather, using the forecast cached at {}: {}".format(
+                    datetime.fromtimestamp(entry['fetched']).strftime('%Y-%m-%d %H:%M'), e))
+                self.stale = True
+        return self.get_days(entry, today)
+
+    def get_days(self, entry, today):
+        days = {}
+        for forecast in entry['daily']:
+            date = self.get_date(forecast)
+            if date >= today:
+                days[date] = self.get_day(forecast)
+        return days
+
+    def get_cached_forecast(self, lat, lon, unit="metric"):
+        # Whatever forecast is cached, however old, for when the download did not finish in time
+        entry = self.load_cache().get('{},{},{}'.format(lat, lon, unit))
+        if entry is None:
+            return {}
+        self.stale = True
+        return self.get_days(entry, datetime.today().date())
+
+    def get_weather(self, lat, lon, api_key, unit="metric"):
+        # Today's forecast only
+        return self.get_forecast(lat, lon, api_key, unit).get(datetime.today().date(), {})
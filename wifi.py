@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 from flask import Flask, request, jsonify, send_from_directory
 from pathlib import Path
-from pisugar import connect_tcp, PiSugarServer
+from power.power import get_client
+import metrics.metrics as metrics
 from datetime import datetime, timedelta
 import json
 import subprocess
@@ -20,21 +21,16 @@ WIFI_RETRY_WAIT = 20         # wait after turning AP off to let Wi-Fi client com
 AP_SSID = "Calendar Setup"
 PISUGAR_SOCKET = "/tmp/pisugar-server.sock"
 PISUGAR_ALARM_REPEAT = 127  # 1111111 in binary: every day
+METRICS_RUNS = 20           # update runs returned by /api/metrics by default
 
 # ---- Flask setup ----
 
 app = Flask(__name__, static_folder=SCRIPT_DIR, static_url_path="")
 
 # ---- PiSugar setup ----
-try:
-    conn, event_conn = connect_tcp("127.0.0.1", 8423)
-    pisugar = PiSugarServer(conn, event_conn)
-    print("[device] Connected to PiSugar server on 127.0.0.1:8423")
-except Exception as e:
-    pisugar = None
-    print("[device] Failed to connect to PiSugar server:", e)
-
-pisugar_lock = threading.Lock() if pisugar is not None else None
+# Shared client, it connects on first use, reconnects when pisugar-server restarts and serialises the requests
+# of the Flask threads
+pisugar = get_client()
 
 # ---- small helpers ----
 
@@ -164,23 +160,20 @@ def stop_ap():
 
 
 def schedule_wakeup_24h(hour: int, minute: int):
-    if pisugar is None:
-        raise RuntimeError("PiSugar server not connected")
     now = datetime.now().astimezone()
     target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
     if target <= now:
         target += timedelta(days=1)
     repeat_mask = 127  # every day
     print(f"[device] Scheduling wake-up at {target.isoformat()} repeat={repeat_mask}")
-    if pisugar_lock is not None:
-        with pisugar_lock:
-            pisugar.set_battery_auto_power_on(False)
-            pisugar.rtc_alarm_set(target, repeat_mask)
-            pisugar.set_battery_auto_power_on(True)
-    else:
-        pisugar.set_battery_auto_power_on(False)
-        pisugar.rtc_alarm_set(target, repeat_mask)
-        pisugar.set_battery_auto_power_on(True)
+    pisugar.command("set_auto_power_on", "false")
+    pisugar.command("rtc_alarm_set", target.isoformat(), str(repeat_mask))
+    pisugar.command("set_auto_power_on", "true")
+    # main.py re-arms the alarm after every run and plans its wake-ups around this daily time
+    cfg = load_config()
+    cfg["dailyUpdateTime"] = hour
+    cfg["dailyUpdateMinute"] = minute
+    save_config(cfg)
     return target
 
 
@@ -326,36 +319,27 @@ def api_wakeup():
 
 @app.route("/api/wakeup", methods=["GET"])
 def get_wakeup():
-    if pisugar is None:
+    # The alarm itself moves between runs, the daily time it is planned around is kept in the config
+    cfg = load_config()
+    if "dailyUpdateTime" in cfg:
         return jsonify({
-            "status": "error",
-            "message": "PiSugar not connected"
-        }), 503
+            "status": "ok",
+            "hour": int(cfg["dailyUpdateTime"]),
+            "minute": int(cfg.get("dailyUpdateMinute", 0))
+        })
     try:
-        if pisugar_lock is not None:
-            with pisugar_lock:
-                try:
-                    enabled = pisugar.get_rtc_alarm_enabled()
-                    if not enabled:
-                        return jsonify({"status": "none"})
-                except Exception:
-                    pass
-                alarm_dt = pisugar.get_rtc_alarm_time()
-        else:
-            try:
-                enabled = pisugar.get_rtc_alarm_enabled()
-                if not enabled:
-                    return jsonify({"status": "none"})
-            except Exception:
-                pass
-            alarm_dt = pisugar.get_rtc_alarm_time()
-    except Exception as e:
+        alarm = pisugar.query("rtc_alarm_enabled", "rtc_alarm_time")
+    except OSError as e:
         print("[device] get_wakeup error:", e)
         return jsonify({
             "status": "error",
-            "message": f"PiSugar error: {e}"
-        }), 500
-    if alarm_dt is None:
+            "message": "PiSugar not connected"
+        }), 503
+    if (alarm["rtc_alarm_enabled"] or "").lower() == "false":
+        return jsonify({"status": "none"})
+    try:
+        alarm_dt = datetime.fromisoformat(alarm["rtc_alarm_time"])
+    except (TypeError, ValueError):
         return jsonify({"status": "none"})
     hour = int(alarm_dt.hour)
     minute = int(alarm_dt.minute)
@@ -368,45 +352,42 @@ def get_wakeup():
 
 @app.route("/api/battery", methods=["GET"])
 def api_battery():
-    if pisugar is None:
+    # level, charging, plugged, model and temperature are read together by the shared client, cached for a couple of seconds
+    try:
+        status = pisugar.status()
+    except OSError as e:
+        print("[device] api_battery error:", e)
         return jsonify({
             "status": "error",
             "message": "PiSugar not connected"
         }), 503
-    try:
-        if pisugar_lock is not None:
-            with pisugar_lock:
-                level = pisugar.get_battery_level()             # %
-                charging = pisugar.get_battery_charging()       # bool
-                plugged = pisugar.get_battery_power_plugged()   # bool
-                model = pisugar.get_model()                     # string
-                try:
-                    temp = pisugar.get_temperature()
-                except Exception:
-                    temp = None
-        else:
-            level = pisugar.get_battery_level()
-            charging = pisugar.get_battery_charging()
-            plugged = pisugar.get_battery_power_plugged()
-            model = pisugar.get_model()
-            try:
-                temp = pisugar.get_temperature()
-            except Exception:
-                temp = None
-        return jsonify({
-            "status": "ok",
-            "level": level,
-            "charging": charging,
-            "plugged": plugged,
-            "model": model,
-            "temperature": temp
-        })
     except Exception as e:
         print("[device] api_battery error:", e)
         return jsonify({
             "status": "error",
             "message": str(e)
         }), 500
+    return jsonify({
+        "status": "ok",
+        "level": status["level"],
+        "charging": status["charging"],
+        "plugged": status["plugged"],
+        "model": status["model"],
+        "temperature": status["temperature"]
+    })
+
+
+@app.route("/api/metrics", methods=["GET"])
+def api_metrics():
+    # The last N update runs from the metrics file, oldest first, ?n= picks how many
+    try:
+        count = max(1, min(int(request.args.get("n", METRICS_RUNS)), 500))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid n"}), 400
+    return jsonify({
+        "status": "ok",
+        "runs": metrics.last_runs(count)
+    })
 
 
 @app.route("/api/wifi/current", methods=["GET"])